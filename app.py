@@ -1,24 +1,46 @@
+import time
+
+IMPORTS_STARTED = time.perf_counter()
+
+# pylint: disable=wrong-import-position
+import argparse
 import asyncio
-import threading
+import signal
 
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect
 from sqlalchemy.exc import ProgrammingError
-from sqlalchemy_utils import database_exists, create_database
 from loguru import logger
 
 
 import loader
 import settings
+from utils.alert_history import ALERT_HISTORY
+from utils.alerts_cache import load_last_alerts
 from utils.alerts_ws import start_server
-from utils.telegram import send_alert
-from utils.binance import update_markets, receive_data_from_stream, create_streams
+from utils.check_log import CHECK_LOG
+from utils.metrics import start_metrics_server
+from utils.daily_volume import DAILY_VOLUMES
+from utils.recorder import KLINE_RECORDER
+from utils.resources import RESOURCES
+from utils.snapshot import STATE_SNAPSHOTS
+from utils.startup import STARTUP_PROFILE
+from utils.telegram import send_alert, TELEGRAM_DISPATCHER
+from utils.binance import update_markets, receive_data_from_stream, create_streams, receive_detector_results
+from utils.workers import start_detector_pool
 from settings import WS_IP, WS_PORT
 from db_utils.models import FutureAlert
-from db_utils.database import create_db
+from db_utils.database import create_db, create_columns, create_indexes, get_engine
+from db_utils.retention import run_retention
+from db_utils.writer import ALERT_WRITER
+
+STARTUP_PROFILE.imports_seconds = time.perf_counter() - IMPORTS_STARTED
+
 
+def check_database() -> None:
+    # slow import, only the startup needs it
+    from sqlalchemy_utils import database_exists, create_database  # pylint: disable=import-outside-toplevel
 
-def check_database(db_uri) -> None:
-    engine = create_engine(db_uri)
+    engine = get_engine()
 
     # check if database not exists
     if not database_exists(engine.url):
@@ -36,46 +58,141 @@ def check_database(db_uri) -> None:
             if not inspector.has_table(FutureAlert.__tablename__):
                 create_db()
                 logger.info("Create table")
+            else:
+                create_columns()
+                create_indexes()
         except ProgrammingError as exp:
             logger.error(f"Error in create table {exp}")
 
 
-def run_receive_data_from_stream():
-    asyncio.run(receive_data_from_stream())
+def prepare_database() -> None:
+    """
+    Creates the database and the table if they are missing and loads the last alerts, runs in a thread.
+    """
+    with STARTUP_PROFILE.step('database check'):
+        check_database()
+    with STARTUP_PROFILE.step('last alerts'):
+        load_last_alerts()
+        ALERT_HISTORY.load()
+
+
+async def startup() -> None:
+    """
+    Runs the startup steps, the independent ones concurrently: the database check and the alerts cache
+    (in a thread) along with the symbols, the streams and the backfill. Only the checks of the backfilled
+    klines wait for the alerts cache.
+    """
+    STARTUP_PROFILE.start()
+    async with asyncio.TaskGroup() as startup_group:
+        database_ready = startup_group.create_task(asyncio.to_thread(prepare_database))
+        streams = startup_group.create_task(STARTUP_PROFILE.measure('streams', create_streams(database_ready)))
+    loader.KLINE_STREAM_IDS = streams.result()
+    STARTUP_PROFILE.finish()
+    logger.info(f"Started in {STARTUP_PROFILE.imports_seconds + STARTUP_PROFILE.total_seconds:.2f}s")
+
+
+async def shutdown() -> None:
+    """
+    Stops the streams, takes the last state snapshot and flushes everything that is still queued
+    (alerts to the database and Telegram).
+    """
+    logger.info("Shutting down...")
+    if RESOURCES.is_created('BINANCE_WEBSOCKET_MANAGER'):
+        loader.BINANCE_WEBSOCKET_MANAGER.stop_manager_with_all_streams()
+
+    try:
+        await asyncio.wait_for(ALERT_WRITER.close(), settings.SHUTDOWN_TIMEOUT)
+        await asyncio.wait_for(TELEGRAM_DISPATCHER.close(), settings.SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error("Shutdown timeout, some queued alerts were not flushed")
 
+    if STATE_SNAPSHOTS is not None:
+        try:
+            await asyncio.wait_for(STATE_SNAPSHOTS.take(), settings.SHUTDOWN_TIMEOUT)
+        except Exception as exp:
+            logger.error(f"Last state snapshot {exp}")
 
-def run_update_markets():
-    asyncio.run(update_markets())
+    CHECK_LOG.close()
 
 
-async def main():
+async def keep_running(task: asyncio.Task) -> None:
+    """
+    Fails the task group if the task fails, but the task is not cancelled with the group.
+    """
+    await asyncio.shield(task)
+
+
+async def main(profile_startup: bool = False):
     """
     Main function to start the program.
 
     Notes:
-        - It runs two separate threads:
-        - One for updating symbols.
-        - One for receiving data from the stream.
+        - Everything runs on one event loop as tasks of a single task group:
+        - Receiving data from the stream and running the checks.
+        - Updating symbols and the 24h volume table.
+        - Alerts websocket server, metrics endpoint, alerts writer and Telegram dispatcher.
+        - Deleting the alerts older than ALERTS_RETENTION_DAYS.
+        - Recording the closed klines to disk (if RECORDER_DIR is set).
+        - Snapshots of the kline windows for the next start (if SNAPSHOT_FILE is set).
+        - If any task fails, or the process gets SIGINT/SIGTERM, the other tasks are cancelled
+          and the queues are flushed.
+        - With profile_startup the server stops after the startup and logs where the startup time went.
     """
 
-    await send_alert("start alert server")
-    check_database(settings.DATABASE)
-
-    loader.FIRST_KLINE_STREAM_ID, loader.SECOND_KLINE_STREAM_ID = await create_streams()
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
 
-    threading.Thread(target=run_receive_data_from_stream, daemon=True).start()  # Receive data from stream
-    threading.Thread(target=run_update_markets, daemon=True).start()
+    await send_alert("start alert server")
+    detector_pool = start_detector_pool()
+    # the results reader is not cancelled with the other tasks, the stopped workers end it (see DetectorPool.stop)
+    results_reader = asyncio.create_task(receive_detector_results()) if detector_pool is not None else None
 
-    tasks = [
-        asyncio.ensure_future(start_server(WS_IP, WS_PORT)),  # Alerts WS,
-    ]
-    await asyncio.gather(*tasks)
+    try:
+        async with asyncio.TaskGroup() as task_group:
+            # the dispatcher sends the hello while the server starts, the writer takes the alerts of the backfill
+            startup_tasks = [task_group.create_task(TELEGRAM_DISPATCHER.run()),
+                             task_group.create_task(ALERT_WRITER.run())]
+            await startup()
+            if profile_startup:
+                logger.info(STARTUP_PROFILE.report())
+                for task in startup_tasks:
+                    task.cancel()
+                return
+
+            task_group.create_task(receive_data_from_stream())  # Receive data from stream
+            if results_reader is not None:
+                task_group.create_task(keep_running(results_reader))
+            task_group.create_task(update_markets())
+            task_group.create_task(DAILY_VOLUMES.run(settings.DAILY_VOLUME_REFRESH_INTERVAL))
+            if settings.ALERTS_RETENTION_DAYS:
+                task_group.create_task(run_retention(settings.ALERTS_RETENTION_DAYS,
+                                                     settings.ALERTS_RETENTION_INTERVAL))
+            if KLINE_RECORDER is not None:
+                task_group.create_task(KLINE_RECORDER.run(settings.RECORDER_FLUSH_INTERVAL))
+            if STATE_SNAPSHOTS is not None:
+                task_group.create_task(STATE_SNAPSHOTS.run(settings.SNAPSHOT_INTERVAL))
+            task_group.create_task(start_server(WS_IP, WS_PORT))  # Alerts WS
+            if settings.METRICS_PORT:
+                task_group.create_task(start_metrics_server(WS_IP, settings.METRICS_PORT))
+    finally:
+        if detector_pool is not None:
+            # the reader gets the results still in flight and ends with the stop answers of the workers,
+            # before the queues are flushed
+            await detector_pool.stop()
+            await asyncio.wait([results_reader])
+        await shutdown()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Alert server')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='stop after the startup and log where the startup time went')
+    args = parser.parse_args()
+
+    loader.setup_logging()
     try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
+        asyncio.run(main(args.profile_startup))
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logger.info("Server stopped manually.")
     except Exception as e:
         logger.exception(e)
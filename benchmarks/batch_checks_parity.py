@@ -0,0 +1,132 @@
+"""
+Checks that the vectorized check engine (KlineMatrix) gives the same results as the scalar windows
+bit for bit, and compares their speed.
+
+Usage:
+    python -m benchmarks.batch_checks_parity --recording klines.jsonl
+    python -m benchmarks.batch_checks_parity --symbols 300 --ticks 500
+
+A recording is a JSON lines file with the stream payloads that event_adapter receives.
+Without a recording, synthetic klines with volume spikes and equal lows are generated.
+"""
+import argparse
+import os
+import random
+import time
+from itertools import groupby
+
+import ujson
+
+# the benchmark does not touch the database or Telegram
+os.environ.setdefault('DB_DATABASE', 'sqlite://')
+os.environ.setdefault('GROUP_ID', '0')
+
+# pylint: disable=wrong-import-position
+import settings
+from utils.batch_checks import KlineMatrix
+from utils.checks import check_window
+from utils.klines import KlineWindow
+
+
+def read_recording(path: str) -> list:
+    """
+    Reads closed klines from a recording and groups them into ticks by open time.
+    """
+    klines = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            data = ujson.loads(line)
+            event_data = data.get('data', None) if 'stream' in data else data
+            kline_data = (event_data or {}).get('k')
+            if kline_data and kline_data.get('x', False):
+                klines.append(kline_data)
+
+    klines.sort(key=lambda elem: elem['t'])
+    return [list(tick) for _, tick in groupby(klines, key=lambda elem: elem['t'])]
+
+
+def generate_ticks(symbols_count: int, ticks: int, seed: int = 1) -> list:
+    """
+    Generates closed 1m klines with prices rounded to a tick size (equal lows) and random volume spikes.
+    """
+    rnd = random.Random(seed)
+    prices = [rnd.uniform(0.1, 1000) for _ in range(symbols_count)]
+    bursts = []
+    for tick in range(ticks):
+        burst = []
+        for index in range(symbols_count):
+            price = prices[index] = prices[index] * rnd.uniform(0.995, 1.005)
+            spike = rnd.random() < 0.05
+            high = price * (rnd.uniform(1.03, 1.06) if spike else rnd.uniform(1, 1.01))
+            burst.append({
+                's': f'SYM{index}USDT', 't': tick * 60000, 'x': True,
+                'h': f'{high:.3g}', 'l': f'{price * rnd.uniform(0.995, 1):.3g}',
+                'q': str(rnd.uniform(1e6, 5e6) * (10 if spike else 1)),
+            })
+        bursts.append(burst)
+    return bursts
+
+
+def run_scalar(ticks: list, capacity: int) -> tuple:
+    windows = {}
+    candidates = []
+    elapsed = 0.0
+    for tick in ticks:
+        started = time.perf_counter()
+        for kline_data in tick:
+            window = windows.get(kline_data['s'])
+            if window is None:
+                window = windows[kline_data['s']] = KlineWindow(capacity)
+            window.append(kline_data)
+            if window.is_full():
+                result, log = check_window(window)
+                if result:
+                    candidates.append((kline_data['s'], window[-1], log))
+        elapsed += time.perf_counter() - started
+    return candidates, elapsed
+
+
+def run_vector(ticks: list, capacity: int) -> tuple:
+    matrix = KlineMatrix(capacity)
+    candidates = []
+    elapsed = 0.0
+    for tick in ticks:
+        started = time.perf_counter()
+        for kline_data in tick:
+            candidates.extend(matrix.add(kline_data))
+        candidates.extend(matrix.evaluate())
+        elapsed += time.perf_counter() - started
+    return candidates, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recording')
+    parser.add_argument('--symbols', type=int, default=300)
+    parser.add_argument('--ticks', type=int, default=500)
+    parser.add_argument('--capacity', type=int, default=settings.MAXIMUM_KLINES)
+    args = parser.parse_args()
+
+    ticks = read_recording(args.recording) if args.recording else generate_ticks(args.symbols, args.ticks)
+    klines_count = sum(len(tick) for tick in ticks)
+
+    scalar, scalar_time = run_scalar(ticks, args.capacity)
+    vector, vector_time = run_vector(ticks, args.capacity)
+
+    scalar = sorted(scalar, key=lambda elem: (elem[1].open_time, elem[0]))
+    vector = sorted(vector, key=lambda elem: (elem[1].open_time, elem[0]))
+    mismatches = [pair for pair in zip(scalar, vector) if pair[0] != pair[1]]
+
+    print(f"{klines_count} klines in {len(ticks)} ticks, window {args.capacity} klines")
+    print(f"scalar: {len(scalar)} candidates, {scalar_time:.3f}s ({klines_count / scalar_time:.0f} klines/s)")
+    print(f"vector: {len(vector)} candidates, {vector_time:.3f}s ({klines_count / vector_time:.0f} klines/s)")
+
+    if len(scalar) != len(vector) or mismatches:
+        for expected, actual in mismatches[:10]:
+            print(f"MISMATCH\n  scalar: {expected}\n  vector: {actual}")
+        raise SystemExit(1)
+    print("results are identical")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark of the detector worker pool: end-to-end detection latency of a minute-close burst
+(all symbols close their kline at once) in the main process and with 1..N worker processes.
+
+Usage:
+    python -m benchmarks.detector_workers --symbols 300 --ticks 60 --workers 1,2,4
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from statistics import fmean, quantiles
+
+# the benchmark does not touch the database or Telegram
+os.environ.setdefault('DB_DATABASE', 'sqlite://')
+os.environ.setdefault('GROUP_ID', '0')
+
+# pylint: disable=wrong-import-position
+import settings
+from utils.checks import check_window
+from utils.klines import KlineWindow
+from utils.workers import DetectorPool
+
+
+def generate_ticks(symbols_count: int, ticks: int, seed: int = 1) -> list:
+    """
+    Generates closed 1m klines: one burst with a kline of every symbol per tick.
+    """
+    rnd = random.Random(seed)
+    prices = [rnd.uniform(0.1, 1000) for _ in range(symbols_count)]
+    bursts = []
+    for tick in range(ticks):
+        burst = []
+        for index in range(symbols_count):
+            price = prices[index] = prices[index] * rnd.uniform(0.99, 1.01)
+            burst.append({
+                's': f'SYM{index}USDT', 't': tick * 60000, 'x': True,
+                'h': str(price * rnd.uniform(1, 1.02)), 'l': str(price * rnd.uniform(0.98, 1)),
+                'q': str(rnd.uniform(1e4, 1e7)),
+            })
+        bursts.append(burst)
+    return bursts
+
+
+def run_in_process(bursts: list, capacity: int) -> list:
+    windows = {}
+    latencies = []
+    for burst in bursts:
+        started = time.perf_counter()
+        for kline_data in burst:
+            window = windows.get(kline_data['s'])
+            if window is None:
+                window = windows[kline_data['s']] = KlineWindow(capacity)
+            window.append(kline_data)
+            if window.is_full():
+                check_window(window)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def run_pool(bursts: list, capacity: int, workers_count: int) -> list:
+    pool = DetectorPool(workers_count, capacity)
+    pool.start()
+    loop = asyncio.get_running_loop()
+    latencies = []
+    try:
+        for burst in bursts:
+            started = time.perf_counter()
+            for kline_data in burst:
+                pool.submit(kline_data)
+            pool.flush()
+
+            # the tick is detected when every worker has answered
+            while pool.in_flight:
+                worker_id, *_ = await loop.run_in_executor(None, pool.outbox.get)
+                pool.in_flight_by_worker[worker_id] -= 1
+            latencies.append(time.perf_counter() - started)
+    finally:
+        await pool.stop()
+    return latencies
+
+
+def report(name: str, latencies: list, klines_per_tick: int) -> None:
+    # the first ticks only fill the windows and warm up the workers
+    latencies = sorted(latencies[len(latencies) // 4:])
+    p50, p99 = quantiles(latencies, n=100)[49], quantiles(latencies, n=100)[98]
+    print(f"{name:<14} mean {fmean(latencies) * 1000:8.2f} ms   p50 {p50 * 1000:8.2f} ms   "
+          f"p99 {p99 * 1000:8.2f} ms   {klines_per_tick / fmean(latencies):12.0f} klines/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbols', type=int, default=300)
+    parser.add_argument('--ticks', type=int, default=60)
+    parser.add_argument('--capacity', type=int, default=settings.MAXIMUM_KLINES)
+    parser.add_argument('--workers', default=','.join(str(2 ** i) for i in range((os.cpu_count() or 1).bit_length())))
+    args = parser.parse_args()
+
+    bursts = generate_ticks(args.symbols, args.ticks)
+    print(f"{args.symbols} symbols, {args.ticks} ticks, window {args.capacity} klines, {os.cpu_count()} CPUs")
+
+    report('in-process', run_in_process(bursts, args.capacity), args.symbols)
+    for workers_count in (int(value) for value in args.workers.split(',')):
+        report(f'{workers_count} workers', asyncio.run(run_pool(bursts, args.capacity, workers_count)), args.symbols)
+
+
+if __name__ == '__main__':
+    main()
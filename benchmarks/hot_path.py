@@ -0,0 +1,404 @@
+"""
+Benchmark of the ingest-to-alert hot path, offline: synthetic kline streams go through the stream inbox,
+event_adapter, event_kline, the checks and event_alert to the websocket clients, a SQLite alerts table and
+a local fake Telegram API.
+
+Every minute of the synthetic market is a few kline updates of every symbol followed by the minute-boundary
+burst of the closed klines of all symbols, a share of them with a volume spike that alerts. The payloads are
+pushed into the stream inbox from a thread, like the websocket manager does.
+
+Reported per symbols count (each one runs in its own process, so the peak RSS is its own):
+    - throughput: stream payloads and closed klines per second of processing;
+    - tick latency: from the first closed kline of the burst pushed to the whole burst processed;
+    - tick-to-alert latency: from the burst pushed to the alert received by every websocket client;
+    - allocations: gc collections during the run and, with tracemalloc in a separate run, the peak
+      of the traced memory and the top allocation sites;
+    - peak RSS.
+
+The results are appended as JSON lines to --output and compared with the last run with the same parameters.
+
+Usage:
+    python -m benchmarks.hot_path --symbols 100,500,2000 --minutes 30 --clients 10
+    CHECK_ENGINE=vector python -m benchmarks.hot_path --symbols 2000 --output results.jsonl
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from statistics import quantiles
+
+import ujson
+
+# the alerts go to a SQLite file of the run, Telegram to a local fake API
+os.environ.setdefault('DB_DATABASE', f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='hot-path-'), 'alerts.db')}")
+os.environ.setdefault('GROUP_ID', '0')
+
+# pylint: disable=wrong-import-position
+from loguru import logger
+
+from utils.replay import FixedDailyVolumes
+
+KLINE_INTERVAL_MS = 60_000
+
+
+def generate_minutes(symbols_count: int, minutes: int, updates: int, spike_rate: float, seed: int = 1) -> list:
+    """
+    Generates the stream payloads of every minute of a synthetic market.
+
+    Args:
+        symbols_count: The number of symbols.
+        minutes: The number of minutes.
+        updates: Kline updates (not closed) of every symbol per minute before the close.
+        spike_rate: Share of the closed klines with a volume and price spike that passes the checks.
+
+    Returns:
+        list of (open time, updates payloads, closed klines payloads) per minute
+    """
+    rnd = random.Random(seed)
+    symbols = [f'SYM{index}USDT' for index in range(symbols_count)]
+    prices = [rnd.uniform(0.1, 1000) for _ in symbols]
+    start = int(time.time() * 1000) // KLINE_INTERVAL_MS * KLINE_INTERVAL_MS - minutes * KLINE_INTERVAL_MS
+
+    def payload(symbol: str, kline: dict) -> dict:
+        return {"stream": f"{symbol.lower()}@kline_1m", "data": {"e": "kline", "s": symbol, "k": kline}}
+
+    result = []
+    for minute in range(minutes):
+        open_time = start + minute * KLINE_INTERVAL_MS
+        minute_updates, closes = [], []
+        for index, symbol in enumerate(symbols):
+            price = prices[index]
+            low, high = price * rnd.uniform(0.995, 1), price * rnd.uniform(1, 1.005)
+            volume = rnd.uniform(1e5, 5e5)
+            if rnd.random() < spike_rate:
+                high, volume = price * 1.05, 5e6
+
+            for update in range(1, updates + 1):
+                minute_updates.append(payload(symbol, {
+                    "t": open_time, "s": symbol, "i": "1m", "x": False, "o": str(price), "c": str(price),
+                    "h": str(high), "l": str(low), "q": str(volume * update / (updates + 1)),
+                }))
+            closes.append(payload(symbol, {
+                "t": open_time, "s": symbol, "i": "1m", "x": True, "o": str(price), "c": str(price),
+                "h": str(high), "l": str(low), "q": str(volume),
+            }))
+        result.append((open_time, minute_updates, closes))
+    return result
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeTelegramApi:
+    """
+    Local HTTP server that answers every request like sendMessage of the Bot API.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._handle, host='127.0.0.1', port=0)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f'http://{host}:{port}'
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        body = b'{"ok":true,"result":{}}'
+        try:
+            while await reader.readline():
+                length = 0
+                while (line := await reader.readline()).strip():
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.lower() == 'content-length':
+                        length = int(value)
+                await reader.readexactly(length)
+                self.messages += 1
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def websocket_client(url: str, burst_times: dict, latencies: list) -> None:
+    """
+    Receives the alerts like a client of the alerts websocket and measures their latency from the burst.
+    """
+    import websockets  # pylint: disable=import-outside-toplevel
+    async with websockets.connect(url, max_queue=None) as websocket:
+        async for message in websocket:
+            received = time.perf_counter()
+            data = ujson.loads(message)
+            if data.get('event') == 'Alert' and data.get('t') in burst_times:
+                latencies.append(received - burst_times[data['t']])
+
+
+def percentile_ms(values: list, percentile: int) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0] * 1000
+    return quantiles(values, n=100)[percentile - 1] * 1000
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return 0.0
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+async def run(args) -> dict:
+    """
+    Runs the whole server pipeline on the synthetic market of args.symbols symbols.
+    """
+    # pylint: disable=import-outside-toplevel
+    import settings
+    import utils.binance
+    import utils.workers
+    from db_utils.database import create_db
+    from db_utils.writer import ALERT_WRITER
+    from utils.alerts_ws import start_server
+    from utils.ingest import STREAM_INBOX
+    from utils.telegram import TELEGRAM_DISPATCHER
+
+    create_db()
+    minutes = generate_minutes(args.symbols, args.minutes, args.updates, args.spike_rate)
+    utils.binance.DAILY_VOLUMES = FixedDailyVolumes(float('inf'))
+
+    telegram = FakeTelegramApi()
+    TELEGRAM_DISPATCHER.base_url = await telegram.start()
+    TELEGRAM_DISPATCHER.min_interval = 0
+    TELEGRAM_DISPATCHER.coalesce_delay = 0
+    # like the start message of the server: the client is created before the first alert
+    await TELEGRAM_DISPATCHER.send("start benchmark")
+    telegram.messages = 0
+
+    # stream batches processed, the producer waits for them before the next burst
+    processed = 0
+    drained = asyncio.Event()
+    target = 0
+    event_batch = utils.binance.event_batch
+
+    async def counted_event_batch(batch: list):
+        nonlocal processed
+        await event_batch(batch)
+        processed += len(batch)
+        if processed >= target:
+            drained.set()
+
+    utils.binance.event_batch = counted_event_batch
+
+    detector_pool = utils.workers.start_detector_pool()
+    port = free_port()
+    tasks = [
+        asyncio.create_task(utils.binance.receive_data_from_stream()),
+        asyncio.create_task(ALERT_WRITER.run()),
+        asyncio.create_task(TELEGRAM_DISPATCHER.run()),
+        asyncio.create_task(start_server('127.0.0.1', port)),
+    ]
+    # the results reader is not cancelled with the other tasks, the stopped workers end it (see DetectorPool.stop)
+    results_reader = asyncio.create_task(utils.binance.receive_detector_results()) \
+        if detector_pool is not None else None
+
+    burst_times, alert_latencies = {}, []
+    await asyncio.sleep(0.2)
+    clients = [asyncio.create_task(websocket_client(f'ws://127.0.0.1:{port}', burst_times, alert_latencies))
+               for _ in range(args.clients)]
+    await asyncio.sleep(0.2)
+
+    def push_all(payloads: list) -> None:
+        for payload in payloads:
+            STREAM_INBOX.push(payload)
+
+    async def push(payloads: list, open_time: int = None) -> float:
+        nonlocal target
+        target += len(payloads)
+        drained.clear()
+        started = time.perf_counter()
+        if open_time is not None:
+            # before the push: the first alerts may reach the clients before the whole burst is processed
+            burst_times[open_time] = started
+        await asyncio.to_thread(push_all, payloads)
+        await drained.wait()
+        return started
+
+    if args.allocations:
+        tracemalloc.start(10)
+        snapshot_before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+    gc_before = sum(stats['collections'] for stats in gc.get_stats())
+    tick_latencies, busy = [], 0.0
+    for open_time, minute_updates, closes in minutes:
+        started = await push(minute_updates)
+        busy += time.perf_counter() - started
+
+        started = await push(closes, open_time)
+        tick_latencies.append(time.perf_counter() - started)
+        busy += tick_latencies[-1]
+        if args.interval:
+            await asyncio.sleep(args.interval)
+
+    gc_collections = sum(stats['collections'] for stats in gc.get_stats()) - gc_before
+    allocations = {}
+    if args.allocations:
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        top = tracemalloc.take_snapshot().compare_to(snapshot_before, 'lineno')[:5]
+        tracemalloc.stop()
+        allocations = {"alloc_peak_kb": peak / 1024,
+                       "top_allocations": [f"{stat.traceback[0]} {stat.size_diff / 1024:+.1f} KiB" for stat in top]}
+
+    # let the last alerts reach the clients, the database and Telegram
+    await asyncio.sleep(0.5)
+    if detector_pool is not None:
+        await detector_pool.stop()
+        await asyncio.wait([results_reader])
+    await ALERT_WRITER.close()
+    for task in tasks + clients:
+        task.cancel()
+    await asyncio.gather(*tasks, *clients, return_exceptions=True)
+    await TELEGRAM_DISPATCHER.close()
+
+    # the first minutes only fill the windows
+    steady = tick_latencies[settings.MAXIMUM_KLINES:] or tick_latencies
+    payloads = sum(len(minute_updates) + len(closes) for _, minute_updates, closes in minutes)
+    return {
+        "symbols": args.symbols,
+        "payloads": payloads,
+        "payloads_per_second": payloads / busy,
+        "klines_per_second": args.symbols * args.minutes / sum(tick_latencies),
+        "tick_p50_ms": percentile_ms(steady, 50),
+        "tick_p99_ms": percentile_ms(steady, 99),
+        "alert_p50_ms": percentile_ms(alert_latencies, 50),
+        "alert_p99_ms": percentile_ms(alert_latencies, 99),
+        "alerts": ALERT_WRITER.submitted,
+        "ws_messages": len(alert_latencies),
+        "db_written": ALERT_WRITER.written,
+        "telegram_messages": telegram.messages,
+        "gc_collections": gc_collections,
+        "peak_rss_mb": peak_rss_mb(),
+        **allocations,
+    }
+
+
+def run_child(args, symbols: int, allocations: bool) -> dict:
+    """
+    Runs one symbols count in a new process and returns its result.
+    """
+    command = [sys.executable, '-m', 'benchmarks.hot_path', '--child', '--symbols', str(symbols),
+               '--minutes', str(args.minutes), '--updates', str(args.updates), '--spike-rate', str(args.spike_rate),
+               '--clients', str(args.clients), '--interval', str(args.interval)]
+    if allocations:
+        command.append('--allocations')
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return ujson.loads(output.strip().splitlines()[-1])
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def previous_results(path: str, params: dict) -> dict:
+    """
+    Results of the last run with the same parameters in the results file, by symbols count.
+    """
+    previous = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                entry = ujson.loads(line)
+                if entry.get('params') == params:
+                    previous[entry['symbols']] = entry
+    return previous
+
+
+def report(result: dict, previous: dict) -> None:
+    def change(key: str) -> str:
+        if previous is None or not previous.get(key):
+            return ''
+        return f" ({(result[key] / previous[key] - 1) * 100:+.0f}%)"
+
+    print(f"{result['symbols']:>5} symbols  "
+          f"{result['payloads_per_second']:10.0f} payloads/s{change('payloads_per_second')}  "
+          f"{result['klines_per_second']:9.0f} klines/s{change('klines_per_second')}")
+    print(f"       tick p50 {result['tick_p50_ms']:8.2f} ms{change('tick_p50_ms')}  "
+          f"p99 {result['tick_p99_ms']:8.2f} ms{change('tick_p99_ms')}   "
+          f"tick-to-alert p50 {result['alert_p50_ms']:8.2f} ms{change('alert_p50_ms')}  "
+          f"p99 {result['alert_p99_ms']:8.2f} ms{change('alert_p99_ms')}")
+    print(f"       {result['alerts']} alerts, {result['ws_messages']} delivered to clients, "
+          f"{result['db_written']} written, {result['telegram_messages']} telegram messages, "
+          f"{result['gc_collections']} gc collections, peak RSS {result['peak_rss_mb']:.0f} MB{change('peak_rss_mb')}")
+    if 'alloc_peak_kb' in result:
+        print(f"       traced allocations peak {result['alloc_peak_kb']:.0f} KiB{change('alloc_peak_kb')}")
+        for line in result['top_allocations']:
+            print(f"         {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbols', default='100,500,2000', help='comma separated symbols counts')
+    parser.add_argument('--minutes', type=int, default=30)
+    parser.add_argument('--updates', type=int, default=4, help='kline updates of every symbol per minute')
+    parser.add_argument('--spike-rate', type=float, default=0.01, help='share of the closed klines that alert')
+    parser.add_argument('--clients', type=int, default=10, help='websocket clients')
+    parser.add_argument('--interval', type=float, default=0, help='pause between the minutes (seconds)')
+    parser.add_argument('--no-allocations', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--output', default='hot_path_results.jsonl', help='JSON lines file the results go to')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--allocations', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+        args.symbols = int(args.symbols)
+        print(ujson.dumps(asyncio.run(run(args))))
+        return
+
+    import settings  # pylint: disable=import-outside-toplevel
+    params = {"minutes": args.minutes, "updates": args.updates, "spike_rate": args.spike_rate,
+              "clients": args.clients, "interval": args.interval, "check_engine": settings.CHECK_ENGINE,
+              "detector_workers": settings.DETECTOR_WORKERS, "timeframes": settings.TIMEFRAMES,
+              "strategies_file": settings.STRATEGIES_FILE}
+    previous = previous_results(args.output, params)
+    print(f"{args.minutes} minutes, {args.updates} updates per symbol and minute, {args.clients} websocket clients, "
+          f"check engine {settings.CHECK_ENGINE}, commit {git_commit() or '-'}")
+
+    for symbols in (int(value) for value in args.symbols.split(',')):
+        result = run_child(args, symbols, allocations=False)
+        if not args.no_allocations:
+            allocations = run_child(args, symbols, allocations=True)
+            result.update(alloc_peak_kb=allocations['alloc_peak_kb'], top_allocations=allocations['top_allocations'])
+        report(result, previous.get(symbols))
+
+        entry = {"time": datetime.now().isoformat(timespec='seconds'), "commit": git_commit(),
+                 "python": sys.version.split()[0], "params": params, **result}
+        with open(args.output, 'a', encoding='utf-8') as file:
+            file.write(ujson.dumps(entry) + '\n')
+
+
+if __name__ == '__main__':
+    main()
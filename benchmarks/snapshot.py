@@ -0,0 +1,146 @@
+"""
+Benchmark of the state snapshots: the time a snapshot blocks the event loop (copy), the write time in the
+thread, the file size and the restore time at startup, for the kline windows of N symbols. The restored
+windows are checked to be the same as the snapshotted ones.
+
+Usage:
+    python -m benchmarks.snapshot --symbols 2000
+    CHECK_ENGINE=vector TIMEFRAMES=5m,15m python -m benchmarks.snapshot --symbols 2000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from statistics import fmean
+
+# the benchmark does not touch the database or Telegram
+os.environ.setdefault('DB_DATABASE', 'sqlite://')
+os.environ.setdefault('GROUP_ID', '0')
+
+# pylint: disable=wrong-import-position
+from benchmarks.detector_workers import generate_ticks
+
+
+def fill_state(bursts: list) -> list:
+    """
+    Puts the klines into the windows of the check engine and of the higher timeframes, the same way as the live
+    stream does.
+    """
+    # pylint: disable=import-outside-toplevel
+    import loader
+    from utils.backfill import KLINE_SEQUENCE
+    from utils.batch_checks import KLINE_MATRIX
+    from utils.klines import new_window
+    from utils.timeframes import TIMEFRAMES
+
+    for burst in bursts:
+        for kline_data in burst:
+            KLINE_SEQUENCE.accept(kline_data)
+            if KLINE_MATRIX is not None:
+                KLINE_MATRIX.add(kline_data)
+            else:
+                window = loader.KLINES_DATA.get(kline_data['s'])
+                if window is None:
+                    window = loader.KLINES_DATA[kline_data['s']] = new_window()
+                window.append(kline_data)
+            for timeframe in TIMEFRAMES:
+                timeframe.aggregator.add(kline_data)
+        if KLINE_MATRIX is not None:
+            KLINE_MATRIX.evaluate()
+    return sorted({kline_data['s'] for kline_data in bursts[0]})
+
+
+def state_of(symbols: list) -> dict:
+    # pylint: disable=import-outside-toplevel
+    import loader
+    from utils.batch_checks import KLINE_MATRIX
+    from utils.timeframes import TIMEFRAMES
+
+    state = {}
+    for symbol in symbols:
+        if KLINE_MATRIX is not None:
+            row = KLINE_MATRIX.rows[symbol]
+            count, head = int(KLINE_MATRIX.counts[row]), int(KLINE_MATRIX.heads[row])
+            slots = [(head - count + index) % KLINE_MATRIX.capacity for index in range(count)]
+            state[symbol] = [(*KLINE_MATRIX.data[row, slot].tolist(), *KLINE_MATRIX.limbs[row, slot].tolist())
+                             for slot in slots]
+        else:
+            state[symbol] = [tuple(column) for column in loader.KLINES_DATA[symbol].columns()]
+        for timeframe in TIMEFRAMES:
+            window = timeframe.aggregator.windows.get(symbol)
+            partial = timeframe.aggregator.partials.get(symbol)
+            state[symbol, timeframe.interval] = (
+                [tuple(column) for column in window.columns()] if window else None,
+                (partial.open_time, partial.first_open_time, partial.high, partial.low, partial.quote_volume,
+                 partial.count)
+                if partial else None,
+            )
+    return state
+
+
+def clear_state() -> None:
+    # pylint: disable=import-outside-toplevel
+    import loader
+    from utils.backfill import KLINE_SEQUENCE
+    from utils.batch_checks import KLINE_MATRIX
+    from utils.timeframes import TIMEFRAMES
+
+    loader.KLINES_DATA.clear()
+    KLINE_SEQUENCE.last_open_times.clear()
+    if KLINE_MATRIX is not None:
+        for symbol in list(KLINE_MATRIX.rows):
+            KLINE_MATRIX.forget(symbol)
+    for timeframe in TIMEFRAMES:
+        timeframe.aggregator.partials.clear()
+        timeframe.aggregator.windows.clear()
+
+
+async def run(args) -> None:
+    # pylint: disable=import-outside-toplevel
+    import settings
+    from utils.snapshot import StateSnapshots
+    from utils.timeframes import TIMEFRAMES
+
+    # the last minutes, so none of the klines is too old to be restored
+    bursts = generate_ticks(args.symbols, args.minutes)
+    start = int(time.time() * 1000) // 60000 * 60000 - args.minutes * 60000
+    for burst in bursts:
+        for kline_data in burst:
+            kline_data['t'] += start
+            kline_data['o'] = kline_data['c'] = kline_data['l']
+    symbols = fill_state(bursts)
+    expected = state_of(symbols)
+
+    path = os.path.join(tempfile.mkdtemp(prefix='snapshot-'), 'state.npz')
+    snapshots = StateSnapshots(path, TIMEFRAMES)
+    captures, writes = [], []
+    for _ in range(args.repeat):
+        await snapshots.take()
+        captures.append(snapshots.last_capture_seconds)
+        writes.append(snapshots.last_write_seconds)
+
+    clear_state()
+    restored = snapshots.restore(symbols, settings.MAXIMUM_KLINES)
+    same = state_of(symbols) == expected
+
+    print(f"{args.symbols} symbols, window {settings.MAXIMUM_KLINES} klines, engine {settings.CHECK_ENGINE}, "
+          f"timeframes {settings.TIMEFRAMES or '-'}")
+    print(f"  copy in the event loop {fmean(captures) * 1000:8.2f} ms (max {max(captures) * 1000:.2f} ms)")
+    print(f"  write in the thread    {fmean(writes) * 1000:8.2f} ms (max {max(writes) * 1000:.2f} ms)")
+    print(f"  snapshot size          {snapshots.last_size / 1024:8.1f} KiB")
+    print(f"  restore                {snapshots.restore_seconds * 1000:8.2f} ms, {len(restored)} symbols, "
+          f"{'same state' if same else 'STATE DIFFERS'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbols', type=int, default=2000)
+    parser.add_argument('--minutes', type=int, default=30, help='klines generated per symbol')
+    parser.add_argument('--repeat', type=int, default=10, help='snapshots taken')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
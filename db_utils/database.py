@@ -1,23 +1,70 @@
-from sqlalchemy import create_engine
+
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import Session as OrmSession, sessionmaker, scoped_session
 
 from settings import DATABASE
+from utils.resources import RESOURCES
 
 db_string = DATABASE
 
-db = create_engine(db_string)
+RESOURCES.register('db', lambda: create_engine(db_string))
 base = declarative_base()
 
-Session = sessionmaker(db)
+
+def get_engine():
+    """
+    The shared engine of the database, created on first use.
+    """
+    return RESOURCES.get('db')
+
+
+class LazySession(OrmSession):
+    """
+    Session bound to the shared engine, so the engine is created by the first session, not at import.
+    """
+
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind if bind is not None else get_engine(), **kwargs)
+
+
+Session = sessionmaker(class_=LazySession)
 session = scoped_session(Session)
 
 base.query = session.query_property()
 
 
 def create_db():
-    base.metadata.create_all(db)
+    base.metadata.create_all(get_engine())
+
+
+def create_columns():
+    """
+    Adds the columns that are missing in the existing tables, with their server defaults for the old rows.
+    """
+    engine = get_engine()
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                default = f" DEFAULT '{column.server_default.arg}'" if column.server_default is not None else ''
+                nullable = '' if column.nullable else ' NOT NULL'
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                                           f'{default}{nullable}')
+
+
+def create_indexes():
+    """
+    Creates the indexes that are missing in the existing tables.
+    """
+    for table in base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(get_engine(), checkfirst=True)
 
 
 def delete_tables():
-    base.metadata.drop_all(db)
+    base.metadata.drop_all(get_engine())
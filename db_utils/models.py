@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, func
+from sqlalchemy import Column, Index, String, Integer, func
 from sqlalchemy.dialects.postgresql import TIMESTAMP
 
 from db_utils.database import base, session
@@ -6,10 +6,20 @@ from db_utils.database import base, session
 
 class FutureAlert(base):
     __tablename__ = 'alerts'
+    __table_args__ = (
+        # last alerts of a symbol (time passed, history by symbol)
+        Index('ix_alerts_future_date_time', 'future', 'date_time'),
+        # history since a time and the retention
+        Index('ix_alerts_date_time', 'date_time'),
+    )
 
     alert_id = Column(Integer, primary_key=True)
     future = Column(String)
     date_time = Column(TIMESTAMP)
+    # strategy of the alert, every strategy has its own cooldown (see utils.strategies)
+    strategy = Column(String, nullable=False, server_default='default')
+    # timeframe of the candle of the alert, '1m' or a higher timeframe (see utils.timeframes)
+    timeframe = Column(String, nullable=False, server_default='1m')
 
     def __str__(self):
         return f"{self.date_time}"
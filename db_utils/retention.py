@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from loguru import logger
+
+from db_utils.database import Session
+from db_utils.models import FutureAlert
+
+
+def delete_expired_alerts(retention_days: int, batch_size: int = 10000) -> int:
+    """
+    Deletes the alerts older than retention_days in batches, so every transaction stays short.
+
+    Returns:
+        number of deleted alerts
+    """
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        with Session() as db_session:
+            expired_ids = (
+                db_session.query(FutureAlert.alert_id)
+                .filter(FutureAlert.date_time < cutoff)
+                .limit(batch_size)
+            )
+            count = (
+                db_session.query(FutureAlert)
+                .filter(FutureAlert.alert_id.in_(expired_ids.scalar_subquery()))
+                .delete(synchronize_session=False)
+            )
+            db_session.commit()
+
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+async def run_retention(retention_days: int, interval: float) -> None:
+    """
+    Deletes the expired alerts every interval seconds.
+
+    Note:
+        - This function runs indefinitely in a loop.
+    """
+    while True:
+        try:
+            deleted = await asyncio.to_thread(delete_expired_alerts, retention_days)
+            if deleted:
+                logger.info(f"Deleted {deleted} alerts older than {retention_days} days")
+        except Exception as exp:
+            logger.error(f'Delete expired alerts {exp}')
+
+        await asyncio.sleep(interval)
+
+
+__all__ = ['delete_expired_alerts', 'run_retention']
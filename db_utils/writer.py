@@ -0,0 +1,131 @@
+import asyncio
+import time
+from datetime import datetime
+
+from loguru import logger
+from sqlalchemy import insert
+
+import settings
+from db_utils.database import Session
+from db_utils.models import FutureAlert
+from utils.metrics import REGISTRY, DB_COMMIT_SECONDS
+
+
+class AlertWriter:
+    """
+    Persists alerts in the background.
+
+    Alerts are put on a bounded asyncio queue and inserted by the writer task with one multi-row
+    INSERT per batch. A batch is written when it reaches batch_size alerts or when flush_interval
+    seconds have passed since its first alert. The blocking commit runs in a worker thread, so the
+    event loop is never blocked by Postgres.
+    """
+
+    def __init__(self, queue_size: int, batch_size: int, flush_interval: float):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._batch = []
+
+        # metrics
+        self.submitted = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.backpressure_waits = 0
+        self.max_queue_depth = 0
+        self.last_flush_seconds = 0.0
+
+    async def submit(self, symbol: str, date_time: datetime, strategy: str = 'default',
+                     timeframe: str = '1m') -> None:
+        """
+        Puts the alert on the queue, waiting for free space if the writer falls behind.
+        """
+        if self.queue.full():
+            self.backpressure_waits += 1
+            logger.warning(f"Alert writer queue is full ({self.queue.maxsize}), waiting for the writer")
+
+        await self.queue.put({"future": symbol, "date_time": date_time, "strategy": strategy,
+                              "timeframe": timeframe})
+        self.submitted += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    async def run(self) -> None:
+        """
+        Collects alerts from the queue into batches and writes them until cancelled.
+        """
+        logger.info("Alert writer started!")
+        while True:
+            self._batch.append(await self.queue.get())
+            deadline = time.monotonic() + self.flush_interval
+
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # a batch handed over to the thread is written even if the task is cancelled meanwhile
+            batch, self._batch = self._batch, []
+            await asyncio.to_thread(self._write, batch)
+
+    async def close(self) -> None:
+        """
+        Writes the collected batch and everything that is still in the queue.
+        """
+        batch = self._drain()
+        if batch:
+            await asyncio.to_thread(self._write, batch)
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "backpressure_waits": self.backpressure_waits,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
+
+    def _drain(self) -> list:
+        batch, self._batch = self._batch, []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    def _write(self, batch: list) -> None:
+        started = time.perf_counter()
+        try:
+            with Session() as db_session:
+                db_session.execute(insert(FutureAlert), batch)
+                db_session.commit()
+            self.written += len(batch)
+        except Exception as exp:
+            self.failed += len(batch)
+            logger.error(f"Error in write {len(batch)} alerts - {exp}")
+
+        self.batches += 1
+        self.last_flush_seconds = time.perf_counter() - started
+        DB_COMMIT_SECONDS.observe(self.last_flush_seconds)
+        logger.info(f"Alert writer flushed {len(batch)} alerts in {self.last_flush_seconds:.3f}s {self.stats()}")
+
+
+ALERT_WRITER = AlertWriter(
+    queue_size=settings.ALERT_WRITER_QUEUE_SIZE,
+    batch_size=settings.ALERT_WRITER_BATCH_SIZE,
+    flush_interval=settings.ALERT_WRITER_FLUSH_INTERVAL,
+)
+REGISTRY.collect('alert_server_db_queue_depth', 'Alerts waiting to be written', lambda: ALERT_WRITER.queue.qsize())
+REGISTRY.collect('alert_server_db_written_total', 'Alerts written to the database',
+                 lambda: ALERT_WRITER.written, kind='counter')
+REGISTRY.collect('alert_server_db_failed_total', 'Alerts not written because of an error',
+                 lambda: ALERT_WRITER.failed, kind='counter')
+REGISTRY.collect('alert_server_db_backpressure_total', 'Alerts that waited for free space in the queue',
+                 lambda: ALERT_WRITER.backpressure_waits, kind='counter')
+
+__all__ = ['AlertWriter', 'ALERT_WRITER']
@@ -1,26 +1,60 @@
 import os
 
 from loguru import logger
-from aio_binance.futures.usdt import Client
-from unicorn_binance_rest_api import BinanceRestApiManager
-from unicorn_binance_websocket_api import BinanceWebSocketApiManager
 
-BINANCE_API_CLIENT = BinanceRestApiManager(exchange="binance.com-futures")
-AIO_BINANCE_API_CLIENT = Client(show_limit_usage=True)
-BINANCE_WEBSOCKET_MANAGER = BinanceWebSocketApiManager(exchange="binance.com-futures")
+import settings
+from utils.resources import RESOURCES
+
 KLINES_DATA = {}
 
-FIRST_KLINE_STREAM_ID = ""
-SECOND_KLINE_STREAM_ID = ""
+KLINE_STREAM_IDS = []
 
 log_folder = "./logs"
-os.makedirs(log_folder, exist_ok=True)
 
-logger.add(f"{log_folder}/file_{{time:DD-MM}}_{{time:HH-mm}}.log", rotation="100 MB", retention="1 day",
-           encoding='utf-8')
+
+def create_rest_api_client():
+    from unicorn_binance_rest_api import BinanceRestApiManager  # pylint: disable=import-outside-toplevel
+    return BinanceRestApiManager(exchange="binance.com-futures")
+
+
+def create_aio_api_client():
+    from aio_binance.futures.usdt import Client  # pylint: disable=import-outside-toplevel
+    return Client(show_limit_usage=True)
+
+
+def create_websocket_manager():
+    from unicorn_binance_websocket_api import BinanceWebSocketApiManager  # pylint: disable=import-outside-toplevel
+    return BinanceWebSocketApiManager(exchange="binance.com-futures")
+
+
+# the exchange clients are created on the first access, e.g. loader.BINANCE_WEBSOCKET_MANAGER
+CLIENTS = {
+    'BINANCE_API_CLIENT': create_rest_api_client,
+    'AIO_BINANCE_API_CLIENT': create_aio_api_client,
+    'BINANCE_WEBSOCKET_MANAGER': create_websocket_manager,
+}
+for client_name, client_factory in CLIENTS.items():
+    RESOURCES.register(client_name, client_factory)
+
+
+def __getattr__(name):
+    if name in CLIENTS:
+        return RESOURCES.get(name)
+    raise AttributeError(f"module 'loader' has no attribute '{name}'")
+
+
+def setup_logging() -> None:
+    """
+    Adds the log file sink, only the server writes the log file.
+    """
+    os.makedirs(log_folder, exist_ok=True)
+    logger.add(f"{log_folder}/file_{{time:DD-MM}}_{{time:HH-mm}}.log", rotation="100 MB", retention="1 day",
+               encoding='utf-8', enqueue=settings.LOG_ENQUEUE)
+
 
 __all__ = [
     'BINANCE_API_CLIENT', 'BINANCE_WEBSOCKET_MANAGER',
-    'FIRST_KLINE_STREAM_ID', 'SECOND_KLINE_STREAM_ID',
+    'KLINE_STREAM_IDS',
     'KLINES_DATA', 'AIO_BINANCE_API_CLIENT',
-]
\ No newline at end of file
+    'setup_logging',
+]
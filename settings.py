@@ -5,12 +5,38 @@ load_dotenv()
 
 # Application
 UPDATE_SYMBOLS_COOLDOWN = 300
+MAX_SUBSCRIPTIONS_PER_STREAM = int(os.getenv('MAX_SUBSCRIPTIONS_PER_STREAM', '200'))
+MIN_KLINE_STREAMS = int(os.getenv('MIN_KLINE_STREAMS', '2'))
+SHUTDOWN_TIMEOUT = 10  # In seconds
+INGEST_MAX_BATCH = int(os.getenv('INGEST_MAX_BATCH', '1000'))
+LOG_ENQUEUE = bool(int(os.getenv('LOG_ENQUEUE', '1')))  # 1 - the log file is written by a background thread
+CHECK_LOG_SAMPLE_RATE = float(os.getenv('CHECK_LOG_SAMPLE_RATE', '1'))  # share of logged evaluations without alert
+CHECK_RECORDS_FILE = os.getenv('CHECK_RECORDS_FILE', '')  # JSON lines with every evaluation, empty - not written
+CHECK_ENGINE = os.getenv('CHECK_ENGINE', 'scalar')  # scalar - window per symbol, vector - NumPy matrix of all symbols
+DETECTOR_WORKERS = os.getenv('DETECTOR_WORKERS', '0')  # 0 - checks in the main process, 'auto' - one per CPU
+DAILY_VOLUME_REFRESH_INTERVAL = int(os.getenv('DAILY_VOLUME_REFRESH_INTERVAL', '60'))  # In seconds
+DAILY_VOLUME_MAX_AGE = int(os.getenv('DAILY_VOLUME_MAX_AGE', '300'))  # In seconds
+BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', '20'))  # 0 - windows are not backfilled at startup
+BACKFILL_WEIGHT_PER_MINUTE = int(os.getenv('BACKFILL_WEIGHT_PER_MINUTE', '1200'))
+RECORDER_DIR = os.getenv('RECORDER_DIR', '')  # empty - closed klines are not recorded
+RECORDER_RETENTION_DAYS = int(os.getenv('RECORDER_RETENTION_DAYS', '7'))
+RECORDER_FLUSH_INTERVAL = float(os.getenv('RECORDER_FLUSH_INTERVAL', '5'))  # In seconds
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', '')  # state snapshot restored at startup, empty - no snapshots
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', '60'))  # In seconds
 
 # WS Server
 WS_IP = os.getenv('WS_IP', '127.0.0.1')
 WS_PORT = int(os.getenv('WS_PORT', 8004))
+WS_CLIENT_QUEUE_SIZE = int(os.getenv('WS_CLIENT_QUEUE_SIZE', '100'))
+WS_SLOW_CLIENT_POLICY = os.getenv('WS_SLOW_CLIENT_POLICY', 'drop_oldest')  # drop_oldest or evict
+WS_COMPRESSION = os.getenv('WS_COMPRESSION', 'deflate')  # permessage-deflate offered to the clients, empty - off
+METRICS_PORT = int(os.getenv('METRICS_PORT', '8005'))  # 0 - metrics are not served
+ALERT_HISTORY_SIZE = int(os.getenv('ALERT_HISTORY_SIZE', '1000'))  # recent alerts kept in memory for the clients
+ALERT_HISTORY_MAX_RESULTS = int(os.getenv('ALERT_HISTORY_MAX_RESULTS', '500'))  # alerts per history response
 
 # Strategy
+STRATEGIES_FILE = os.getenv('STRATEGIES_FILE', '')  # JSON, empty - one strategy with the thresholds below
+TIMEFRAMES = os.getenv('TIMEFRAMES', '')  # higher timeframes checked besides 1m, e.g. 5m,15m,1h
 MAXIMUM_KLINES = int(os.getenv('STRATEGY_MAXIMUM_KLINES', '10'))
 AVG_INCREASE = float(os.getenv('STRATEGY_VOLUME_AVG_INCREASE', '3500000'))
 VOLUME_MULTIPLE = float(os.getenv('STRATEGY_VOLUME_MULTIPLE', '3.5'))
@@ -21,8 +47,17 @@ MIN_DAILY_VOLUME = int(os.getenv('STRATEGY_MIN_DAILY_VOLUME', '70000000'))
 
 # DB
 DATABASE = os.getenv('DB_DATABASE', None)
+ALERT_WRITER_QUEUE_SIZE = int(os.getenv('ALERT_WRITER_QUEUE_SIZE', '1000'))
+ALERT_WRITER_BATCH_SIZE = int(os.getenv('ALERT_WRITER_BATCH_SIZE', '100'))
+ALERT_WRITER_FLUSH_INTERVAL = float(os.getenv('ALERT_WRITER_FLUSH_INTERVAL', '1'))  # In seconds
+ALERTS_RETENTION_DAYS = int(os.getenv('ALERTS_RETENTION_DAYS', '90'))  # 0 - alerts are kept forever
+ALERTS_RETENTION_INTERVAL = 3600  # In seconds
 
 
 # Telegram
 TOKEN_MAIN_BOT = os.getenv('TG_TOKEN_MAIN_BOT', None)
 GROUP_ID = int(os.getenv('GROUP_ID', None))
+TG_API_URL = os.getenv('TG_API_URL', 'https://api.telegram.org')
+TG_QUEUE_SIZE = int(os.getenv('TG_QUEUE_SIZE', '1000'))
+TG_MESSAGES_PER_MINUTE = int(os.getenv('TG_MESSAGES_PER_MINUTE', '20'))
+TG_COALESCE_DELAY = float(os.getenv('TG_COALESCE_DELAY', '1'))  # In seconds
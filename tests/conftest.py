@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the tests do not touch the database or Telegram
+os.environ.setdefault('DB_DATABASE', 'sqlite://')
+os.environ.setdefault('GROUP_ID', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
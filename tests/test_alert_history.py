@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import utils.alert_history
+from db_utils.database import base
+from db_utils.models import FutureAlert
+from utils.alert_history import AlertHistory
+
+START = datetime(2024, 1, 1)
+MINUTE_MS = 60_000
+
+
+@pytest.fixture
+def alerts_table(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'alerts.db'}")
+    base.metadata.create_all(engine)
+    session = sessionmaker(engine)
+    monkeypatch.setattr(utils.alert_history, 'Session', session)
+    return session
+
+
+def add_rows(session, rows: list) -> None:
+    with session() as db_session:
+        db_session.add_all(FutureAlert(future=symbol, date_time=datetime.fromtimestamp(START.timestamp() + minute * 60),
+                                       strategy=strategy, timeframe=timeframe)
+                           for symbol, minute, strategy, timeframe in rows)
+        db_session.commit()
+
+
+def start_ms(minute: int) -> int:
+    return int(START.timestamp() * 1000) + minute * MINUTE_MS
+
+
+def test_since_pages_through_all_the_alerts(alerts_table):
+    rows = []
+    for minute in range(20):
+        rows.append(('BTCUSDT', minute, 'default', '1m'))
+        if minute % 3 == 0:
+            rows.append(('BTCUSDT', minute, 'majors', '1m'))
+        if minute % 5 == 0:
+            rows.append(('ETHUSDT', minute, 'default', '5m'))
+    add_rows(alerts_table, rows)
+    history = AlertHistory(size=10, max_results=4)
+
+    received, open_time = {}, start_ms(0)
+    for _ in range(100):
+        page = asyncio.run(history.since(open_time))
+        new = {(alert['symbol'], alert['timeframe'], alert['t']): alert for alert in page}
+        if new.keys() <= received.keys():
+            break
+        received.update(new)
+        # a client resumes with the open time of the last alert it received
+        open_time = page[-1]['t']
+
+    assert len(received) == 20 + 4
+    assert received[('BTCUSDT', '1m', start_ms(3))]['strategies'] == ['default', 'majors']
+    assert 'strategies' not in received[('BTCUSDT', '1m', start_ms(4))]
+    assert history.db_queries > 1 and history.memory_hits == 0
+
+
+def test_since_is_served_from_memory_after_the_load(alerts_table):
+    add_rows(alerts_table, [('BTCUSDT', minute, 'default', '1m') for minute in range(5)])
+    history = AlertHistory(size=10, max_results=100)
+    history.load()
+    history.add({"event": "Alert", "symbol": "ETHUSDT", "t": start_ms(5), "timeframe": "1m"})
+
+    alerts = asyncio.run(history.since(start_ms(3)))
+
+    assert [(alert['symbol'], alert['t']) for alert in alerts] == [
+        ('BTCUSDT', start_ms(3)), ('BTCUSDT', start_ms(4)), ('ETHUSDT', start_ms(5))]
+    assert (history.memory_hits, history.db_queries) == (1, 0)
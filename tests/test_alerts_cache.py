@@ -0,0 +1,27 @@
+from datetime import datetime
+
+import utils.alerts_cache
+from utils.alerts_cache import get_last_alert, set_last_alert
+
+
+def test_strategies_and_timeframes_have_their_own_cooldown(monkeypatch):
+    monkeypatch.setattr(utils.alerts_cache, 'LAST_ALERTS', {})
+
+    set_last_alert('BTCUSDT', datetime(2024, 1, 1, 12, 7))
+    # the 5m candle opened before the last 1m alert
+    set_last_alert('BTCUSDT', datetime(2024, 1, 1, 12, 5), timeframe='5m')
+    set_last_alert('BTCUSDT', datetime(2024, 1, 1, 12, 3), 'majors')
+
+    assert get_last_alert('BTCUSDT') == datetime(2024, 1, 1, 12, 7)
+    assert get_last_alert('BTCUSDT', timeframe='5m') == datetime(2024, 1, 1, 12, 5)
+    assert get_last_alert('BTCUSDT', 'majors') == datetime(2024, 1, 1, 12, 3)
+    assert get_last_alert('BTCUSDT', 'majors', '5m') is None
+
+
+def test_last_alert_never_moves_back(monkeypatch):
+    monkeypatch.setattr(utils.alerts_cache, 'LAST_ALERTS', {})
+
+    set_last_alert('BTCUSDT', datetime(2024, 1, 1, 12, 7))
+    set_last_alert('BTCUSDT', datetime(2024, 1, 1, 12, 5))
+
+    assert get_last_alert('BTCUSDT') == datetime(2024, 1, 1, 12, 7)
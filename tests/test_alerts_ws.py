@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+import ujson
+
+from utils.alert_history import AlertHistory
+from utils.alerts_ws import Broadcaster, Subscriber
+
+msgpack = pytest.importorskip('msgpack')
+
+
+class FakeWebSocket:
+    """
+    Stand-in for a client connection: yields the requests, then fails with the error if one is given.
+    """
+
+    remote_address = ('127.0.0.1', 50000)
+
+    def __init__(self, requests: list, error: Exception = None):
+        self.requests = requests
+        self.error = error
+        self.sent = []
+
+    async def __aiter__(self):
+        for request in self.requests:
+            yield request
+        if self.error is not None:
+            raise self.error
+
+    async def send(self, frame) -> None:
+        self.sent.append(ujson.loads(frame))
+
+
+def receive(requests: list, error: Exception = None) -> tuple:
+    broadcaster = Broadcaster(queue_size=10, policy='drop_oldest', history=AlertHistory(size=10, max_results=10))
+    websocket = FakeWebSocket(requests, error)
+    subscriber = Subscriber(websocket, 10)
+    broadcaster.subscribers[websocket] = subscriber
+    broadcaster.all_symbols.add(subscriber)
+
+    async def unencodable(symbol, limit):
+        return [{"symbol": symbol, "t": object()}]
+
+    broadcaster.history.last = unencodable
+    # no alerts before the start, the history is answered from memory
+    broadcaster.history.covered_since = 0
+    asyncio.run(broadcaster.receive_requests(subscriber))
+    return broadcaster, subscriber, websocket.sent
+
+
+def test_bad_requests_are_answered_and_the_next_ones_served():
+    _, subscriber, sent = receive([
+        'not json',
+        msgpack.packb([1, 2]) + b'\xc1',
+        '{"method": "since", "id": 1}',
+        '{"method": "last", "symbol": "btcusdt", "id": 2}',
+        '{"method": "since", "t": 0, "id": 3}',
+    ])
+
+    assert [response['event'] for response in sent] == ['Error', 'Error', 'Error', 'Error', 'History']
+    assert sent[2]['id'] == 1 and sent[3]['message'] == "Request failed"
+    assert sent[4] == {"event": "History", "method": "since", "alerts": [], "id": 3}
+    assert subscriber.queue.empty()
+
+
+def test_connection_error_closes_the_connection():
+    broadcaster, subscriber, sent = receive(['{"method": "since", "t": 0}'], RuntimeError("broken frame"))
+
+    assert [response['event'] for response in sent] == ['History']
+    assert subscriber.queue.get_nowait() == (1011, 'Internal error')
+    assert subscriber not in broadcaster.all_symbols and not broadcaster.subscribers
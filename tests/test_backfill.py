@@ -0,0 +1,103 @@
+import asyncio
+
+import utils.backfill
+from utils.backfill import KlineSequence, WeightBudget, backfill_klines
+from utils.resources import RESOURCES
+
+MINUTE_MS = 60_000
+# 2024-01-01 00:10:30 UTC, the kline of 00:10 is still open
+NOW = 1704067830.0
+
+
+class FakeTime:
+    """
+    Clock of the backfill that only the fake sleep moves.
+    """
+
+    def __init__(self, now: float):
+        self.now = now
+        self.slept = []
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float) -> None:
+        self.slept.append(delay)
+        self.now += delay
+
+
+class StubClient:
+    """
+    The REST client: the last `limit` 1m klines of every symbol up to NOW, the last one still open.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    async def get_public_klines(self, symbol: str, interval: str, limit: int) -> dict:
+        self.requests.append((symbol, interval, limit))
+        last_open_time = int(NOW * 1000) // MINUTE_MS * MINUTE_MS
+        data = [[open_time, '1.0', '1.1', '0.9', '1.0', '100', open_time + MINUTE_MS - 1, '100.0', 10]
+                for open_time in range(last_open_time - (limit - 1) * MINUTE_MS, last_open_time + 1, MINUTE_MS)]
+        return {'data': data, 'limit_usage': '7'}
+
+
+def install_fakes(monkeypatch) -> FakeTime:
+    clock = FakeTime(NOW)
+    monkeypatch.setattr(utils.backfill, 'time', clock)
+    monkeypatch.setattr(utils.backfill.asyncio, 'sleep', clock.sleep)
+    return clock
+
+
+def test_weight_budget_waits_for_the_next_minute(monkeypatch):
+    clock = install_fakes(monkeypatch)
+    budget = WeightBudget(10)
+
+    async def main():
+        await budget.acquire(5)
+        await budget.acquire(5)
+        assert not clock.slept
+        await budget.acquire(5)
+
+    asyncio.run(main())
+    assert clock.slept == [30.0]
+    assert budget.used == 5
+    assert budget.total == 15
+
+
+def test_weight_budget_syncs_the_weight_of_the_exchange():
+    budget = WeightBudget(100)
+    budget.used = 10
+    budget.sync('40')
+    assert budget.used == 40
+    budget.sync('20')
+    budget.sync(None)
+    budget.sync('n/a')
+    assert budget.used == 40
+
+
+def test_backfill_stitches_with_the_stream(monkeypatch):
+    install_fakes(monkeypatch)
+    client = StubClient()
+    monkeypatch.setitem(RESOURCES.instances, 'AIO_BINANCE_API_CLIENT', client)
+
+    events = asyncio.run(backfill_klines(['AUSDT', 'BUSDT'], limit=5, concurrency=2, weight_per_minute=100))
+
+    assert sorted(client.requests) == [('AUSDT', '1m', 6), ('BUSDT', '1m', 6)]
+    # the closed klines only, ordered by open time for event_batch
+    last_closed = int(NOW * 1000) // MINUTE_MS * MINUTE_MS - MINUTE_MS
+    open_times = [event['k']['t'] for event in events]
+    assert open_times == sorted(open_times)
+    assert sorted(open_times) == sorted(last_closed - index * MINUTE_MS for index in range(5) for _ in range(2))
+    assert all(event['e'] == 'kline' and event['k']['x'] for event in events)
+
+    sequence = KlineSequence()
+    assert all(sequence.accept(event['k']) for event in events)
+    # the stream repeats the last backfilled kline, then continues with the open one and, later, after a gap
+    assert not sequence.accept({'s': 'AUSDT', 't': last_closed})
+    assert sequence.accept({'s': 'AUSDT', 't': last_closed + MINUTE_MS})
+    assert sequence.accept({'s': 'AUSDT', 't': last_closed + 3 * MINUTE_MS})
+    assert (sequence.duplicates, sequence.gaps) == (1, 1)
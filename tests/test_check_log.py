@@ -0,0 +1,41 @@
+import threading
+
+from loguru import logger
+
+from utils.check_log import CheckLog
+
+
+class Record:
+    """
+    Check record that remembers the thread that formatted it.
+    """
+
+    def __init__(self, number: int):
+        self.number = number
+        self.formatted_by = None
+
+    def __str__(self) -> str:
+        self.formatted_by = threading.current_thread().name
+        return f"record {self.number}"
+
+    def to_dict(self) -> dict:
+        return {"number": self.number}
+
+
+def test_records_are_formatted_off_the_calling_thread(tmp_path):
+    lines = []
+    sink = logger.add(lines.append, format="{message}")
+    check_log = CheckLog(sample_rate=0, records_path=str(tmp_path / 'records.jsonl'))
+    records = [Record(number) for number in range(3)]
+    try:
+        check_log.write(records[0], True)
+        check_log.write(records[1], False)
+        check_log.write(records[2], True)
+        check_log.close()
+    finally:
+        logger.remove(sink)
+
+    assert [line.strip() for line in lines] == ["record 0", "record 2"]
+    assert [record.formatted_by for record in records] == ['check-log', None, 'check-log']
+    assert (check_log.logged, check_log.skipped) == (2, 1)
+    assert (tmp_path / 'records.jsonl').read_text().splitlines() == ['{"number":0}', '{"number":1}', '{"number":2}']
@@ -0,0 +1,52 @@
+import random
+from statistics import fmean
+
+from utils.checks import check_average_volume_greater, get_average_volume, get_min_candle
+from utils.klines import KlineWindow
+
+
+def kline(open_time: int, high: float, low: float, quote_volume: float) -> dict:
+    return {"t": open_time, "h": str(high), "l": str(low), "q": str(quote_volume)}
+
+
+def random_klines(count: int, seed: int) -> list:
+    rand = random.Random(seed)
+    klines = []
+    for index in range(count):
+        low = round(rand.uniform(1, 2), rand.choice([1, 2, 4]))
+        high = low + round(rand.uniform(0, 1), rand.choice([1, 2, 4]))
+        klines.append(kline(index * 60_000, high, low, rand.uniform(0, 10 ** rand.randint(0, 9))))
+    return klines
+
+
+def test_window_statistics_match_the_scans():
+    window = KlineWindow(10)
+    klines = random_klines(2000, seed=1)
+    for index, kline_data in enumerate(klines):
+        window.append(kline_data)
+        if not window.is_full():
+            continue
+
+        candles = klines[index - 9:index + 1]
+        min_price = min(float(candle['l']) for candle in candles[:-1])
+        max_in_min_price = max(float(candle['h']) for candle in candles[:-1] if float(candle['l']) == min_price)
+        assert get_min_candle(window) == {"min_price": min_price, "max_in_min_price": max_in_min_price}
+        assert get_average_volume(window) == fmean(float(candle['q']) for candle in candles)
+
+
+def test_sum_volume_decides_as_the_sum_of_the_candles():
+    rand = random.Random(2)
+    differ = 0
+    for _ in range(2000):
+        window = KlineWindow(10)
+        volumes = [rand.uniform(0, 10 ** rand.randint(0, 9)) for _ in range(10)]
+        for index, volume in enumerate(volumes):
+            window.append(kline(index * 60_000, 2, 1, volume))
+
+        naive = sum(volumes)
+        differ += naive != window.stats.quote_sum
+        # the thresholds at the boundary, where the exact and the naive sums may decide differently
+        for volume in (naive, window.stats.quote_sum, naive * (1 - 2 ** -52), naive * (1 + 2 ** -52)):
+            assert check_average_volume_greater(window, volume)[0] == (naive > volume)
+    # the boundary cases were covered
+    assert differ
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.resources import Resources
+
+
+def test_slow_factory_does_not_hold_up_other_resources():
+    resources = Resources()
+    release = threading.Event()
+
+    def slow_factory():
+        release.wait(5)
+        return 'slow'
+
+    resources.register('slow', slow_factory)
+    resources.register('fast', lambda: 'fast')
+
+    async def main():
+        slow = asyncio.create_task(resources.prepare('slow'))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        assert resources.get('fast') == 'fast'
+        assert time.perf_counter() - started < 0.5
+        # the event loop does not wait for the resource that is being created in a thread
+        with pytest.raises(RuntimeError):
+            resources.get('slow')
+        release.set()
+        assert await slow == 'slow'
+        assert resources.get('slow') == 'slow'
+
+    asyncio.run(main())
+
+
+def test_resource_is_created_once_by_threads():
+    resources = Resources()
+    created = []
+
+    def factory():
+        time.sleep(0.05)
+        created.append(object())
+        return created[-1]
+
+    resources.register('client', factory)
+    threads = [threading.Thread(target=resources.get, args=('client',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
@@ -0,0 +1,93 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import loader
+import settings
+import utils.snapshot
+from utils.backfill import KLINE_SEQUENCE
+from utils.klines import new_window
+from utils.snapshot import StateSnapshots
+from utils.timeframes import PartialCandle, Timeframe
+
+MINUTE_MS = 60_000
+# 2024-01-01 12:03:30 UTC: the 12:00 candle of 5m is open with the klines 12:00 - 12:02
+NOW_MS = 1_704_110_400_000 + 3 * MINUTE_MS + 30_000
+SYMBOLS = ['BTCUSDT', 'ETHUSDT']
+
+
+def kline(symbol: str, open_time: int, price: float) -> dict:
+    return {"s": symbol, "t": open_time, "o": str(price), "h": str(price + 1), "l": str(price - 1),
+            "c": str(price + 0.5), "q": str(price * 10)}
+
+
+@pytest.fixture
+def timeframe(monkeypatch):
+    if settings.CHECK_ENGINE != 'scalar':
+        pytest.skip('the 1m windows live in the kline matrix')
+    monkeypatch.setattr(utils.snapshot, 'time', SimpleNamespace(time=lambda: NOW_MS / 1000,
+                                                                perf_counter=time.perf_counter))
+    monkeypatch.setattr(loader, 'KLINES_DATA', {})
+    monkeypatch.setattr(KLINE_SEQUENCE, 'last_open_times', {})
+    return Timeframe('5m', capacity=10, strategies_file='')
+
+
+def feed(timeframe: Timeframe, last_open_time: int, minutes: int) -> None:
+    for symbol_index, symbol in enumerate(SYMBOLS):
+        window = loader.KLINES_DATA[symbol] = new_window()
+        for minute in range(minutes):
+            kline_data = kline(symbol, last_open_time - (minutes - 1 - minute) * MINUTE_MS,
+                               price=100 * (symbol_index + 1) + minute)
+            window.append(kline_data)
+            timeframe.aggregator.add(kline_data)
+            KLINE_SEQUENCE.last_open_times[symbol] = kline_data['t']
+
+
+def state_of(timeframe: Timeframe) -> dict:
+    aggregator = timeframe.aggregator
+    return {
+        symbol: (
+            [tuple(column) for column in loader.KLINES_DATA[symbol].columns()],
+            [tuple(column) for column in aggregator.windows[symbol].columns()],
+            {slot: getattr(aggregator.partials[symbol], slot) for slot in PartialCandle.__slots__},
+            KLINE_SEQUENCE.last_open_times[symbol],
+        )
+        for symbol in SYMBOLS
+    }
+
+
+def clear_state(timeframe: Timeframe) -> None:
+    loader.KLINES_DATA.clear()
+    KLINE_SEQUENCE.last_open_times.clear()
+    timeframe.aggregator.windows.clear()
+    timeframe.aggregator.partials.clear()
+
+
+def test_snapshot_restores_the_state(timeframe, tmp_path):
+    snapshots = StateSnapshots(str(tmp_path / 'state.npz'), [timeframe])
+    # the klines 11:00 - 12:02: twelve closed 5m candles and the partial 12:00 candle
+    feed(timeframe, last_open_time=NOW_MS - 90_000, minutes=63)
+    expected = state_of(timeframe)
+    assert expected['BTCUSDT'][2]['first_open_time'] == NOW_MS - 210_000
+    assert expected['BTCUSDT'][2]['count'] == 3
+
+    snapshots.write(snapshots.capture())
+    clear_state(timeframe)
+    last_open_times = snapshots.restore(SYMBOLS, capacity=settings.MAXIMUM_KLINES)
+
+    assert last_open_times == {symbol: NOW_MS - 90_000 for symbol in SYMBOLS}
+    assert state_of(timeframe) == expected
+
+
+def test_stale_snapshot_is_not_restored(timeframe, tmp_path):
+    snapshots = StateSnapshots(str(tmp_path / 'state.npz'), [timeframe])
+    # the last kline closed an hour ago: the backfill rebuilds the windows
+    feed(timeframe, last_open_time=NOW_MS - 90_000 - 60 * MINUTE_MS, minutes=63)
+
+    snapshots.write(snapshots.capture())
+    clear_state(timeframe)
+
+    assert snapshots.restore(SYMBOLS, capacity=settings.MAXIMUM_KLINES) == {}
+    assert loader.KLINES_DATA == {} and KLINE_SEQUENCE.last_open_times == {}
+    assert timeframe.aggregator.windows == {} and timeframe.aggregator.partials == {}
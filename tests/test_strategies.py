@@ -0,0 +1,102 @@
+import random
+from datetime import datetime
+
+import pytest
+
+import settings
+import utils.alerts_cache
+import utils.strategies
+from utils.alerts_cache import get_last_alert, set_last_alert
+from utils.checks import check_window, passes_time_passed, window_record
+from utils.klines import KlineWindow
+from utils.strategies import Strategy, StrategyEngine
+
+
+class DiscardedCheckLog:
+    def write(self, record, result: bool) -> None:
+        pass
+
+
+def spiky_klines(count: int, seed: int) -> list:
+    rand = random.Random(seed)
+    klines = []
+    for index in range(count):
+        low = rand.uniform(1, 1.1)
+        spike = rand.random() < 0.2
+        high = low * (rand.uniform(1.03, 1.08) if spike else rand.uniform(1, 1.01))
+        volume = rand.uniform(5e6, 2e7) if spike else rand.uniform(1e5, 1e6)
+        klines.append({"t": index * 60_000, "h": str(high), "l": str(low), "q": str(volume)})
+    return klines
+
+
+@pytest.fixture(autouse=True)
+def no_alerts(monkeypatch):
+    monkeypatch.setattr(utils.alerts_cache, 'LAST_ALERTS', {})
+    monkeypatch.setattr(utils.strategies, 'CHECK_LOG', DiscardedCheckLog())
+
+
+def test_default_strategy_decides_as_the_checks():
+    strategy = Strategy('default', {})
+    window = KlineWindow(settings.MAXIMUM_KLINES)
+    alerts = 0
+    for kline_data in spiky_klines(3000, seed=3):
+        window.append(kline_data)
+        if not window.is_full():
+            continue
+
+        window_result, expected = check_window(window)
+        last_alert = get_last_alert('BTCUSDT')
+        record = strategy.evaluate('BTCUSDT', window_record(window), window)
+
+        assert record.results == expected.results + (passes_time_passed(last_alert, expected.new_candle,
+                                                                        settings.TIME_PASSED),)
+        assert bool(record.time_passed) == (window_result and record.results[-1])
+        if record.time_passed:
+            alerts += 1
+            set_last_alert('BTCUSDT', datetime.fromtimestamp(kline_data['t'] / 1000))
+    # the time passed check was reached
+    assert alerts
+
+
+def test_strategies_have_their_own_cooldown():
+    params = {"volume_multiple": 0, "avg_increase": 0, "time_passed": 90}
+    engine = StrategyEngine([Strategy(name, params, rules=['volume_multiple', 'sum_volume', 'time_passed'])
+                             for name in ('fast', 'slow')])
+    window = KlineWindow(settings.MAXIMUM_KLINES)
+    for kline_data in spiky_klines(settings.MAXIMUM_KLINES, seed=4):
+        window.append(kline_data)
+    alert_time = datetime.fromtimestamp(window[-1].open_time / 1000)
+
+    assert engine.evaluate('BTCUSDT', window) == ['fast', 'slow']
+    set_last_alert('BTCUSDT', alert_time, 'fast')
+
+    assert engine.evaluate('BTCUSDT', window) == ['slow']
+    assert get_last_alert('BTCUSDT', 'slow') is None
+    assert get_last_alert('BTCUSDT') is None
+
+
+def test_strategy_params_override_the_settings_by_group():
+    strategy = Strategy('majors', {"volume_multiple": 3},
+                        groups=[{"symbols": ["BTCUSDT"], "params": {"avg_increase": 100}}])
+
+    assert strategy.params_for('BTCUSDT')['avg_increase'] == 100
+    assert strategy.params_for('ETHUSDT')['avg_increase'] == settings.AVG_INCREASE
+    assert strategy.params_for('ETHUSDT')['volume_multiple'] == 3
+    with pytest.raises(ValueError):
+        Strategy('typo', {"volume_multiplier": 3})
+
+
+def test_strategies_config_needs_the_scalar_engine(monkeypatch, tmp_path):
+    path = tmp_path / 'strategies.json'
+    path.write_text('{"strategies": [{"name": "default"}, {"name": "fast", "params": {"time_passed": 30}}]}')
+
+    assert [strategy.name for strategy in StrategyEngine.from_config(str(path)).strategies] == ['default', 'fast']
+    monkeypatch.setattr(settings, 'CHECK_ENGINE', 'vector')
+    with pytest.raises(ValueError):
+        StrategyEngine.from_config(str(path))
+    # the higher timeframes always run the strategies in the main process
+    assert len(StrategyEngine.from_config(str(path), '5m').strategies) == 2
+    monkeypatch.setattr(settings, 'CHECK_ENGINE', 'scalar')
+    monkeypatch.setattr(settings, 'DETECTOR_WORKERS', '2')
+    with pytest.raises(ValueError):
+        StrategyEngine.from_config(str(path))
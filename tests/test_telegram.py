@@ -0,0 +1,43 @@
+import asyncio
+
+import httpx
+
+from utils.telegram import TelegramDispatcher
+
+
+def create_dispatcher(responses: list) -> TelegramDispatcher:
+    """
+    Dispatcher whose client answers with the responses in turn.
+    """
+    def handler(request):
+        return responses.pop(0)
+
+    dispatcher = TelegramDispatcher('https://telegram.test', 'token', 1, queue_size=10, messages_per_minute=6000,
+                                    coalesce_delay=0)
+    dispatcher.client = httpx.AsyncClient(base_url=dispatcher.base_url, transport=httpx.MockTransport(handler))
+    return dispatcher
+
+
+def test_rate_limit_without_json_body():
+    dispatcher = create_dispatcher([
+        httpx.Response(429, text='<html>Too Many Requests</html>', headers={'Retry-After': '0.01'}),
+        httpx.Response(429, text='<html>Too Many Requests</html>'),
+        httpx.Response(200, json={'ok': True}),
+    ])
+
+    async def main():
+        return await asyncio.wait_for(dispatcher.send('BTCUSDT'), 5)
+
+    assert asyncio.run(main())
+    assert dispatcher.rate_limited == 2
+    assert dispatcher.sent == 1
+
+
+def test_rate_limit_retry_after_of_the_api():
+    dispatcher = create_dispatcher([
+        httpx.Response(429, json={'ok': False, 'parameters': {'retry_after': 0}}),
+        httpx.Response(200, json={'ok': True}),
+    ])
+
+    assert asyncio.run(dispatcher.send('BTCUSDT'))
+    assert dispatcher.rate_limited == 1
@@ -0,0 +1,61 @@
+import pytest
+
+from utils.timeframes import CandleAggregator, interval_minutes
+
+HOUR_MS = 3_600_000
+
+
+def kline(open_time: int, price: float, quote_volume: float = 1.0) -> dict:
+    return {"s": "BTCUSDT", "t": open_time, "o": str(price), "h": str(price + 1), "l": str(price - 1),
+            "c": str(price + 0.5), "q": str(quote_volume)}
+
+
+def feed(aggregator: CandleAggregator, start: int, minutes: int) -> list:
+    closed = []
+    for minute in range(minutes):
+        closed.extend(aggregator.add(kline(start + minute * 60_000, price=100 + minute)))
+    return closed
+
+
+def test_candle_aggregates_the_1m_klines_of_the_period():
+    aggregator = CandleAggregator('5m', capacity=10)
+
+    closed = feed(aggregator, start=0, minutes=12)
+
+    window = aggregator.windows['BTCUSDT']
+    assert len(closed) == 2 and closed[0] is window
+    assert [candle.open_time for candle in window] == [0, 300_000]
+    assert (window[0].high, window[0].low, window[0].quote_volume) == (105, 99, 5)
+    assert window[1].high == 110
+    assert aggregator.partials['BTCUSDT'].count == 2
+
+
+def test_partial_periods_stay_out_of_the_window():
+    aggregator = CandleAggregator('1h', capacity=10)
+
+    # started 50 minutes into the hour: the first hour has 10 of its 60 klines
+    feed(aggregator, start=10 * HOUR_MS + 50 * 60_000, minutes=70)
+    assert [candle.open_time for candle in aggregator.windows['BTCUSDT']] == [11 * HOUR_MS]
+
+    # a gap in the stream: the 12:00 hour misses its last klines and closes with the first kline of 13:00
+    feed(aggregator, start=12 * HOUR_MS, minutes=30)
+    feed(aggregator, start=13 * HOUR_MS, minutes=60)
+
+    assert [candle.open_time for candle in aggregator.windows['BTCUSDT']] == [11 * HOUR_MS, 13 * HOUR_MS]
+    assert (aggregator.closed, aggregator.incomplete) == (2, 2)
+
+
+def test_period_without_its_first_kline_is_dropped():
+    aggregator = CandleAggregator('5m', capacity=10)
+
+    closed = feed(aggregator, start=60_000, minutes=4)
+
+    assert closed == [] and 'BTCUSDT' not in aggregator.windows
+    assert aggregator.incomplete == 1
+
+
+def test_timeframes_are_aligned_to_the_day():
+    assert interval_minutes('15m') == 15
+    assert interval_minutes('4h') == 240
+    with pytest.raises(ValueError):
+        interval_minutes('7m')
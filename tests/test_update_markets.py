@@ -0,0 +1,68 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import loader
+import utils.binance
+import utils.alerts_cache
+from utils.backfill import KLINE_SEQUENCE
+from utils.klines import new_window
+from utils.resources import RESOURCES
+
+
+class LowercasingManager:
+    """
+    Stand-in for the websocket manager, lowercases the markets it is given in place like the real one.
+    """
+
+    def __init__(self, markets):
+        self.markets = {stream_id: [market.lower() for market in stream_markets]
+                        for stream_id, stream_markets in markets.items()}
+
+    def get_stream_info(self, stream_id):
+        return {'markets': list(self.markets[stream_id])}
+
+    def subscribe_to_stream(self, stream_id, channels=None, markets=None):
+        self.markets[stream_id].extend(market.lower() for market in markets)
+
+    def unsubscribe_from_stream(self, stream_id, channels=None, markets=None):
+        for index, market in enumerate(markets):
+            markets[index] = market.lower()
+        self.markets[stream_id] = [market for market in self.markets[stream_id] if market not in markets]
+
+
+class StopLoop(Exception):
+    pass
+
+
+async def stop_loop(_):
+    raise StopLoop
+
+
+def test_update_markets_frees_delisted_symbols(monkeypatch):
+    manager = LowercasingManager({'stream': ['BTCUSDT', 'OLDUSDT']})
+    monkeypatch.setitem(RESOURCES.instances, 'BINANCE_WEBSOCKET_MANAGER', manager)
+    monkeypatch.setattr(loader, 'KLINE_STREAM_IDS', ['stream'])
+
+    async def receive_symbols():
+        return ['BTCUSDT', 'NEWUSDT']
+
+    monkeypatch.setattr(utils.binance, 'receive_symbols', receive_symbols)
+    monkeypatch.setattr(utils.binance.asyncio, 'sleep', stop_loop)
+    monkeypatch.setattr(loader, 'KLINES_DATA', {})
+    monkeypatch.setattr(utils.alerts_cache, 'LAST_ALERTS', {})
+    monkeypatch.setattr(KLINE_SEQUENCE, 'last_open_times', {})
+    for symbol in ('BTCUSDT', 'OLDUSDT'):
+        loader.KLINES_DATA[symbol] = new_window()
+        KLINE_SEQUENCE.last_open_times[symbol] = 0
+        utils.alerts_cache.set_last_alert(symbol, datetime(2024, 1, 1))
+
+    with pytest.raises(StopLoop):
+        asyncio.run(utils.binance.update_markets())
+
+    assert sorted(manager.markets['stream']) == ['btcusdt', 'newusdt']
+    assert 'OLDUSDT' not in loader.KLINES_DATA
+    assert 'OLDUSDT' not in KLINE_SEQUENCE.last_open_times
+    assert utils.alerts_cache.get_last_alert('OLDUSDT') is None
+    assert 'BTCUSDT' in loader.KLINES_DATA and 'NEWUSDT' in loader.KLINES_DATA
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from utils.workers import DetectorPool
+
+
+def submit_ticks(pool: DetectorPool, symbols: int, ticks: int) -> None:
+    for tick in range(ticks):
+        for index in range(symbols):
+            pool.submit({'s': f'S{index}USDT', 't': tick * 60_000, 'h': 1.0 + tick, 'l': 1.0, 'q': 1000.0})
+        pool.flush()
+
+
+def test_stop_with_results_in_flight():
+    async def main():
+        pool = DetectorPool(2, capacity=5)
+        pool.start()
+        submit_ticks(pool, symbols=500, ticks=20)
+        assert pool.in_flight > 0
+
+        started = time.monotonic()
+        await pool.stop()
+        assert time.monotonic() - started < 5
+        assert pool.finished
+        assert pool.in_flight == 0
+        assert not any(process.is_alive() for process in pool.processes)
+
+    asyncio.run(main())
+
+
+def test_stop_ends_the_reader_with_every_result():
+    async def main():
+        pool = DetectorPool(2, capacity=5)
+        pool.start()
+        reader = asyncio.create_task(_collect(pool.results()))
+        for tick in range(20):
+            # every 5th kline is a volume and price spike that passes the window checks
+            spike = tick % 5 == 4
+            for index in range(500):
+                pool.submit({'s': f'S{index}USDT', 't': tick * 60_000, 'h': 1.05 if spike else 1.01, 'l': 1.0,
+                             'q': 4_000_000.0 if spike else 1.0})
+            pool.flush()
+
+        assert await pool.stop() == []
+        candidates = await asyncio.wait_for(reader, 5)
+        assert len(candidates) == 500 * 4
+        assert pool.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_reader_writes_off_a_dead_worker():
+    async def main():
+        pool = DetectorPool(2, capacity=5)
+        pool.start()
+        for process in pool.processes:
+            process.terminate()
+            process.join()
+        submit_ticks(pool, symbols=10, ticks=3)
+
+        candidates = await asyncio.wait_for(_collect(pool.results()), 5)
+        assert candidates == []
+        assert pool.in_flight == 0
+        await pool.stop()
+
+    asyncio.run(main())
+
+
+async def _collect(results) -> list:
+    return [candidate async for candidate in results]
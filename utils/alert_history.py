@@ -0,0 +1,164 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+import settings
+from db_utils.database import Session
+from db_utils.models import FutureAlert
+from utils.alerts_cache import DEFAULT_STRATEGY, DEFAULT_TIMEFRAME
+from utils.metrics import REGISTRY
+
+
+def alerts_from_rows(rows: Iterable[tuple]) -> List[dict]:
+    """
+    Alert messages of the websocket built from the rows (symbol, date_time, strategy, timeframe) of the
+    alerts table. Every strategy that alerted on a kline has its own row, they make one alert.
+    """
+    alerts = {}
+    for symbol, date_time, strategy, timeframe in rows:
+        open_time = int(date_time.timestamp() * 1000)
+        timeframe = timeframe or DEFAULT_TIMEFRAME
+        alert = alerts.get((symbol, timeframe, open_time))
+        if alert is None:
+            alert = alerts[(symbol, timeframe, open_time)] = {"event": "Alert", "symbol": symbol, "t": open_time,
+                                                              "timeframe": timeframe, "strategies": []}
+        alert['strategies'].append(strategy or DEFAULT_STRATEGY)
+
+    for alert in alerts.values():
+        # as sent: only the alerts of other strategies than the default one name them
+        if alert['strategies'] == [DEFAULT_STRATEGY]:
+            del alert['strategies']
+    return list(alerts.values())
+
+
+def query_alerts_since(open_time: int, limit: int) -> Tuple[List[dict], bool]:
+    """
+    The first alerts with the kline open time >= open_time (ms), the oldest first, from at most limit rows.
+
+    Returns:
+        (alerts, True if the limit cut the rows and there may be newer alerts)
+    """
+    with Session() as db_session:
+        rows = (
+            db_session.query(FutureAlert.future, FutureAlert.date_time, FutureAlert.strategy, FutureAlert.timeframe)
+            .filter(FutureAlert.date_time >= datetime.fromtimestamp(open_time / 1000))
+            .order_by(FutureAlert.date_time, FutureAlert.alert_id)
+            .limit(limit)
+            .all()
+        )
+    return alerts_from_rows(rows), len(rows) == limit
+
+
+def query_last_alerts(symbol: Optional[str] = None, limit: int = 100) -> Tuple[List[dict], bool]:
+    """
+    The last alerts of the symbol (of all symbols if None), the oldest first, from at most limit rows.
+
+    Returns:
+        (alerts, True if the limit cut the rows and there may be older alerts)
+    """
+    with Session() as db_session:
+        query = db_session.query(FutureAlert.future, FutureAlert.date_time, FutureAlert.strategy,
+                                 FutureAlert.timeframe)
+        if symbol is not None:
+            query = query.filter(FutureAlert.future == symbol)
+        rows = query.order_by(FutureAlert.date_time.desc(), FutureAlert.alert_id.desc()).limit(limit).all()
+    return alerts_from_rows(reversed(rows)), len(rows) == limit
+
+
+def merge_alerts(stored: Iterable[dict], recent: Iterable[dict]) -> List[dict]:
+    """
+    Alerts of the database and of the memory without duplicates, ordered by the open time.
+    """
+    alerts = {(alert['symbol'], alert['timeframe'], alert['t']): alert for alert in stored}
+    # the alerts in memory have the send time
+    alerts.update(((alert['symbol'], alert['timeframe'], alert['t']), alert) for alert in recent)
+    return sorted(alerts.values(), key=lambda alert: alert['t'])
+
+
+class AlertHistory:
+    """
+    Recent alerts for the history requests of the websocket clients.
+
+    The last `size` alerts are kept in a ring in memory, so a client that reconnects after a break gets
+    the alerts it missed without a database query. Only the requests that reach past the ring (older
+    alerts, or more alerts of a symbol than the ring has) are read from the indexed alerts table.
+    """
+
+    def __init__(self, size: int, max_results: int):
+        self.alerts = deque(maxlen=size)
+        self.max_results = max_results
+        # every alert with the open time >= covered_since (ms) is in the ring
+        self.covered_since = int(time.time() * 1000)
+
+        # metrics
+        self.memory_hits = 0
+        self.db_queries = 0
+
+    def load(self) -> None:
+        """
+        Warms the ring with the last alerts from the database, so the reconnects after a restart are served
+        from memory too.
+        """
+        alerts, cut = query_last_alerts(limit=self.alerts.maxlen)
+        self.alerts.extendleft(reversed(alerts))
+        if not cut:
+            self.covered_since = 0
+        else:
+            # other alerts of the same minute as the oldest one may be left in the database
+            self.covered_since = alerts[0]['t'] + 1
+        logger.info(f"Loaded {len(alerts)} recent alerts")
+
+    def add(self, alert: dict) -> None:
+        """
+        Adds the sent alert (with the open time 't' of its kline).
+        """
+        if self.alerts and len(self.alerts) == self.alerts.maxlen:
+            self.covered_since = max(self.covered_since, self.alerts[0]['t'] + 1)
+        self.alerts.append(alert)
+
+    async def since(self, open_time: int) -> List[dict]:
+        """
+        Alerts with the kline open time >= open_time (ms), the oldest first, at most max_results.
+
+        A client resumes with the open time of the last alert it received: the alerts of that minute
+        come again and the ones it already has are skipped by (symbol, timeframe, t).
+        """
+        recent = [alert for alert in self.alerts if alert['t'] >= open_time]
+        if open_time >= self.covered_since:
+            self.memory_hits += 1
+            return sorted(recent, key=lambda alert: alert['t'])[:self.max_results]
+
+        self.db_queries += 1
+        stored, cut = await asyncio.to_thread(query_alerts_since, open_time, self.max_results)
+        if cut:
+            # the newer alerts are requested with the open time of the last one
+            recent = [alert for alert in recent if alert['t'] <= stored[-1]['t']]
+        return merge_alerts(stored, recent)[:self.max_results]
+
+    async def last(self, symbol: str, limit: int) -> List[dict]:
+        """
+        The last alerts of the symbol, the oldest first.
+        """
+        limit = min(limit, self.max_results)
+        recent = [alert for alert in self.alerts if alert['symbol'] == symbol]
+        if len(recent) >= limit or self.covered_since == 0:
+            self.memory_hits += 1
+            return sorted(recent, key=lambda alert: alert['t'])[-limit:] if limit > 0 else []
+
+        self.db_queries += 1
+        stored, _ = await asyncio.to_thread(query_last_alerts, symbol, limit)
+        return merge_alerts(stored, recent)[-limit:]
+
+
+ALERT_HISTORY = AlertHistory(settings.ALERT_HISTORY_SIZE, settings.ALERT_HISTORY_MAX_RESULTS)
+
+REGISTRY.collect('alert_server_history_memory_total', 'History requests served from memory',
+                 lambda: ALERT_HISTORY.memory_hits, kind='counter')
+REGISTRY.collect('alert_server_history_db_total', 'History requests read from the database',
+                 lambda: ALERT_HISTORY.db_queries, kind='counter')
+
+__all__ = ['AlertHistory', 'ALERT_HISTORY', 'query_alerts_since', 'query_last_alerts']
@@ -0,0 +1,61 @@
+from datetime import datetime
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import func
+
+from db_utils.database import session as db_session
+from db_utils.models import FutureAlert
+
+# the strategy of the alerts without a strategies config (see utils.strategies)
+DEFAULT_STRATEGY = 'default'
+# the timeframe of the alerts of the 1m windows (see utils.timeframes)
+DEFAULT_TIMEFRAME = '1m'
+
+# (strategy, timeframe) -> symbol -> datetime of the candle of the last alert,
+# every strategy has its own cooldown on every timeframe
+LAST_ALERTS = {}
+
+
+def load_last_alerts() -> None:
+    """
+    Warms the cache with the last alert time of every symbol, strategy and timeframe using one grouped query.
+    """
+    last_alert_ids = (
+        db_session.query(func.max(FutureAlert.alert_id))
+        .group_by(FutureAlert.future, FutureAlert.strategy, FutureAlert.timeframe)
+    )
+    last_alerts = (
+        db_session.query(FutureAlert.future, FutureAlert.strategy, FutureAlert.timeframe, FutureAlert.date_time)
+        .filter(FutureAlert.alert_id.in_(last_alert_ids))
+        .all()
+    )
+
+    LAST_ALERTS.clear()
+    for symbol, strategy, timeframe, date_time in last_alerts:
+        set_last_alert(symbol, date_time, strategy or DEFAULT_STRATEGY, timeframe or DEFAULT_TIMEFRAME)
+    logger.info(f"Loaded last alerts for {len(last_alerts)} symbols, strategies and timeframes")
+
+
+def get_last_alert(symbol: str, strategy: str = DEFAULT_STRATEGY,
+                   timeframe: str = DEFAULT_TIMEFRAME) -> Optional[datetime]:
+    alerts = LAST_ALERTS.get((strategy, timeframe))
+    return alerts.get(symbol) if alerts else None
+
+
+def set_last_alert(symbol: str, date_time: datetime, strategy: str = DEFAULT_STRATEGY,
+                   timeframe: str = DEFAULT_TIMEFRAME) -> None:
+    alerts = LAST_ALERTS.setdefault((strategy, timeframe), {})
+    last_alert = alerts.get(symbol)
+    # an alert of an older candle never moves the cooldown back
+    if last_alert is None or date_time > last_alert:
+        alerts[symbol] = date_time
+
+
+def forget_last_alert(symbol: str) -> None:
+    for alerts in LAST_ALERTS.values():
+        alerts.pop(symbol, None)
+
+
+__all__ = ['LAST_ALERTS', 'DEFAULT_STRATEGY', 'DEFAULT_TIMEFRAME', 'load_last_alerts', 'get_last_alert',
+           'set_last_alert', 'forget_last_alert']
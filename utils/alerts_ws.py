@@ -1,5 +1,5 @@
 import asyncio
-from copy import copy
+import time
 from datetime import datetime as dt
 
 import ujson
@@ -7,11 +7,322 @@ import websockets
 from websockets.legacy.server import WebSocketServerProtocol
 from loguru import logger
 
-from utils.telegram import send_alert
+try:
+    import msgpack
+except ImportError:  # the msgpack encoding is not offered
+    msgpack = None
+
+import settings
+from utils.alert_history import ALERT_HISTORY, AlertHistory
+from utils.metrics import REGISTRY, WS_SEND_SECONDS
 
 PING_COOLDOWN = 15  # In seconds
-MESSAGES_QUEUE = []
-CONNECTIONS = []
+ENCODINGS = ('json', 'msgpack')
+
+
+def encode(data: dict, encoding: str):
+    """
+    Frame of the message in the encoding of the client: JSON text or msgpack binary.
+    """
+    if encoding == 'msgpack':
+        return msgpack.packb(data)
+    return ujson.dumps(data)
+
+
+def decode(message) -> dict:
+    if isinstance(message, bytes):
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        return msgpack.unpackb(message)
+    return ujson.loads(message)
+
+
+class Subscriber:
+    """
+    Connected client and the alerts it subscribed to (None - all symbols / strategies).
+    """
+
+    __slots__ = ('websocket', 'queue', 'symbols', 'strategies', 'encoding', 'batch')
+
+    def __init__(self, websocket: WebSocketServerProtocol, queue_size: int):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.symbols = None
+        self.strategies = None
+        self.encoding = 'json'
+        # True - the alerts of one tick come in one frame
+        self.batch = False
+
+    def wants(self, alert: dict) -> bool:
+        return self.strategies is None or not self.strategies.isdisjoint(alert.get('strategies', ('default',)))
+
+
+class Broadcaster:
+    """
+    Fans out alerts to the connected clients.
+
+    Every client has its own bounded queue drained by its connection handler, so a frame is
+    serialized once per encoding and then sent to all clients concurrently. When the queue of a slow
+    client is full, the oldest frame is dropped ('drop_oldest') or the client is disconnected ('evict').
+
+    By default a client gets every alert as a JSON text frame. With a subscribe request (see handle_request)
+    it gets only the alerts of its symbols and strategies, msgpack binary frames instead of JSON and all the
+    alerts of a tick in one frame. The subscribers of a symbol are kept in an index, so an alert only
+    reaches the clients of its symbol and the ones without a symbol filter. The permessage-deflate
+    compression is negotiated by the client in the handshake (WS_COMPRESSION).
+
+    Clients may also request the alert history, e.g. the alerts they missed while they were disconnected.
+    """
+
+    def __init__(self, queue_size: int, policy: str, history: AlertHistory):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.history = history
+        self.subscribers = {}
+        # subscribers of every symbol, and the ones that get all the symbols
+        self.by_symbol = {}
+        self.all_symbols = set()
+        self._pending = []
+
+        # metrics
+        self.dropped = 0
+        self.evicted = 0
+        self.frames = 0
+
+    def publish(self, data: dict) -> None:
+        """
+        Sends the alert to the clients subscribed to it.
+
+        The alerts published by one pass of the event loop (the alerts of one stream batch, see event_batch)
+        are sent together right after it.
+        """
+        data['event'] = 'Alert'
+        data['E'] = int(dt.utcnow().timestamp())
+        self.history.add(data)
+
+        if not self._pending:
+            asyncio.get_running_loop().call_soon(self.flush)
+        self._pending.append(data)
+
+    def flush(self) -> None:
+        alerts, self._pending = self._pending, []
+        recipients = {}
+        for index, alert in enumerate(alerts):
+            for subscriber in self.all_symbols.union(self.by_symbol.get(alert['symbol'], ())):
+                if subscriber.wants(alert):
+                    recipients.setdefault(subscriber, []).append(index)
+
+        frames = {}
+        for subscriber, indexes in recipients.items():
+            if subscriber.batch:
+                key = (subscriber.encoding, tuple(indexes))
+                frame = frames.get(key)
+                if frame is None:
+                    frame = frames[key] = encode({"event": "Alerts", "E": alerts[indexes[0]]['E'],
+                                                  "alerts": [alerts[index] for index in indexes]},
+                                                 subscriber.encoding)
+                self.put(subscriber, frame)
+                continue
+
+            for index in indexes:
+                key = (subscriber.encoding, index)
+                frame = frames.get(key)
+                if frame is None:
+                    frame = frames[key] = encode(alerts[index], subscriber.encoding)
+                self.put(subscriber, frame)
+
+    def broadcast(self, data: dict) -> None:
+        """
+        Sends the message to all clients.
+        """
+        frames = {}
+        for subscriber in list(self.subscribers.values()):
+            frame = frames.get(subscriber.encoding)
+            if frame is None:
+                frame = frames[subscriber.encoding] = encode(data, subscriber.encoding)
+            self.put(subscriber, frame)
+
+    def put(self, subscriber: Subscriber, frame) -> None:
+        try:
+            subscriber.queue.put_nowait(frame)
+            self.frames += 1
+        except asyncio.QueueFull:
+            self._handle_slow_subscriber(subscriber, frame)
+
+    def _handle_slow_subscriber(self, subscriber: Subscriber, frame) -> None:
+        if self.policy == 'evict':
+            self.evicted += 1
+            logger.warning(f"Evict slow websocket client: {subscriber.websocket.remote_address}")
+            self._disconnect(subscriber, 1008, 'Slow consumer')
+        else:
+            self.dropped += 1
+            subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(frame)
+
+    def _disconnect(self, subscriber: Subscriber, code: int, reason: str) -> None:
+        """
+        Stops sending alerts to the client, its handler closes the connection with the code and the reason.
+        """
+        self._remove(subscriber)
+
+        # wake up the handler of the client so that it closes the connection
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait((code, reason))
+
+    def subscribe(self, subscriber: Subscriber, symbols=None, strategies=None, encoding: str = 'json',
+                  batch: bool = False) -> None:
+        """
+        Replaces the subscription of the client (symbols / strategies None - all of them).
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding}, supported: {', '.join(ENCODINGS)}")
+        if encoding == 'msgpack' and msgpack is None:
+            raise ValueError("msgpack is not installed")
+
+        self._unindex(subscriber)
+        subscriber.symbols = frozenset(str(symbol).upper() for symbol in symbols) if symbols is not None else None
+        subscriber.strategies = frozenset(strategies) if strategies is not None else None
+        subscriber.encoding = encoding
+        subscriber.batch = bool(batch)
+        self._index(subscriber)
+
+    def _index(self, subscriber: Subscriber) -> None:
+        if subscriber.symbols is None:
+            self.all_symbols.add(subscriber)
+            return
+        for symbol in subscriber.symbols:
+            self.by_symbol.setdefault(symbol, set()).add(subscriber)
+
+    def _unindex(self, subscriber: Subscriber) -> None:
+        if subscriber.symbols is None:
+            self.all_symbols.discard(subscriber)
+            return
+        for symbol in subscriber.symbols:
+            symbol_subscribers = self.by_symbol.get(symbol)
+            if symbol_subscribers is not None:
+                symbol_subscribers.discard(subscriber)
+                if not symbol_subscribers:
+                    del self.by_symbol[symbol]
+
+    def _remove(self, subscriber: Subscriber) -> None:
+        if self.subscribers.get(subscriber.websocket) is subscriber:
+            del self.subscribers[subscriber.websocket]
+            self._unindex(subscriber)
+
+    async def serve(self, websocket: WebSocketServerProtocol) -> None:
+        """
+        Registers the client and sends it messages from its queue until it disconnects or is evicted.
+        """
+        subscriber = Subscriber(websocket, self.queue_size)
+        self.subscribers[websocket] = subscriber
+        self._index(subscriber)
+        requests_task = asyncio.create_task(self.receive_requests(subscriber))
+        try:
+            while True:
+                message = await subscriber.queue.get()
+                if isinstance(message, tuple):
+                    # (code, reason) of a disconnect (see _disconnect)
+                    await websocket.close(*message)
+                    break
+                started = time.perf_counter()
+                await websocket.send(message)
+                WS_SEND_SECONDS.observe(time.perf_counter() - started)
+        finally:
+            requests_task.cancel()
+            self._remove(subscriber)
+
+    async def receive_requests(self, subscriber: Subscriber) -> None:
+        """
+        Answers the requests of the client until it disconnects.
+
+        A request that fails (a frame that is not JSON or msgpack, a missing field, a response that can not be
+        encoded) is logged and answered with an error, the next requests are still answered. An error of the
+        connection itself closes it.
+        """
+        try:
+            async for message in subscriber.websocket:
+                try:
+                    frame = encode(await self.handle_request(subscriber, message), subscriber.encoding)
+                except Exception as exp:
+                    logger.error(f"Websocket request of {subscriber.websocket.remote_address} {exp}")
+                    frame = encode({"event": "Error", "message": "Request failed"}, subscriber.encoding)
+                await subscriber.websocket.send(frame)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as exp:
+            logger.error(f"Websocket requests of {subscriber.websocket.remote_address} {exp}, closing the connection")
+            self._disconnect(subscriber, 1011, 'Internal error')
+
+    async def handle_request(self, subscriber: Subscriber, message) -> dict:
+        """
+        Answers a request of a client (JSON text, or msgpack binary):
+            - {"method": "subscribe", "symbols": ["BTCUSDT"], "strategies": ["default"], "encoding": "msgpack",
+              "batch": true} - only the alerts of the symbols and strategies (omitted or null - all of them),
+              in JSON (default) or msgpack frames, the alerts of a tick one by one (default) or in one frame
+              {"event": "Alerts", "E": ..., "alerts": [...]}; the response and everything after it comes
+              in the new encoding.
+            - {"method": "since", "t": <open time, ms>} - alerts of the klines opened since the time;
+              a reconnecting client sends the 't' of the last alert it received to get the missed ones.
+            - {"method": "last", "symbol": "BTCUSDT", "limit": 10} - the last alerts of the symbol.
+        An "id" of the request is returned in the response.
+
+        Returns:
+            {"event": "Subscribed", ...}, {"event": "History", "method": ..., "alerts": [...]} with the alerts
+            ordered by 't', or {"event": "Error", "message": ...}
+        """
+        request = {}
+        try:
+            request = decode(message)
+            method = request['method']
+            if method == 'subscribe':
+                self.subscribe(subscriber, request.get('symbols'), request.get('strategies'),
+                               request.get('encoding', 'json'), request.get('batch', False))
+                response = {"event": "Subscribed",
+                            "symbols": sorted(subscriber.symbols) if subscriber.symbols is not None else None,
+                            "strategies": sorted(subscriber.strategies) if subscriber.strategies is not None else None,
+                            "encoding": subscriber.encoding, "batch": subscriber.batch}
+            elif method == 'since':
+                alerts = await self.history.since(int(request['t']))
+                response = {"event": "History", "method": method, "alerts": alerts}
+            elif method == 'last':
+                alerts = await self.history.last(str(request['symbol']).upper(), int(request.get('limit', 10)))
+                response = {"event": "History", "method": method, "alerts": alerts}
+            else:
+                raise ValueError(f"Unknown method {method}")
+        except (ValueError, KeyError, TypeError) as exp:
+            response = {"event": "Error", "message": f"Bad request: {exp}"}
+        except Exception as exp:
+            logger.error(f"Websocket request {exp}")
+            response = {"event": "Error", "message": "Request failed"}
+
+        if isinstance(request, dict) and 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    async def ping(self, cooldown: int) -> None:
+        """
+        Sends a PING message to all clients every cooldown seconds.
+        """
+        while True:
+            await asyncio.sleep(cooldown)
+            self.broadcast({
+                "event": "PING",
+                "E": int(dt.utcnow().timestamp())
+            })
+
+
+BROADCASTER = Broadcaster(settings.WS_CLIENT_QUEUE_SIZE, settings.WS_SLOW_CLIENT_POLICY, ALERT_HISTORY)
+
+REGISTRY.collect('alert_server_ws_clients', 'Connected websocket clients', lambda: len(BROADCASTER.subscribers))
+REGISTRY.collect('alert_server_ws_dropped_total', 'Messages dropped for slow websocket clients',
+                 lambda: BROADCASTER.dropped, kind='counter')
+REGISTRY.collect('alert_server_ws_filtered_clients', 'Websocket clients subscribed to some symbols only',
+                 lambda: len(BROADCASTER.subscribers) - len(BROADCASTER.all_symbols))
+REGISTRY.collect('alert_server_ws_frames_total', 'Frames queued for the websocket clients',
+                 lambda: BROADCASTER.frames, kind='counter')
+REGISTRY.collect('alert_server_ws_evicted_total', 'Slow websocket clients disconnected',
+                 lambda: BROADCASTER.evicted, kind='counter')
 
 
 async def start_server(ip: str = "localhost", port: int = 8004) -> None:
@@ -24,66 +335,38 @@ async def start_server(ip: str = "localhost", port: int = 8004) -> None:
         :return: None
     """
 
-    async with websockets.serve(handle_ping,
-                                host=ip,
-                                port=port):
-        logger.info(f"Websocket server started. Address: ws://{ip}:{port}")
-        await asyncio.Future()
+    ping_task = asyncio.create_task(BROADCASTER.ping(PING_COOLDOWN))
+
+    try:
+        async with websockets.serve(handle_connection,
+                                    host=ip,
+                                    port=port,
+                                    compression=settings.WS_COMPRESSION or None):
+            logger.info(f"Websocket server started. Address: ws://{ip}:{port}")
+            await asyncio.Future()
+    finally:
+        ping_task.cancel()
 
 
-async def handle_ping(websocket: WebSocketServerProtocol):
+async def handle_connection(websocket: WebSocketServerProtocol):
     """
-        Sends a PING message to the websocket every PING_COOLDOWN seconds,
-        otherwise sends a message from the messages_queue
+        Sends alerts and PING messages from the broadcaster to the websocket
         :param websocket: Websocket connection
     """
 
-    last_ping_time = dt.utcnow()
-
-    CONNECTIONS.append(websocket)
     logger.info(f'New connection: {websocket.remote_address}')
-    while True:
-        try:
-            # Check if it's time to send a PING message
-            if (dt.utcnow() - last_ping_time).total_seconds() >= PING_COOLDOWN:
-                # Send the PING message as JSON
-                await websocket.send(ujson.dumps({
-                    "event": "PING",
-                    "E": int(dt.utcnow().timestamp())
-                }))
-
-                # Update the last ping time
-                last_ping_time = dt.utcnow()
-            else:
-                # Check if there are any messages in the queue
-                if MESSAGES_QUEUE:
-                    # Get the next message from the queue
-                    data = MESSAGES_QUEUE.pop(0)
-
-                    data['event'] = 'Alert'
-                    data['E'] = int(dt.utcnow().timestamp())
-
-                    # Send the message as JSON
-                    for connection in copy(CONNECTIONS):
-                        if not connection.closed:
-                            await connection.send(ujson.dumps(data))
-                        else:
-                            CONNECTIONS.remove(connection)
-
-                    await send_alert(data['symbol'])
-
-            await asyncio.sleep(0.25)
-        except (
-                websockets.exceptions.ConnectionClosed,
-                websockets.exceptions.ConnectionClosedOK,
-                websockets.exceptions.ConnectionClosedError
-        ):
-            CONNECTIONS.remove(websocket)
-            break
-        except Exception as e:
-            logger.exception(e)
+    try:
+        await BROADCASTER.serve(websocket)
+    except (
+            websockets.exceptions.ConnectionClosed,
+            websockets.exceptions.ConnectionClosedOK,
+            websockets.exceptions.ConnectionClosedError
+    ):
+        pass
+    except Exception as e:
+        logger.exception(e)
 
     logger.info(f"Websocket connection closed: {websocket.remote_address}")
 
 
-__all__ = ['start_server', 'MESSAGES_QUEUE']
+__all__ = ['start_server', 'BROADCASTER']
@@ -0,0 +1,188 @@
+import asyncio
+import time
+from typing import Dict, Iterable, List, Optional
+
+from loguru import logger
+
+import loader
+
+KLINE_INTERVAL_MS = 60_000
+
+
+def get_klines_weight(limit: int) -> int:
+    """
+    Request weight of GET /fapi/v1/klines with the limit.
+    """
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+class WeightBudget:
+    """
+    Keeps the REST requests within a request weight per minute (the IP limit of the exchange is shared
+    with the other requests of the server, so the backfill takes only a part of it).
+
+    The used weight is counted locally and synced with the X-MBX-USED-WEIGHT-1M reported by the exchange.
+    """
+
+    def __init__(self, weight_per_minute: int):
+        self.weight_per_minute = weight_per_minute
+        self.used = 0
+        self._minute = None
+
+        # metrics
+        self.total = 0
+        self.waited = 0.0
+
+    async def acquire(self, weight: int) -> None:
+        while True:
+            minute = int(time.time() // 60)
+            if minute != self._minute:
+                self._minute, self.used = minute, 0
+
+            if self.used + weight <= self.weight_per_minute:
+                self.used += weight
+                self.total += weight
+                return
+
+            delay = (minute + 1) * 60 - time.time()
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+    def sync(self, used_weight) -> None:
+        """
+        Takes the used weight reported by the exchange if it is higher than the local count.
+        """
+        try:
+            self.used = max(self.used, int(used_weight))
+        except (TypeError, ValueError):
+            pass
+
+
+async def fetch_closed_klines(symbol: str, limit: int, budget: WeightBudget, now_ms: int) -> List[dict]:
+    """
+    Fetches the last closed 1m klines of the symbol.
+
+    Returns:
+        list of klines in the format of the 'k' object of the kline stream event, from the oldest
+    """
+    # one more kline than needed: the last one is still open
+    await budget.acquire(get_klines_weight(limit + 1))
+    response = await loader.AIO_BINANCE_API_CLIENT.get_public_klines(symbol, '1m', limit=limit + 1)
+    budget.sync(response.get('limit_usage'))
+
+    klines = []
+    for open_time, open_price, high, low, close, _, close_time, quote_volume, *_ in response.get('data', []):
+        if close_time >= now_ms:
+            continue
+        klines.append({"t": open_time, "s": symbol, "i": "1m", "x": True,
+                       "o": open_price, "h": high, "l": low, "c": close, "q": quote_volume})
+    return klines[-limit:]
+
+
+def missing_klines(symbols: Iterable[str], last_open_times: Dict[str, int], limit: int, now_ms: int) -> Dict[str, int]:
+    """
+    Number of the closed 1m klines of every symbol after its last known one (at most limit).
+    """
+    last_closed_open_time = now_ms // KLINE_INTERVAL_MS * KLINE_INTERVAL_MS - KLINE_INTERVAL_MS
+    limits = {}
+    for symbol in symbols:
+        last_open_time = last_open_times.get(symbol)
+        if last_open_time is None:
+            limits[symbol] = limit
+        else:
+            limits[symbol] = min(limit, max(0, (last_closed_open_time - last_open_time) // KLINE_INTERVAL_MS))
+    return limits
+
+
+async def backfill_klines(symbols: Iterable[str], limit: int, concurrency: int,
+                          weight_per_minute: int, limits: Optional[Dict[str, int]] = None) -> List[dict]:
+    """
+    Fetches the last closed klines of all symbols concurrently.
+
+    Args:
+        symbols: The symbols to backfill.
+        limit: Closed klines per symbol (the window size).
+        concurrency: The maximum number of requests in flight.
+        weight_per_minute: The request weight budget of the backfill.
+        limits: Closed klines of the symbols that need less than limit (restored from a snapshot, see
+            missing_klines), the symbols with 0 are not requested.
+
+    Returns:
+        list of closed kline events of all symbols ordered by open time, in the format of the stream,
+        so they can go through event_batch as if they were received live
+    """
+    started = time.monotonic()
+    limits = {symbol: limits.get(symbol, limit) if limits else limit for symbol in symbols}
+    symbols = [symbol for symbol, symbol_limit in limits.items() if symbol_limit > 0]
+    budget = WeightBudget(weight_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+    now_ms = int(time.time() * 1000)
+    failed = []
+
+    async def fetch(symbol: str) -> List[dict]:
+        async with semaphore:
+            try:
+                return await fetch_closed_klines(symbol, limits[symbol], budget, now_ms)
+            except Exception as exp:
+                logger.error(f'Backfill {symbol} {exp}')
+                failed.append(symbol)
+                return []
+
+    results = await asyncio.gather(*(fetch(symbol) for symbol in symbols))
+
+    events = sorted(({"e": "kline", "s": kline["s"], "k": kline} for klines in results for kline in klines),
+                    key=lambda event: event["k"]["t"])
+
+    complete = sum(len(klines) == limits[symbol] for symbol, klines in zip(symbols, results))
+    logger.info(f"Backfill of {len(symbols)} symbols done in {time.monotonic() - started:.2f}s: "
+                f"{len(events)} klines, {complete} symbols complete (alerts possible now), {len(failed)} failed, "
+                f"weight {budget.total}, waited for weight {budget.waited:.1f}s")
+    return events
+
+
+class KlineSequence:
+    """
+    Last closed kline open time of every symbol.
+
+    The backfilled klines and the live stream overlap at the start, and the streams may repeat
+    a kline after a reconnect, so a closed kline that is not newer than the last one is skipped.
+    """
+
+    def __init__(self):
+        self.last_open_times = {}
+
+        # metrics
+        self.duplicates = 0
+        self.gaps = 0
+
+    def accept(self, kline_data: dict) -> bool:
+        symbol = kline_data['s']
+        open_time = int(kline_data['t'])
+        last_open_time = self.last_open_times.get(symbol)
+
+        if last_open_time is not None:
+            if open_time <= last_open_time:
+                self.duplicates += 1
+                return False
+            if open_time - last_open_time > KLINE_INTERVAL_MS:
+                self.gaps += 1
+                logger.warning(f"Gap in klines of {symbol}: {(open_time - last_open_time) // KLINE_INTERVAL_MS - 1} "
+                               f"missed after {last_open_time}")
+
+        self.last_open_times[symbol] = open_time
+        return True
+
+    def forget(self, symbol: str) -> Optional[int]:
+        return self.last_open_times.pop(symbol, None)
+
+
+KLINE_SEQUENCE = KlineSequence()
+
+__all__ = ['backfill_klines', 'missing_klines', 'fetch_closed_klines', 'WeightBudget', 'KlineSequence',
+           'KLINE_SEQUENCE']
@@ -0,0 +1,191 @@
+import numpy as np
+
+import settings
+from utils.checks import SUM_ERROR, WindowRecord
+from utils.klines import Kline, QUOTE_VOLUME_SCALE
+
+# fields of the kline matrix
+OPEN_TIME, HIGH, LOW, QUOTE_VOLUME = range(4)
+
+# exact quote volume sums: every volume is stored as the fixed-point integer int(volume * 2**62)
+# (the same as the scalar windows) split into int64 limbs that can be summed without overflow
+FRACTION_BITS = 62
+LIMB_BITS = 31
+LIMB_MASK = (1 << LIMB_BITS) - 1
+
+
+class KlineMatrix:
+    """
+    Kline windows of all symbols in one symbols x klines x fields NumPy matrix (ring buffer per row).
+
+    Closed klines of a tick are added with add() and evaluate() runs the window checks (№1-5) for all
+    the symbols of the tick at once as column operations. The results are the same as check_window()
+    of the scalar windows, bit for bit.
+    """
+
+    def __init__(self, capacity: int, rows: int = 512):
+        self.capacity = capacity
+        self.symbols = []
+        self.rows = {}
+        self.data = np.zeros((rows, capacity, 4), dtype=np.float64)
+        self.limbs = np.zeros((rows, capacity, 3), dtype=np.int64)
+        self.heads = np.zeros(rows, dtype=np.int64)
+        self.counts = np.zeros(rows, dtype=np.int64)
+        self._pending = {}
+        self._free_rows = []
+
+    def row_of(self, symbol: str) -> int:
+        row = self.rows.get(symbol)
+        if row is None:
+            if self._free_rows:
+                row = self.rows[symbol] = self._free_rows.pop()
+                self.symbols[row] = symbol
+                return row
+
+            row = self.rows[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            if row == len(self.heads):
+                self._grow()
+        return row
+
+    def forget(self, symbol: str) -> None:
+        """
+        Frees the row of the symbol for another symbol.
+        """
+        row = self.rows.pop(symbol, None)
+        if row is not None:
+            self._pending.pop(row, None)
+            self.symbols[row] = None
+            self.heads[row] = 0
+            self.counts[row] = 0
+            self._free_rows.append(row)
+
+    def _grow(self) -> None:
+        rows = len(self.heads) * 2
+        self.data = np.concatenate([self.data, np.zeros_like(self.data)])
+        self.limbs = np.concatenate([self.limbs, np.zeros_like(self.limbs)])
+        self.heads = np.resize(self.heads, rows)
+        self.counts = np.resize(self.counts, rows)
+        self.heads[rows // 2:] = 0
+        self.counts[rows // 2:] = 0
+
+    def add(self, kline_data: dict) -> list:
+        """
+        Adds a closed kline of the current tick.
+
+        Returns:
+            Results of the previous tick of the symbol if it was not evaluated yet (see evaluate()).
+        """
+        row = self.row_of(kline_data['s'])
+        results = self.evaluate() if row in self._pending else []
+        self._pending[row] = self._store(row, kline_data)
+        return results
+
+    def load(self, kline_data: dict) -> None:
+        """
+        Adds a closed kline without checking it (restored state, see utils.snapshot).
+        """
+        row = self.row_of(kline_data['s'])
+        if row in self._pending:
+            self.evaluate()
+        slot = self._store(row, kline_data)
+        # the pending klines are split by evaluate(), the loaded ones are never pending
+        fixed = int(float(kline_data['q']) * QUOTE_VOLUME_SCALE)
+        fraction = fixed & ((1 << FRACTION_BITS) - 1)
+        self.limbs[row, slot] = (fixed >> FRACTION_BITS, fraction >> LIMB_BITS, fraction & LIMB_MASK)
+
+    def _store(self, row: int, kline_data: dict) -> int:
+        slot = self.heads[row]
+        self.data[row, slot] = (int(kline_data['t']), float(kline_data['h']),
+                                float(kline_data['l']), float(kline_data['q']))
+        self.heads[row] = (slot + 1) % self.capacity
+        self.counts[row] = min(self.counts[row] + 1, self.capacity)
+        return slot
+
+    def evaluate(self) -> list:
+        """
+        Runs the window checks for all the symbols added since the last call.
+
+        Returns:
+            list of (symbol, new kline, WindowRecord) of the symbols that passed the checks
+        """
+        if not self._pending:
+            return []
+
+        rows = np.fromiter(self._pending.keys(), dtype=np.int64, count=len(self._pending))
+        new_slots = np.fromiter(self._pending.values(), dtype=np.int64, count=len(self._pending))
+        self._pending = {}
+        self._split_volumes(rows, new_slots)
+
+        rows = rows[self.counts[rows] == self.capacity]
+        if not len(rows):
+            return []
+
+        windows = self.data[rows]
+        index = np.arange(len(rows))
+        last = (self.heads[rows] - 1) % self.capacity
+        penultimate = (self.heads[rows] - 2) % self.capacity
+
+        new_high = windows[index, last, HIGH]
+        new_volume = windows[index, last, QUOTE_VOLUME]
+        penultimate_low = windows[index, penultimate, LOW]
+
+        # lowest low without the new kline and the highest high of the klines with this low
+        lows = windows[:, :, LOW].copy()
+        lows[index, last] = np.inf
+        min_price = lows.min(axis=1)
+        max_in_min_price = np.where(lows == min_price[:, None], windows[:, :, HIGH], -np.inf).max(axis=1)
+
+        sum_volume = self._sum_volumes(rows)
+        average_volume = sum_volume / self.capacity
+        self._sum_near_threshold(sum_volume, windows, self.heads[rows], settings.AVG_INCREASE)
+
+        result = new_volume >= average_volume * settings.VOLUME_MULTIPLE
+        result &= sum_volume > settings.AVG_INCREASE
+        result &= (new_high - min_price) >= min_price * (settings.PERCENT_TO_MAX_PRICE_EXCEEDS_MIN / 100)
+        result &= (new_high - penultimate_low) <= penultimate_low * (settings.WITHIN_THRESHOLD / 100)
+        result &= new_high >= max_in_min_price
+
+        candidates = []
+        for position in np.flatnonzero(result):
+            row = rows[position]
+            new_candle = Kline(*self._kline(row, last[position]))
+            record = WindowRecord(new_candle, Kline(*self._kline(row, penultimate[position])),
+                                  float(average_volume[position]), float(sum_volume[position]),
+                                  float(min_price[position]), float(max_in_min_price[position]), (True,) * 5)
+            candidates.append((self.symbols[row], new_candle, record))
+        return candidates
+
+    def _kline(self, row: int, slot: int) -> tuple:
+        open_time, high, low, quote_volume = self.data[row, slot].tolist()
+        return int(open_time), high, low, quote_volume
+
+    def _split_volumes(self, rows: np.ndarray, slots: np.ndarray) -> None:
+        volumes = self.data[rows, slots, QUOTE_VOLUME]
+        integer = np.floor(volumes)
+        fraction = np.floor((volumes - integer) * float(1 << FRACTION_BITS)).astype(np.int64)
+        self.limbs[rows, slots, 0] = integer.astype(np.int64)
+        self.limbs[rows, slots, 1] = fraction >> LIMB_BITS
+        self.limbs[rows, slots, 2] = fraction & LIMB_MASK
+
+    def _sum_volumes(self, rows: np.ndarray) -> np.ndarray:
+        sums = self.limbs[rows].sum(axis=1).tolist()
+        # correctly rounded conversion of the exact sums, the same as the scalar WindowStats.quote_sum
+        return np.array([((integer << FRACTION_BITS) + (high << LIMB_BITS) + low) / QUOTE_VOLUME_SCALE
+                         for integer, high, low in sums])
+
+    def _sum_near_threshold(self, sum_volume: np.ndarray, windows: np.ndarray, heads: np.ndarray,
+                            volume: float) -> None:
+        """
+        Replaces the exact sums that are within the rounding error of sum() from the threshold with sum() of the
+        klines from the oldest one, the same as the scalar get_sum_volume().
+        """
+        near = np.abs(sum_volume - volume) <= self.capacity * (sum_volume * SUM_ERROR + 1 / QUOTE_VOLUME_SCALE)
+        for position in np.flatnonzero(near):
+            order = (heads[position] + np.arange(self.capacity)) % self.capacity
+            sum_volume[position] = sum(windows[position, order, QUOTE_VOLUME].tolist())
+
+
+KLINE_MATRIX = KlineMatrix(settings.MAXIMUM_KLINES) if settings.CHECK_ENGINE == 'vector' else None
+
+__all__ = ['KlineMatrix', 'KLINE_MATRIX']
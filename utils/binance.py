@@ -1,6 +1,7 @@
 import asyncio
+import time
 from datetime import datetime as dt
-from typing import List
+from typing import Awaitable, List, Optional
 
 from loguru import logger
 
@@ -9,29 +10,64 @@ import settings
 import utils
 import utils.alerts_ws
 import utils.telegram
-from db_utils.database import session as db_session
-from db_utils.models import FutureAlert
-from loader import BINANCE_WEBSOCKET_MANAGER
-from utils.checks import all_checks
-from utils.other_func import distribute_pairs_to_threads
+import utils.workers
+from utils.batch_checks import KLINE_MATRIX
+from db_utils.writer import ALERT_WRITER
+from utils.alerts_cache import DEFAULT_STRATEGY, DEFAULT_TIMEFRAME, set_last_alert, forget_last_alert
+from utils.backfill import backfill_klines, missing_klines, KLINE_SEQUENCE
+from utils.checks import final_checks
+from utils.daily_volume import DAILY_VOLUMES
+from utils.ingest import STREAM_INBOX
+from utils.klines import new_window
+from utils.metrics import (
+    REGISTRY, EVENT_LAG_SECONDS, EVENT_ADAPTER_SECONDS, ALL_CHECKS_SECONDS, VECTOR_CHECKS_SECONDS,
+    DAILY_VOLUME_CHECK_SECONDS, KLINES_TOTAL, ALERTS_TOTAL,
+)
+from utils.other_func import plan_stream_shards, assign_to_streams, diff_stream_pairs
+from utils.recorder import KLINE_RECORDER
+from utils.resources import RESOURCES
+from utils.snapshot import STATE_SNAPSHOTS
+from utils.strategies import all_checks
+from utils.timeframes import TIMEFRAMES
 
 
 async def receive_data_from_stream():
     """
-    Receives data from the stream buffer and passes it to the event adapter.
+    Receives batches of data pushed by the streams and passes them to the event adapter.
 
     Notes:
         - This function runs indefinitely in a loop.
+        - The whole batch is processed in this task, without a task per message.
     """
 
-    logger.info("Thread \'Receive data from stream\' started!")
+    logger.info("Task \'Receive data from stream\' started!")
     while True:
-        data_from_stream_buffer = BINANCE_WEBSOCKET_MANAGER.pop_stream_data_from_stream_buffer()
+        batch = await STREAM_INBOX.get_batch()
+        await event_batch(batch)
 
-        if data_from_stream_buffer:
-            await event_adapter(data_from_stream_buffer)
-        else:
-            await asyncio.sleep(0.1)
+        if STREAM_INBOX.last_batch_size > 1:
+            logger.debug(f"Stream batch processed {STREAM_INBOX.stats()}")
+
+
+async def event_batch(batch: list):
+    """
+    Passes a batch of stream data to the event adapter and runs the batch-level checks.
+
+    Args:
+        batch (list): The data received from the streams.
+    """
+    for data_from_stream in batch:
+        started = time.perf_counter()
+        await event_adapter(data_from_stream)
+        EVENT_ADAPTER_SECONDS.observe(time.perf_counter() - started)
+
+    if utils.workers.DETECTOR_POOL is not None:
+        utils.workers.DETECTOR_POOL.flush()
+    elif KLINE_MATRIX is not None:
+        started = time.perf_counter()
+        candidates = KLINE_MATRIX.evaluate()
+        VECTOR_CHECKS_SECONDS.observe(time.perf_counter() - started)
+        await event_candidates(candidates)
 
 
 async def event_adapter(data: dict):
@@ -47,7 +83,7 @@ async def event_adapter(data: dict):
         event_type = event_data.get('e', None)
 
         if event_type == 'kline':
-            asyncio.create_task(event_kline(event_data))
+            await event_kline(event_data)
 
 
 async def event_kline(data: dict):
@@ -59,109 +95,284 @@ async def event_kline(data: dict):
     """
     kline_data = data.get('k', None)
     if kline_data and kline_data.get('x', False):
+        if not KLINE_SEQUENCE.accept(kline_data):
+            # already received (backfill overlap or a repeat after reconnect)
+            return
+
+        KLINES_TOTAL.inc()
+        if 'E' in data:
+            EVENT_LAG_SECONDS.observe(time.time() - data['E'] / 1000)
+
+        if KLINE_RECORDER is not None:
+            KLINE_RECORDER.append(kline_data)
+
+        # higher timeframes are built from the 1m klines, whatever engine checks the 1m windows
+        for timeframe in TIMEFRAMES:
+            for open_time, strategies in timeframe.add(kline_data):
+                await event_alert(kline_data['s'], open_time, strategies, timeframe.interval)
+
+        if utils.workers.DETECTOR_POOL is not None:
+            # the window checks run in the worker that owns the symbol
+            utils.workers.DETECTOR_POOL.submit(kline_data)
+            return
+
+        if KLINE_MATRIX is not None:
+            # the window checks run for the whole batch at once (see receive_data_from_stream)
+            await event_candidates(KLINE_MATRIX.add(kline_data))
+            return
+
         symbol = kline_data.get('s')
-        candle = loader.KLINES_DATA.get(symbol, [])
-        candle.append(kline_data)
-
-        if len(candle) > settings.MAXIMUM_KLINES:
-            candle.pop(0)
-
-        check_status = await all_checks(symbol) if len(candle) >= settings.MAXIMUM_KLINES else False
-
-        if check_status:
-            # check daily volume of symbol
-            result_check, log = await check_daily_volume(symbol)
-            if result_check:
-                logger.info(f"Alert {symbol} {result_check} - {log}")
-                last_candle_dt = dt.fromtimestamp(
-                    kline_data.get('t') / 1000
-                )
-                # add alert to database
-                new_alert = FutureAlert(future=symbol, date_time=last_candle_dt)
-                db_session.add(new_alert)
-                db_session.commit()
-
-                if len(utils.alerts_ws.CONNECTIONS) > 0:
-                    utils.alerts_ws.MESSAGES_QUEUE.append({"symbol": symbol})
-                else:
-                    await utils.telegram.send_alert({"symbol": symbol})
-            else:
-                logger.info(f"Remove Alert {symbol} {result_check} - {log}")
+        window = loader.KLINES_DATA.get(symbol)
+        if window is None:
+            window = loader.KLINES_DATA[symbol] = new_window()
+        window.append(kline_data)
+
+        alerted_strategies = []
+        if window.is_full():
+            started = time.perf_counter()
+            alerted_strategies = await all_checks(symbol, window)
+            ALL_CHECKS_SECONDS.observe(time.perf_counter() - started)
+
+        if alerted_strategies:
+            await event_alert(symbol, kline_data.get('t'), alerted_strategies)
+
+
+async def receive_detector_results():
+    """
+    Receives the candidates found by the detector workers and finishes their checks in the main process.
+
+    Notes:
+        - This function runs until the detector pool is stopped.
+    """
+    logger.info("Task \'Receive detector results\' started!")
+    async for candidate in utils.workers.DETECTOR_POOL.results():
+        await event_candidates([candidate])
+
+
+async def event_candidates(candidates: list):
+    """
+    Finishes the checks of the symbols that passed the window checks.
+
+    Args:
+        candidates (list): (symbol, new kline, window checks record) of every symbol.
+    """
+    for symbol, new_candle, window_record in candidates:
+        if final_checks(symbol, new_candle, True, window_record):
+            await event_alert(symbol, new_candle.open_time)
+
+
+async def event_alert(symbol: str, open_time: int, strategies: Optional[List[str]] = None,
+                      timeframe: str = DEFAULT_TIMEFRAME):
+    """
+    Checks the daily volume of the symbol that passed the checks and sends the alert.
+
+    Args:
+        symbol (str): The symbol.
+        open_time (int): The open time of the kline that triggered the alert (ms).
+        strategies (list): The strategies that alerted (None - the default one), each has its own cooldown.
+        timeframe (str): The timeframe of the kline, the cooldowns of every timeframe are separate.
+    """
+    # check daily volume of symbol
+    started = time.perf_counter()
+    result_check, log = await check_daily_volume(symbol)
+    DAILY_VOLUME_CHECK_SECONDS.observe(time.perf_counter() - started)
+    if result_check:
+        ALERTS_TOTAL.inc()
+        logger.info(f"Alert {symbol} {result_check} - {log}")
+        last_candle_dt = dt.fromtimestamp(
+            open_time / 1000
+        )
+        strategies = strategies or [DEFAULT_STRATEGY]
+        for strategy in strategies:
+            # add alert to database (in the background)
+            await ALERT_WRITER.submit(symbol, last_candle_dt, strategy, timeframe)
+            set_last_alert(symbol, last_candle_dt, strategy, timeframe)
+
+        message = {"symbol": symbol, "t": open_time, "timeframe": timeframe}
+        if strategies != [DEFAULT_STRATEGY]:
+            message["strategies"] = strategies
+        utils.alerts_ws.BROADCASTER.publish(message)
+        await utils.telegram.send_alert(symbol if timeframe == DEFAULT_TIMEFRAME else f"{symbol} {timeframe}",
+                                        key=open_time)
+    else:
+        logger.info(f"Remove Alert {symbol} {result_check} - {log}")
 
 
 async def update_markets():
     """
-    Updates the markets by subscribing to new symbols that are not in the current stream.
+    Reconciles the subscribed markets with the symbols listed by the exchange.
 
     Note:
         - This function runs indefinitely in a loop.
+        - Only the difference is sent: the delisted symbols are unsubscribed and their state is freed, the new
+          symbols go to the least loaded streams with free room, new streams are created when all are full.
+        - A refresh without changes sends nothing. An unsubscribe request carries only the removed symbols,
+          but the manager builds a subscribe request from all the markets of the stream, so adding symbols
+          resends the whole stream (at most MAX_SUBSCRIPTIONS_PER_STREAM markets).
     """
-    logger.info("Thread \'Update markets\' started!")
+    logger.info("Task \'Update markets\' started!")
     while True:
         bn_symbols = await receive_symbols()
-        first_symbols, second_symbols = distribute_pairs_to_threads(bn_symbols, 'K')
-        first_stream_info = BINANCE_WEBSOCKET_MANAGER.get_stream_info(loader.FIRST_KLINE_STREAM_ID)
-        second_stream_info = BINANCE_WEBSOCKET_MANAGER.get_stream_info(loader.SECOND_KLINE_STREAM_ID)
-
-        for symbol in first_symbols:
-            if symbol.lower() not in first_stream_info['markets']:
-                await subscribe_to_stream(symbol, loader.FIRST_KLINE_STREAM_ID)
-
-        for symbol in second_symbols:
-            if symbol.lower() not in second_stream_info['markets']:
-                await subscribe_to_stream(symbol, loader.SECOND_KLINE_STREAM_ID)
+        if not bn_symbols:
+            # the exchange did not answer, an empty list would unsubscribe everything
+            await asyncio.sleep(settings.UPDATE_SYMBOLS_COOLDOWN)
+            continue
+
+        websocket_manager = loader.BINANCE_WEBSOCKET_MANAGER
+        streams = {
+            stream_id: [market.upper() for market in websocket_manager.get_stream_info(stream_id)['markets']]
+            for stream_id in loader.KLINE_STREAM_IDS
+        }
+        new_symbols, removed = diff_stream_pairs(bn_symbols, streams)
+
+        for stream_id, symbols in removed.items():
+            unsubscribe_from_stream(stream_id, symbols)
+            gone = set(symbols)
+            streams[stream_id] = [symbol for symbol in streams[stream_id] if symbol not in gone]
+            forget_symbols(symbols)
+
+        if new_symbols:
+            assigned, not_assigned = assign_to_streams(new_symbols, streams, settings.MAX_SUBSCRIPTIONS_PER_STREAM,
+                                                       DAILY_VOLUMES.volumes)
+            for stream_id, symbols in assigned.items():
+                subscribe_to_stream(stream_id, symbols)
+
+            if not_assigned:
+                loader.KLINE_STREAM_IDS.extend(create_kline_streams(not_assigned, min_streams=1))
+
+        if new_symbols or removed:
+            logger.info(f"Markets updated: {len(new_symbols)} subscribed, "
+                        f"{sum(len(symbols) for symbols in removed.values())} unsubscribed")
 
         await asyncio.sleep(settings.UPDATE_SYMBOLS_COOLDOWN)
 
 
-async def subscribe_to_stream(symbol: str, stream_id: str):
+def subscribe_to_stream(stream_id: str, symbols: List[str]):
     """
-    Subscribes to a data stream for a specific symbol.
+    Subscribes the stream to the symbols. The manager adds them to the markets of the stream and resends all
+    of them (split to the exchange limits), not only the new ones.
 
     Args:
-        stream_id: The stream id to subscribe to the symbol.
-        symbol (str): The symbol to subscribe to.
+        stream_id: The stream id to subscribe to the symbols.
+        symbols: The symbols to subscribe to.
     """
-
-    BINANCE_WEBSOCKET_MANAGER.subscribe_to_stream(
+    loader.BINANCE_WEBSOCKET_MANAGER.subscribe_to_stream(
         stream_id=stream_id,
         channels="kline_1m",
-        markets=symbol
+        markets=list(symbols)
     )
 
-    if symbol not in loader.KLINES_DATA:
-        loader.KLINES_DATA[symbol] = []
+    for symbol in symbols:
+        if symbol not in loader.KLINES_DATA:
+            loader.KLINES_DATA[symbol] = new_window()
 
 
-async def create_streams():
+def unsubscribe_from_stream(stream_id: str, symbols: List[str]):
     """
-    Creates a data stream (kline_15m)
+    Unsubscribes the stream from the symbols with one request, the other symbols of the stream stay subscribed.
+
+    Args:
+        stream_id: The stream id to unsubscribe from the symbols.
+        symbols: The symbols to unsubscribe from.
+    """
+    # only the markets: with the channels the manager would unsubscribe all the markets of the channel;
+    # a copy, the manager lowercases the list in place
+    loader.BINANCE_WEBSOCKET_MANAGER.unsubscribe_from_stream(
+        stream_id=stream_id,
+        markets=list(symbols)
+    )
+
+
+def forget_symbols(symbols: List[str]):
+    """
+    Frees the windows, the last alerts and the other per-symbol state of the unsubscribed symbols.
+    """
+    for symbol in symbols:
+        loader.KLINES_DATA.pop(symbol, None)
+        KLINE_SEQUENCE.forget(symbol)
+        forget_last_alert(symbol)
+        for timeframe in TIMEFRAMES:
+            timeframe.aggregator.forget(symbol)
+        if KLINE_MATRIX is not None:
+            KLINE_MATRIX.forget(symbol)
+
+    if utils.workers.DETECTOR_POOL is not None:
+        utils.workers.DETECTOR_POOL.forget(symbols)
+
+
+def create_kline_streams(symbols: List[str], min_streams: int) -> List[str]:
+    """
+    Creates kline_1m streams for the symbols, split into shards of at most MAX_SUBSCRIPTIONS_PER_STREAM
+    symbols balanced by their 24h quote volume.
 
     Returns:
-        stream_id(str) or False
+        list of stream ids
     """
-    symbols = await receive_symbols()
+    shards = plan_stream_shards(symbols, settings.MAX_SUBSCRIPTIONS_PER_STREAM, min_streams, DAILY_VOLUMES.volumes)
 
-    first_pairs, second_pairs = distribute_pairs_to_threads(symbols, 'K')
+    stream_ids = []
+    for shard in shards:
+        if not shard:
+            continue
 
-    first_stream = BINANCE_WEBSOCKET_MANAGER.create_stream(
-        channels="kline_1m",
-        markets=first_pairs,
-        stream_label='kline_1m_first_part',
-        output="dict"
-    )
+        stream_ids.append(loader.BINANCE_WEBSOCKET_MANAGER.create_stream(
+            channels="kline_1m",
+            markets=shard,
+            stream_label=f'kline_1m_part_{len(loader.KLINE_STREAM_IDS) + len(stream_ids) + 1}',
+            output="dict",
+            process_stream_data=STREAM_INBOX.push
+        ))
+        logger.info(f"Created kline stream with {len(shard)} symbols")
 
-    second_stream = BINANCE_WEBSOCKET_MANAGER.create_stream(
-        channels="kline_1m",
-        markets=second_pairs,
-        stream_label='kline_1m_second_part',
-        output="dict"
+        for symbol in shard:
+            if symbol not in loader.KLINES_DATA:
+                loader.KLINES_DATA[symbol] = new_window()
+
+    return stream_ids
+
+
+async def create_streams(before_checks: Optional[Awaitable] = None):
+    """
+    Creates the data streams (kline_1m) for all symbols and backfills their kline windows.
+
+    Notes:
+        - The streams are created first and buffer the live klines in the stream inbox while the last closed
+          klines are fetched from REST, so there is no gap between them; the overlap is skipped by event_kline.
+        - The backfilled klines go through event_batch before the live ones, so the windows are full and
+          alerts are possible right after the start instead of after MAXIMUM_KLINES minutes.
+        - With a state snapshot (SNAPSHOT_FILE) the windows are restored from it and only the klines
+          closed after the snapshot are backfilled.
+        - The symbols and the 24h volumes are fetched while the websocket manager is created; the checks of
+          the backfilled klines wait for before_checks (e.g. the last alerts loaded from the database).
+
+    Returns:
+        list of stream ids
+    """
+    started = time.monotonic()
+    symbols, refreshed, websocket_manager = await asyncio.gather(
+        receive_symbols(), DAILY_VOLUMES.refresh(), RESOURCES.prepare('BINANCE_WEBSOCKET_MANAGER'),
+        return_exceptions=True,
     )
+    if isinstance(websocket_manager, Exception):
+        raise websocket_manager
+    if isinstance(refreshed, Exception):
+        logger.error(f'Refresh daily volumes {refreshed}')
 
-    for symbol in symbols:
-        loader.KLINES_DATA[symbol] = []
+    stream_ids = create_kline_streams(symbols, settings.MIN_KLINE_STREAMS)
+
+    restored = STATE_SNAPSHOTS.restore(symbols, settings.MAXIMUM_KLINES) if STATE_SNAPSHOTS is not None else {}
 
-    return first_stream, second_stream
+    if settings.BACKFILL_CONCURRENCY > 0:
+        limits = missing_klines(symbols, restored, settings.MAXIMUM_KLINES, int(time.time() * 1000))
+        backfilled = await backfill_klines(symbols, settings.MAXIMUM_KLINES, settings.BACKFILL_CONCURRENCY,
+                                           settings.BACKFILL_WEIGHT_PER_MINUTE, limits)
+        if before_checks is not None:
+            await before_checks
+        await event_batch(backfilled)
+
+    logger.info(f"Streams and windows of {len(symbols)} symbols ready in {time.monotonic() - started:.2f}s "
+                f"({len(restored)} restored from the state snapshot)")
+    return stream_ids
 
 
 async def receive_symbols() -> List[str]:
@@ -173,7 +384,9 @@ async def receive_symbols() -> List[str]:
     """
 
     try:
-        exchange_info = await loader.AIO_BINANCE_API_CLIENT.get_public_exchange_info()
+        # the first call creates the client (and imports aio-binance) in a thread
+        client = await RESOURCES.prepare('AIO_BINANCE_API_CLIENT')
+        exchange_info = await client.get_public_exchange_info()
 
         bn_symbols = [elem["symbol"].upper() for elem in exchange_info['data']["symbols"]
                       if elem["symbol"].endswith("USDT") and elem["contractType"] == "PERPETUAL"
@@ -202,6 +415,18 @@ async def get_daily_quote_volume(symbol) -> float:
 
 
 async def check_daily_volume(symbol: str) -> tuple:
-    volume = await get_daily_quote_volume(symbol)
+    volume = DAILY_VOLUMES.get(symbol)
+    if volume is None:
+        # the table is stale or does not know the symbol yet
+        volume = await get_daily_quote_volume(symbol)
+
     result = volume >= settings.MIN_DAILY_VOLUME
     return result, f"quote volume {volume} > {settings.MIN_DAILY_VOLUME}"
+
+
+REGISTRY.collect('alert_server_kline_streams', 'Kline streams', lambda: len(loader.KLINE_STREAM_IDS))
+REGISTRY.collect('alert_server_kline_windows', 'Symbols with a kline window', lambda: len(loader.KLINES_DATA))
+REGISTRY.collect('alert_server_kline_duplicates_total', 'Closed klines skipped as already received',
+                 lambda: KLINE_SEQUENCE.duplicates, kind='counter')
+REGISTRY.collect('alert_server_kline_gaps_total', 'Gaps in the closed klines of a symbol',
+                 lambda: KLINE_SEQUENCE.gaps, kind='counter')
@@ -0,0 +1,115 @@
+import queue
+import random
+import threading
+from typing import Optional
+
+import ujson
+from loguru import logger
+
+import settings
+
+
+class RecordsThread:
+    """
+    Hands the check records over to a background thread, so the checks only put them on a queue.
+    """
+
+    name = 'check-records'
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def put(self, record) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self.thread.start()
+        self.queue.put(record)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+
+    def _run(self) -> None:
+        while True:
+            records = [self.queue.get()]
+            # everything queued meanwhile is handled at once
+            while not self.queue.empty():
+                records.append(self.queue.get())
+
+            stop = None in records
+            self.write([record for record in records if record is not None])
+            if stop:
+                return
+
+    def write(self, records: list) -> None:
+        raise NotImplementedError
+
+
+class CheckRecordsFile(RecordsThread):
+    """
+    Writes the check records as JSON lines, in one write per batch.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def write(self, records: list) -> None:
+        if records:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write('\n'.join(ujson.dumps(record.to_dict()) for record in records) + '\n')
+
+
+class CheckLogLines(RecordsThread):
+    """
+    Formats the check records to the log lines and logs them.
+    """
+
+    name = 'check-log'
+
+    def write(self, records: list) -> None:
+        for record in records:
+            logger.info(str(record))
+
+
+class CheckLog:
+    """
+    Writes the check records of the closed klines.
+
+    Symbols that passed all the checks are always logged, the other evaluations only with the probability
+    sample_rate (1 - all, 0 - none). The checks hand the raw record over, its log line is formatted and
+    logged by a background thread.
+    If records_path is set, every evaluation also goes to that JSON lines file (see utils.replay --compare).
+    """
+
+    def __init__(self, sample_rate: float, records_path: str = ''):
+        self.sample_rate = sample_rate
+        self.lines = CheckLogLines()
+        self.records = CheckRecordsFile(records_path) if records_path else None
+
+        # metrics
+        self.logged = 0
+        self.skipped = 0
+
+    def write(self, record, result: bool) -> None:
+        if result or self.sample_rate >= 1 or random.random() < self.sample_rate:
+            self.lines.put(record)
+            self.logged += 1
+        else:
+            self.skipped += 1
+
+        if self.records is not None:
+            self.records.put(record)
+
+    def close(self) -> None:
+        self.lines.close(settings.SHUTDOWN_TIMEOUT)
+        if self.records is not None:
+            self.records.close(settings.SHUTDOWN_TIMEOUT)
+
+
+CHECK_LOG = CheckLog(settings.CHECK_LOG_SAMPLE_RATE, settings.CHECK_RECORDS_FILE)
+
+__all__ = ['CheckLog', 'CheckLogLines', 'CheckRecordsFile', 'CHECK_LOG']
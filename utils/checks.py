@@ -1,142 +1,329 @@
-from statistics import fmean
 from datetime import datetime, timedelta
+from typing import Optional
 
-from loguru import logger
-from sqlalchemy import desc
-
-import loader
 import settings
-from db_utils.database import session as db_session
-from db_utils.models import FutureAlert
+from utils.alerts_cache import get_last_alert
+from utils.check_log import CHECK_LOG
+from utils.klines import Kline, KlineWindow, QUOTE_VOLUME_SCALE
+
+# bound of the relative rounding error of one addition of sum() (2**-53), doubled as a margin
+SUM_ERROR = 2 ** -52
 
 
-def get_min_candle(lst_candles: list) -> dict:
+def get_min_candle(window: KlineWindow) -> dict:
     """
-    The function finds the lowest price from the given candles
-    :param lst_candles:
+    The function returns the lowest price from the given candles (without the new one),
+    kept up to date by the window statistics
+    :param window: kline window of the symbol
     :return: dict with min_price and max price in this min candle
     """
 
-    min_price = min(float(elem["l"]) for elem in lst_candles[:-1])
-    max_in_min_price = max(float(elem["h"]) for elem in lst_candles[:-1] if float(elem["l"]) == min_price)
-
-    return {"min_price": min_price, "max_in_min_price": max_in_min_price}
+    return {"min_price": window.stats.min_low, "max_in_min_price": window.stats.max_high_in_min_low}
 
 
-def get_average_volume(lst_candles: list) -> float:
+def get_average_volume(window: KlineWindow) -> float:
     """
-    The function calculates the average volume in dollars from a list candles
-    :param lst_candles:
+    The function calculates the average volume in dollars from a window of candles
+    :param window: kline window of the symbol
     :return: average volume
     """
-    average_volume = fmean([float(elem["q"]) for elem in lst_candles])
+    average_volume = window.stats.quote_sum / len(window)
     return average_volume
 
 
-def check_candle_volume_multiple(new_candle, average_volume, multiple) -> tuple:
+def passes_candle_volume_multiple(new_candle: Kline, average_volume, multiple) -> bool:
+    return new_candle.quote_volume >= (average_volume * multiple)
+
+
+def check_candle_volume_multiple(new_candle: Kline, average_volume, multiple) -> tuple:
     """
     Checks whether the volume of the new candle is greater than the average volume of the last candles by 350%
     """
-    result = float(new_candle["q"]) >= (average_volume * multiple)
-    return result, f"volume new kline: {new_candle['q']} > average_volume: {average_volume} * {multiple}"
+    result = passes_candle_volume_multiple(new_candle, average_volume, multiple)
+    return result, f"volume new kline: {new_candle.quote_volume} > average_volume: {average_volume} * {multiple}"
 
 
-def check_average_volume_greater(lst_candles: dict,  volume: float) -> tuple:
+def get_sum_volume(window: KlineWindow, volume: float) -> float:
+    """
+    The function returns the total volume of the candles to compare with the threshold volume: the exact sum
+    of the window statistics, or, when the threshold is within the rounding error of sum() of the candles,
+    sum() itself, so the check decides the same as summing the candles one by one
+    :param window: kline window of the symbol
+    :param volume: threshold of the total volume in dollars
+    :return: total volume
+    """
+    sum_volume = window.stats.quote_sum
+    # sum() of n positive floats is off by less than n ulps of the sum (and the fixed point truncates below 2**-62)
+    if abs(sum_volume - volume) <= len(window) * (sum_volume * SUM_ERROR + 1 / QUOTE_VOLUME_SCALE):
+        sum_volume = sum(window.values(window.quote_volume))
+    return sum_volume
+
+
+def check_average_volume_greater(window: KlineWindow, volume: float) -> tuple:
     """
     The function checks if the total volume of the last candles is more than parameters Volume in dollars
     """
-    sum_volume = sum(float(elem["q"]) for elem in lst_candles)
+    sum_volume = get_sum_volume(window, volume)
     result = sum_volume > volume
     return result, f"sum_volume: {sum_volume} > {volume}$"
 
 
-def check_max_candle_price_exceeds_min_threshold(min_price, new_candle, percentage: float) -> tuple:
+def passes_max_candle_price_exceeds_min_threshold(min_price, new_candle: Kline, percentage: float) -> bool:
+    return (new_candle.high - min_price) >= (min_price * (percentage / 100))
+
+
+def check_max_candle_price_exceeds_min_threshold(min_price, new_candle: Kline, percentage: float) -> tuple:
     """
     The function checks whether the maximum price of the new candle is higher than the lowest
     price of the last candles by at least 3%
     """
-    result = (float(new_candle["h"]) - min_price) >= (min_price * (percentage / 100))
-    return result, f"hight new kline: {new_candle['h']} >= min price: {min_price} by {percentage}%"
+    result = passes_max_candle_price_exceeds_min_threshold(min_price, new_candle, percentage)
+    return result, f"hight new kline: {new_candle.high} >= min price: {min_price} by {percentage}%"
 
 
-def check_max_candle_price_within_percent_threshold(new_candle, penultimate_candle, percentage: float) -> tuple:
+def passes_max_candle_price_within_percent_threshold(new_candle: Kline, penultimate_candle: Kline,
+                                                     percentage: float) -> bool:
+    return (new_candle.high - penultimate_candle.low) <= (
+            penultimate_candle.low * (percentage / 100)
+    )
+
+
+def check_max_candle_price_within_percent_threshold(new_candle: Kline, penultimate_candle: Kline,
+                                                    percentage: float) -> tuple:
     """
     The function checks whether the maximum price of the new candle is greater than the minimum
     of the previous candle not more than 9%
 
     """
-    result = (float(new_candle["h"]) - float(penultimate_candle["l"])) <= (
-            float(penultimate_candle["l"]) * (percentage / 100)
-    )
-    return result, f"high new kline: {new_candle['h']} > penultimate kline min price: " \
-                   f"{penultimate_candle['l']} not more than {percentage}%"
+    result = passes_max_candle_price_within_percent_threshold(new_candle, penultimate_candle, percentage)
+    return result, f"high new kline: {new_candle.high} > penultimate kline min price: " \
+                   f"{penultimate_candle.low} not more than {percentage}%"
 
 
-def check_max_candle(new_candle, max_in_min_price) -> tuple:
+def check_max_candle(new_candle: Kline, max_in_min_price) -> tuple:
     """
     Function checks whether the high of the new candle is greater than the high of the candle that had the low price
     :param new_candle: last candle
     :param max_in_min_price: high of the candle that had the lowest price
     :return bool
     """
-    result = float(new_candle["h"]) >= max_in_min_price
-    return result, f"high new kline: {new_candle['h']} >= max in min kline: {max_in_min_price}"
+    result = new_candle.high >= max_in_min_price
+    return result, f"high new kline: {new_candle.high} >= max in min kline: {max_in_min_price}"
+
 
+def passes_time_passed(last_alert: Optional[datetime], last_candle: Kline, minute) -> bool:
+    return (last_alert is None) or (datetime.fromtimestamp(last_candle.open_time / 1000)
+                                    >= (last_alert + timedelta(minutes=minute)))
 
-def time_passed(symbol, last_candle, minute) -> tuple:
+
+def time_passed(symbol, last_candle: Kline, minute) -> tuple:
     """
     The function checks whether a certain time has passed since the last alert
     """
-    # last alert by symbol
-    last_alert = (
-        db_session.query(FutureAlert)
-        .filter(FutureAlert.future == symbol)
-        .order_by(desc(FutureAlert.alert_id))
-        .first()
-    )
+    # last alert by symbol (datetime of its candle)
+    last_alert = get_last_alert(symbol)
+    result = passes_time_passed(last_alert, last_candle, minute)
+    return result, time_passed_log(last_alert, last_candle, minute)
+
+
+def time_passed_log(last_alert: Optional[datetime], last_candle: Kline, minute) -> str:
     # last candle datetime
     last_candle_dt = datetime.fromtimestamp(
-        last_candle["t"] / 1000
+        last_candle.open_time / 1000
     )
-    result = (last_alert is None) or (last_candle_dt >= (last_alert.date_time + timedelta(minutes=minute)))
-    return result, f"time new kline: {last_candle_dt} > last_alert: {last_alert} for 90 minutes"
+    return f"time new kline: {last_candle_dt} > last_alert: {last_alert} for {minute} minutes"
 
 
-async def all_checks(symbol: str) -> bool:
-    candle = loader.KLINES_DATA[symbol]
+def default_params() -> dict:
+    """
+    Thresholds of the checks from the settings (the default strategy)
+    """
+    return {
+        "volume_multiple": settings.VOLUME_MULTIPLE,
+        "avg_increase": settings.AVG_INCREASE,
+        "percent_to_max_price_exceeds_min": settings.PERCENT_TO_MAX_PRICE_EXCEEDS_MIN,
+        "within_threshold": settings.WITHIN_THRESHOLD,
+        "time_passed": settings.TIME_PASSED,
+    }
+
+
+# the window checks (№1-5) as rules of a strategy: (name, predicate(window record, params))
+WINDOW_RULES = (
+    ('volume_multiple', lambda record, params: passes_candle_volume_multiple(
+        record.new_candle, record.average_volume, params['volume_multiple'])),
+    ('sum_volume', lambda record, params: record.sum_volume > params['avg_increase']),
+    ('exceeds_min', lambda record, params: passes_max_candle_price_exceeds_min_threshold(
+        record.min_price, record.new_candle, params['percent_to_max_price_exceeds_min'])),
+    ('within_threshold', lambda record, params: passes_max_candle_price_within_percent_threshold(
+        record.new_candle, record.penultimate_candle, params['within_threshold'])),
+    ('max_candle', lambda record, params: record.new_candle.high >= record.max_in_min_price),
+)
+
+
+class WindowRecord:
+    """
+    Inputs and results of the window checks (№1-5) of the new kline.
 
-    min_candle = get_min_candle(candle)
-    average_volume = get_average_volume(candle)
+    The checks log is rendered from the record only when it is written (str()),
+    so evaluations that are not logged cost no formatting. Checks that were skipped
+    (None in results, after an earlier check failed) are evaluated only for the log.
+    """
+
+    __slots__ = ('new_candle', 'penultimate_candle', 'average_volume', 'sum_volume', 'min_price',
+                 'max_in_min_price', 'results', 'params')
+
+    def __init__(self, new_candle: Kline, penultimate_candle: Kline, average_volume: float, sum_volume: float,
+                 min_price: float, max_in_min_price: float, results: tuple, params: Optional[dict] = None):
+        self.new_candle = new_candle
+        self.penultimate_candle = penultimate_candle
+        self.average_volume = average_volume
+        self.sum_volume = sum_volume
+        self.min_price = min_price
+        self.max_in_min_price = max_in_min_price
+        self.results = results
+        # thresholds of the strategy, None - the settings
+        self.params = params
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, WindowRecord) and self.to_tuple() == other.to_tuple()
+
+    def to_tuple(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def get_params(self) -> dict:
+        return self.params if self.params is not None else default_params()
+
+    def complete_results(self) -> tuple:
+        if None not in self.results:
+            return self.results
+        params = self.get_params()
+        return tuple(predicate(self, params) if result is None else result
+                     for result, (_, predicate) in zip(self.results, WINDOW_RULES))
+
+    def __str__(self) -> str:
+        params = self.get_params()
+        logs = (
+            check_candle_volume_multiple(self.new_candle, self.average_volume, params['volume_multiple'])[1],
+            f"sum_volume: {self.sum_volume} > {params['avg_increase']}$",
+            check_max_candle_price_exceeds_min_threshold(self.min_price, self.new_candle,
+                                                         params['percent_to_max_price_exceeds_min'])[1],
+            check_max_candle_price_within_percent_threshold(self.new_candle, self.penultimate_candle,
+                                                            params['within_threshold'])[1],
+            check_max_candle(self.new_candle, self.max_in_min_price)[1],
+        )
+        return "".join(f"check №{number} ({result} {log}) "
+                       for number, (result, log) in enumerate(zip(self.complete_results(), logs), start=1))
+
+    def to_dict(self) -> dict:
+        return {
+            "t": self.new_candle.open_time,
+            "high": self.new_candle.high,
+            "low": self.new_candle.low,
+            "volume": self.new_candle.quote_volume,
+            "penultimate_low": self.penultimate_candle.low,
+            "average_volume": self.average_volume,
+            "sum_volume": self.sum_volume,
+            "min_price": self.min_price,
+            "max_in_min_price": self.max_in_min_price,
+        }
+
+
+class CheckRecord:
+    """
+    All the checks (№1-6) of the new kline of the symbol, rendered to the checks log line only when it is written.
+    """
+
+    __slots__ = ('symbol', 'window', 'time_passed', 'last_alert', 'strategy')
+
+    def __init__(self, symbol: str, window: WindowRecord, t_passed: Optional[bool], last_alert: Optional[datetime],
+                 strategy: Optional[str] = None):
+        self.symbol = symbol
+        self.window = window
+        # None - skipped, the window checks failed
+        self.time_passed = t_passed
+        self.last_alert = last_alert
+        self.strategy = strategy
+
+    @property
+    def results(self) -> tuple:
+        t_passed = self.time_passed
+        if t_passed is None:
+            t_passed = passes_time_passed(self.last_alert, self.window.new_candle,
+                                          self.window.get_params()['time_passed'])
+        return self.window.complete_results() + (t_passed,)
+
+    @property
+    def result(self) -> bool:
+        return all(self.results)
+
+    def __str__(self) -> str:
+        name = f"{self.symbol} {self.strategy}" if self.strategy else self.symbol
+        t_passed = self.results[-1]
+        log_6 = time_passed_log(self.last_alert, self.window.new_candle, self.window.get_params()['time_passed'])
+        return (f"[ {name} \t|\t "
+                f"{self.window}"
+                f"check №6 ({t_passed} {log_6}) ]")
+
+    def to_dict(self) -> dict:
+        """
+        Compact structured record (one JSON line of the check records file).
+        """
+        record = {"s": self.symbol, "r": [int(result) for result in self.results], "alert": self.result}
+        if self.strategy:
+            record["strategy"] = self.strategy
+        record.update(self.window.to_dict())
+        record["last_alert"] = self.last_alert.isoformat() if self.last_alert else None
+        return record
 
-    # Check if candle volume exceeds the average volume threshold
-    is_exceeds_percentage, log_1 = check_candle_volume_multiple(candle[-1], average_volume,
-                                                                settings.VOLUME_MULTIPLE)
 
-    # Check if average volume is greater than the threshold
-    average_volume_is_greater, log_2 = check_average_volume_greater(candle, settings.AVG_INCREASE)
+def window_record(candle: KlineWindow) -> WindowRecord:
+    """
+    Collects the inputs of the window checks from the window statistics (the checks are not run yet)
+    """
+    min_candle = get_min_candle(candle)
+    return WindowRecord(candle[-1], candle[-2], get_average_volume(candle), candle.stats.quote_sum,
+                        min_candle['min_price'], min_candle['max_in_min_price'], (None,) * len(WINDOW_RULES))
 
-    # Check if the max candle price exceeds the min threshold
-    above_percent, log_3 = check_max_candle_price_exceeds_min_threshold(min_candle['min_price'], candle[-1],
-                                                                        settings.PERCENT_TO_MAX_PRICE_EXCEEDS_MIN)
 
-    # Check if the max candle price is within the percent threshold
-    not_higher_percent, log_4 = check_max_candle_price_within_percent_threshold(candle[-1], candle[-2],
-                                                                                settings.WITHIN_THRESHOLD)
+def check_window(candle: KlineWindow) -> tuple:
+    """
+    Runs the checks of the kline window itself (№1-5) with the thresholds from the settings,
+    they do not need anything but the window
+    :param candle: full kline window of the symbol
+    :return: (result of all the checks, WindowRecord with the inputs and results of every check)
+    """
+    record = window_record(candle)
+    new_candle = record.new_candle
+
+    record.sum_volume = get_sum_volume(candle, settings.AVG_INCREASE)
+    record.results = (
+        # Check if candle volume exceeds the average volume threshold
+        passes_candle_volume_multiple(new_candle, record.average_volume, settings.VOLUME_MULTIPLE),
+        # Check if average volume is greater than the threshold
+        record.sum_volume > settings.AVG_INCREASE,
+        # Check if the max candle price exceeds the min threshold
+        passes_max_candle_price_exceeds_min_threshold(record.min_price, new_candle,
+                                                      settings.PERCENT_TO_MAX_PRICE_EXCEEDS_MIN),
+        # Check if the max candle price is within the percent threshold
+        passes_max_candle_price_within_percent_threshold(new_candle, record.penultimate_candle,
+                                                         settings.WITHIN_THRESHOLD),
+        # Check the max candle
+        new_candle.high >= record.max_in_min_price,
+    )
+
+    # Combine the checks using logical AND
+    return all(record.results), record
 
-    # Check the max candle
-    max_candle, log_5 = check_max_candle(candle[-1], min_candle['max_in_min_price'])
 
-    # Check the time passed
-    t_passed, log_6 = time_passed(symbol, candle[-1], settings.TIME_PASSED)
+def final_checks(symbol: str, new_candle: Kline, window_result: bool, window_record: WindowRecord) -> bool:
+    """
+    Combines the result of the window checks with the time passed check (№6) and logs all of them.
+    The time passed check runs only if the window checks passed.
+    """
+    last_alert = get_last_alert(symbol)
+    t_passed = passes_time_passed(last_alert, new_candle, settings.TIME_PASSED) if window_result else None
 
-    logger.info(f"[ {symbol} \t|\t "
-                f"check №1 ({is_exceeds_percentage} {log_1}) "
-                f"check №2 ({average_volume_is_greater} {log_2}) "
-                f"check №3 ({above_percent} {log_3}) "
-                f"check №4 ({not_higher_percent} {log_4}) "
-                f"check №5 ({max_candle} {log_5}) "
-                f"check №6 ({t_passed} {log_6}) ]")
+    result = window_result and t_passed
+    CHECK_LOG.write(CheckRecord(symbol, window_record, t_passed, last_alert), result)
 
-    # Combine all the checks using logical AND
-    return all([is_exceeds_percentage, average_volume_is_greater,
-                above_percent, not_higher_percent, max_candle, t_passed])
+    return result
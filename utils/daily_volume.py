@@ -0,0 +1,65 @@
+import asyncio
+import time
+from typing import Optional
+
+from loguru import logger
+
+import loader
+import settings
+
+
+def fetch_tickers() -> list:
+    """
+    The 24h tickers of all symbols, runs in a thread: the first call also creates the REST client,
+    which pings the exchange.
+    """
+    return loader.BINANCE_API_CLIENT.futures_ticker()
+
+
+class DailyVolumeTable:
+    """
+    In-memory table with the 24h quote volume of all symbols.
+
+    The table is filled by one bulk /ticker/24hr request and refreshed in the background,
+    so the alert path reads it in O(1) without a network call. Values older than max_age
+    seconds are considered stale and are not returned.
+    """
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self.volumes = {}
+        self.updated_at = None
+
+    def get(self, symbol: str) -> Optional[float]:
+        """
+        Returns the 24h quote volume of the symbol or None if it is unknown or the table is stale.
+        """
+        if self.updated_at is None or time.monotonic() - self.updated_at > self.max_age:
+            return None
+        return self.volumes.get(symbol)
+
+    async def refresh(self) -> None:
+        tickers = await asyncio.to_thread(fetch_tickers)
+
+        self.volumes = {ticker['symbol']: float(ticker['quoteVolume']) for ticker in tickers}
+        self.updated_at = time.monotonic()
+
+    async def run(self, interval: float) -> None:
+        """
+        Refreshes the table every interval seconds.
+
+        Note:
+            - This function runs indefinitely in a loop.
+        """
+        while True:
+            try:
+                await self.refresh()
+            except Exception as exp:
+                logger.error(f'Refresh daily volumes {exp}')
+
+            await asyncio.sleep(interval)
+
+
+DAILY_VOLUMES = DailyVolumeTable(settings.DAILY_VOLUME_MAX_AGE)
+
+__all__ = ['DailyVolumeTable', 'DAILY_VOLUMES']
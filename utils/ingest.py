@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections import deque
+
+import settings
+from utils.metrics import REGISTRY, INBOX_WAIT_SECONDS
+
+
+class StreamInbox:
+    """
+    Hands stream data over from the websocket manager threads to the event loop.
+
+    The manager calls push() from its socket threads for every received message. The consumer awaits
+    get_batch(), which wakes up only when data arrives and returns everything that is buffered (up to
+    max_batch messages) at once, so there is no polling and no per-message scheduling.
+    """
+
+    def __init__(self, max_batch: int):
+        self.max_batch = max_batch
+        self._buffer = deque()
+        self._loop = None
+        self._wakeup = None
+        self._waiting = False
+        self._oldest_at = None
+
+        # metrics
+        self.received = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.max_depth = 0
+
+    def push(self, data) -> None:
+        """
+        Callback for the websocket manager (process_stream_data), called from its threads.
+        """
+        if not self._buffer:
+            self._oldest_at = time.perf_counter()
+        self._buffer.append(data)
+        self.received += 1
+
+        if self._waiting:
+            self._waiting = False
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def get_batch(self) -> list:
+        """
+        Waits for data and returns all buffered messages in arrival order.
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+
+        while not self._buffer:
+            self._wakeup.clear()
+            self._waiting = True
+            # data may have been pushed before the flag was set
+            if self._buffer:
+                self._waiting = False
+                break
+            await self._wakeup.wait()
+
+        depth = len(self._buffer)
+        size = min(depth, self.max_batch)
+        batch = [self._buffer.popleft() for _ in range(size)]
+
+        # the oldest message of the batch waited the longest (the rest of the buffer waits from now on)
+        INBOX_WAIT_SECONDS.observe(time.perf_counter() - self._oldest_at)
+        self._oldest_at = time.perf_counter()
+
+        self.batches += 1
+        self.last_batch_size = size
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.max_depth = max(self.max_depth, depth)
+        return batch
+
+    def depth(self) -> int:
+        return len(self._buffer)
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "batches": self.batches,
+            "depth": self.depth(),
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "max_depth": self.max_depth,
+        }
+
+
+STREAM_INBOX = StreamInbox(settings.INGEST_MAX_BATCH)
+
+REGISTRY.collect('alert_server_stream_inbox_depth', 'Stream messages waiting for the event loop', STREAM_INBOX.depth)
+REGISTRY.collect('alert_server_stream_messages_total', 'Stream messages received',
+                 lambda: STREAM_INBOX.received, kind='counter')
+
+__all__ = ['StreamInbox', 'STREAM_INBOX']
@@ -0,0 +1,187 @@
+from array import array
+from collections import deque
+from typing import Iterator, NamedTuple, Optional
+
+import settings
+
+
+class Kline(NamedTuple):
+    open_time: int
+    high: float
+    low: float
+    quote_volume: float
+
+
+# Quote volumes are summed as fixed-point integers: float * 2**62 is exact for any volume above ~0.001$,
+# so the running sum never drifts and converts back to the same correctly rounded value as math.fsum
+QUOTE_VOLUME_SCALE = 2 ** 62
+
+
+class WindowStats:
+    """
+    Streaming statistics of a kline window, updated in O(1) amortized per appended kline:
+        - exact running sum of the quote volume of all klines in the window;
+        - the lowest low of the window without the newest kline and the highest high among
+          the klines that have this low (monotonic deque of lows, each holding a max-deque of highs).
+    """
+
+    __slots__ = ('_quote_sum', '_lows', '_pending')
+
+    def __init__(self):
+        self._quote_sum = 0
+        self._lows = deque()
+        self._pending = None
+
+    @property
+    def quote_sum(self) -> float:
+        return self._quote_sum / QUOTE_VOLUME_SCALE
+
+    @property
+    def min_low(self) -> float:
+        return self._lows[0][0]
+
+    @property
+    def max_high_in_min_low(self) -> float:
+        return self._lows[0][1][0][1]
+
+    def push(self, seq: int, high: float, low: float, quote_volume: float, first_seq: int) -> None:
+        """
+        Adds the new kline to the statistics.
+
+        Args:
+            seq: The sequence number of the new kline in its window.
+            high, low, quote_volume: The parsed fields of the new kline.
+            first_seq: The sequence number of the oldest kline that is still in the window.
+        """
+        self._quote_sum += int(quote_volume * QUOTE_VOLUME_SCALE)
+
+        # the newest kline is excluded from the min low, so the previous one enters the deque only now
+        if self._pending is not None:
+            self._push_low(*self._pending)
+        self._pending = (seq, high, low)
+        self._expire(first_seq)
+
+    def pop(self, quote_volume: float) -> None:
+        """
+        Removes the quote volume of the kline that was overwritten in the window.
+        """
+        self._quote_sum -= int(quote_volume * QUOTE_VOLUME_SCALE)
+
+    def _push_low(self, seq: int, high: float, low: float) -> None:
+        lows = self._lows
+        while lows and lows[-1][0] > low:
+            lows.pop()
+
+        if lows and lows[-1][0] == low:
+            highs = lows[-1][1]
+            while highs and highs[-1][1] <= high:
+                highs.pop()
+            highs.append((seq, high))
+        else:
+            lows.append((low, deque([(seq, high)])))
+
+    def _expire(self, first_seq: int) -> None:
+        lows = self._lows
+        while lows:
+            highs = lows[0][1]
+            while highs and highs[0][0] < first_seq:
+                highs.popleft()
+            if highs:
+                break
+            lows.popleft()
+
+
+class KlineWindow:
+    """
+    Fixed-capacity ring buffer with the last closed klines of one symbol.
+
+    Fields are parsed once on append and stored in typed arrays, so checks can read
+    the window in place without copying or converting strings again.
+    """
+
+    __slots__ = ('capacity', 'open_time', 'high', 'low', 'quote_volume', 'stats', '_start', '_size', '_seq')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.open_time = array('q', [0]) * capacity
+        self.high = array('d', [0.0]) * capacity
+        self.low = array('d', [0.0]) * capacity
+        self.quote_volume = array('d', [0.0]) * capacity
+        self.stats = WindowStats()
+        self._start = 0
+        self._size = 0
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> Kline:
+        slot = self.slot(index)
+        return Kline(self.open_time[slot], self.high[slot], self.low[slot], self.quote_volume[slot])
+
+    def is_full(self) -> bool:
+        return self._size == self.capacity
+
+    def slot(self, index: int) -> int:
+        """
+        Converts a logical index (0 is the oldest kline, -1 the newest) into a position in the arrays.
+        """
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('kline window index out of range')
+        return (self._start + index) % self.capacity
+
+    def slots(self, start: int = 0, stop: Optional[int] = None) -> Iterator[int]:
+        """
+        Yields array positions of the klines in [start, stop) from the oldest to the newest.
+        """
+        start, stop, _ = slice(start, stop).indices(self._size)
+        for index in range(start, stop):
+            yield (self._start + index) % self.capacity
+
+    def values(self, field: array, start: int = 0, stop: Optional[int] = None) -> Iterator[float]:
+        """
+        Yields one of the field arrays (high, low, ...) in chronological order without copying it.
+        """
+        for slot in self.slots(start, stop):
+            yield field[slot]
+
+    def columns(self) -> tuple:
+        """
+        Copies of the open time, high, low and quote volume arrays in chronological order.
+        """
+        fields = (self.open_time, self.high, self.low, self.quote_volume)
+        if self._size < self.capacity:
+            return tuple(field[:self._size] for field in fields)
+        return tuple(field[self._start:] + field[:self._start] for field in fields)
+
+    def append(self, kline_data: dict) -> None:
+        """
+        Parses a closed kline from the stream and stores it, overwriting the oldest one when the window is full.
+
+        Args:
+            kline_data (dict): The 'k' object of the kline event.
+        """
+        if self._size < self.capacity:
+            slot = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            slot = self._start
+            self._start = (self._start + 1) % self.capacity
+            self.stats.pop(self.quote_volume[slot])
+
+        high = self.high[slot] = float(kline_data['h'])
+        low = self.low[slot] = float(kline_data['l'])
+        quote_volume = self.quote_volume[slot] = float(kline_data['q'])
+        self.open_time[slot] = int(kline_data['t'])
+
+        self._seq += 1
+        self.stats.push(self._seq, high, low, quote_volume, self._seq - self._size + 1)
+
+
+def new_window() -> KlineWindow:
+    return KlineWindow(settings.MAXIMUM_KLINES)
+
+
+__all__ = ['Kline', 'KlineWindow', 'WindowStats', 'new_window']
@@ -0,0 +1,174 @@
+import asyncio
+from bisect import bisect_left
+from typing import Callable
+
+from loguru import logger
+
+# In seconds, from the per-kline stages (microseconds) to the network round trips (seconds)
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    __slots__ = ('name', 'labels', 'value')
+
+    def __init__(self, name: str, labels: str = ''):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets: observe() only increments preallocated counts, nothing is allocated.
+    """
+
+    __slots__ = ('name', 'labels', 'bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, name: str, bounds: tuple = LATENCY_BUCKETS, labels: str = ''):
+        self.name = name
+        self.labels = labels
+        self.bounds = bounds
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        separator = ',' if self.labels else ''
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket', f'{self.labels}{separator}le="{bound}"', cumulative
+        yield f'{self.name}_bucket', f'{self.labels}{separator}le="+Inf"', self.count
+        yield f'{self.name}_sum', self.labels, self.sum
+        yield f'{self.name}_count', self.labels, self.count
+
+
+class Collected:
+    """
+    Value read from a component at scrape time (queue depths, clients, counters the components keep themselves).
+    """
+
+    __slots__ = ('name', 'labels', 'function')
+
+    def __init__(self, name: str, function: Callable[[], float], labels: str = ''):
+        self.name = name
+        self.labels = labels
+        self.function = function
+
+    def samples(self):
+        yield self.name, self.labels, self.function()
+
+
+class MetricsRegistry:
+    """
+    Metrics of the server in the Prometheus text format.
+
+    Metrics with the same name and different labels (e.g. the stages of the alert path) share one HELP/TYPE.
+    """
+
+    def __init__(self):
+        self.families = {}
+
+    def _register(self, kind: str, help_text: str, metric):
+        family = self.families.setdefault(metric.name, (kind, help_text, []))
+        family[2].append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: str = '') -> Counter:
+        return self._register('counter', help_text, Counter(name, labels))
+
+    def histogram(self, name: str, help_text: str, bounds: tuple = LATENCY_BUCKETS, labels: str = '') -> Histogram:
+        return self._register('histogram', help_text, Histogram(name, bounds, labels))
+
+    def collect(self, name: str, help_text: str, function: Callable[[], float], kind: str = 'gauge',
+                labels: str = '') -> Collected:
+        return self._register(kind, help_text, Collected(name, function, labels))
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, metrics) in self.families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for metric in metrics:
+                try:
+                    for sample_name, labels, value in metric.samples():
+                        lines.append(f'{sample_name}{{{labels}}} {value}' if labels else f'{sample_name} {value}')
+                except Exception as exp:
+                    logger.error(f"Metric {name} {exp}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def stage_histogram(stage: str) -> Histogram:
+    return REGISTRY.histogram('alert_server_stage_seconds', 'Duration of the stages of the alert path',
+                              labels=f'stage="{stage}"')
+
+
+# alert path, from the exchange to the clients
+EVENT_LAG_SECONDS = REGISTRY.histogram('alert_server_event_lag_seconds',
+                                       'Time from the exchange event time to the processing of the closed kline',
+                                       LAG_BUCKETS)
+INBOX_WAIT_SECONDS = stage_histogram('inbox_wait')
+EVENT_ADAPTER_SECONDS = stage_histogram('event_adapter')
+ALL_CHECKS_SECONDS = stage_histogram('all_checks')
+VECTOR_CHECKS_SECONDS = stage_histogram('vector_checks')
+DAILY_VOLUME_CHECK_SECONDS = stage_histogram('daily_volume_check')
+DB_COMMIT_SECONDS = stage_histogram('db_commit')
+WS_SEND_SECONDS = stage_histogram('ws_send')
+TELEGRAM_SEND_SECONDS = stage_histogram('telegram_send')
+
+KLINES_TOTAL = REGISTRY.counter('alert_server_klines_total', 'Closed klines received')
+ALERTS_TOTAL = REGISTRY.counter('alert_server_alerts_total', 'Alerts sent')
+
+
+async def handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        # skip the headers
+        while (await reader.readline()).strip():
+            pass
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', REGISTRY.render().encode()
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+
+        writer.write(f'HTTP/1.1 {status}\r\n'
+                     f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                     f'Content-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(ip: str, port: int) -> None:
+    """
+    Serves the metrics at http://ip:port/metrics until cancelled.
+    """
+    server = await asyncio.start_server(handle_request, host=ip, port=port)
+    logger.info(f"Metrics server started. Address: http://{ip}:{port}/metrics")
+    async with server:
+        await server.serve_forever()
+
+
+__all__ = ['REGISTRY', 'MetricsRegistry', 'Counter', 'Histogram', 'start_metrics_server']
@@ -1,14 +1,111 @@
-import bisect
+import heapq
+import math
+from statistics import fmean
+from typing import Callable, Dict, List, Optional
 
 
-def split_list_by_letter(lst: list, letter: str) -> tuple:
-    index = bisect.bisect_left(lst, letter)
-    first_half = lst[:index]
-    second_half = lst[index:]
-    return first_half, second_half
+def get_weight_function(weights: Optional[Dict[str, float]]) -> Callable[[str], float]:
+    """
+    Returns a function with the weight of a pair, pairs without a weight get the average weight.
+    """
+    if not weights:
+        return lambda pair: 1.0
 
+    default = fmean(weights.values())
+    return lambda pair: weights.get(pair, default)
 
-def distribute_pairs_to_threads(pairs: list, sorted_letter: str) -> tuple:
-    sorted_pairs = sorted(pairs)
-    first_pairs, second_pairs = split_list_by_letter(sorted_pairs, sorted_letter)
-    return first_pairs, second_pairs
+
+def plan_stream_shards(pairs: list, max_per_stream: int, min_streams: int = 1,
+                       weights: Optional[Dict[str, float]] = None) -> List[list]:
+    """
+    Distributes pairs between as few streams as max_per_stream allows (at least min_streams),
+    balancing the streams by the weight (expected message rate) of their pairs.
+
+    Args:
+        pairs: The pairs to distribute.
+        max_per_stream: The maximum number of subscriptions per stream (websocket connection).
+        min_streams: The minimum number of streams.
+        weights: Weight of each pair, pairs without a weight get the average weight.
+
+    Returns:
+        List of sorted pair lists, one per stream.
+    """
+    get_weight = get_weight_function(weights)
+    streams_count = max(min_streams, math.ceil(len(pairs) / max_per_stream), 1)
+    shards = [[] for _ in range(streams_count)]
+
+    # the heaviest pair goes to the lightest stream that still has room
+    loads = [(0.0, index) for index in range(streams_count)]
+    for pair in sorted(pairs, key=lambda elem: get_weight(elem), reverse=True):
+        full = []
+        load, index = heapq.heappop(loads)
+        while len(shards[index]) >= max_per_stream:
+            full.append((load, index))
+            load, index = heapq.heappop(loads)
+
+        shards[index].append(pair)
+        heapq.heappush(loads, (load + get_weight(pair), index))
+        for elem in full:
+            heapq.heappush(loads, elem)
+
+    return [sorted(shard) for shard in shards]
+
+
+def assign_to_streams(pairs: list, streams: Dict[str, list], max_per_stream: int,
+                      weights: Optional[Dict[str, float]] = None) -> tuple:
+    """
+    Assigns new pairs to existing streams with free room, lightest stream first.
+
+    Args:
+        pairs: The new pairs.
+        streams: The pairs already subscribed on each stream id.
+        max_per_stream: The maximum number of subscriptions per stream.
+        weights: Weight of each pair, pairs without a weight get the average weight.
+
+    Returns:
+        (dict stream_id -> list of new pairs, list of pairs that did not fit into any stream)
+    """
+    get_weight = get_weight_function(weights)
+    assigned = {stream_id: [] for stream_id in streams}
+    counts = {stream_id: len(stream_pairs) for stream_id, stream_pairs in streams.items()}
+    loads = [(sum(get_weight(pair) for pair in stream_pairs), stream_id)
+             for stream_id, stream_pairs in streams.items() if counts[stream_id] < max_per_stream]
+    heapq.heapify(loads)
+
+    not_assigned = []
+    for pair in sorted(pairs, key=lambda elem: get_weight(elem), reverse=True):
+        if not loads:
+            not_assigned.append(pair)
+            continue
+
+        load, stream_id = heapq.heappop(loads)
+        assigned[stream_id].append(pair)
+        counts[stream_id] += 1
+        if counts[stream_id] < max_per_stream:
+            heapq.heappush(loads, (load + get_weight(pair), stream_id))
+
+    return assigned, not_assigned
+
+
+def diff_stream_pairs(pairs: list, streams: Dict[str, list]) -> tuple:
+    """
+    Compares the pairs that should be subscribed with the pairs subscribed on the streams.
+
+    Args:
+        pairs: The pairs that should be subscribed.
+        streams: The pairs already subscribed on each stream id.
+
+    Returns:
+        (list of pairs to subscribe, dict stream_id -> list of pairs to unsubscribe from the stream)
+    """
+    desired = set(pairs)
+    subscribed = set()
+    removed = {}
+    for stream_id, stream_pairs in streams.items():
+        subscribed.update(stream_pairs)
+        stale = [pair for pair in stream_pairs if pair not in desired]
+        if stale:
+            removed[stream_id] = stale
+
+    added = [pair for pair in pairs if pair not in subscribed]
+    return added, removed
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import shutil
+from array import array
+from datetime import datetime as dt, timedelta, timezone
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+from loguru import logger
+
+import settings
+
+# one column file of fixed-width little-endian values per field: (field, kline field, array typecode, dtype)
+KLINE_COLUMNS = (
+    ('open_time', 't', 'q', np.dtype('<i8')),
+    ('open', 'o', 'd', np.dtype('<f8')),
+    ('high', 'h', 'd', np.dtype('<f8')),
+    ('low', 'l', 'd', np.dtype('<f8')),
+    ('close', 'c', 'd', np.dtype('<f8')),
+    ('quote_volume', 'q', 'd', np.dtype('<f8')),
+)
+
+DAY_FORMAT = '%Y%m%d'
+FILE_SUFFIX = '.col'
+
+
+def day_of(open_time: int) -> str:
+    """
+    Returns the UTC day (YYYYMMDD) of the kline open time in ms.
+    """
+    return dt.fromtimestamp(open_time / 1000, tz=timezone.utc).strftime(DAY_FORMAT)
+
+
+class KlineRecorder:
+    """
+    Append-only columnar store of the closed klines: one directory per symbol and UTC day with one file of
+    fixed-width little-endian values per field (open time, OHLC, quote volume).
+
+        <directory>/<YYYYMMDD>/<SYMBOL>/<field>.col
+
+    Appending adds the fields to the in-memory columns of the symbol, run() appends them to the column files.
+    Reads map every column file with NumPy memmap, so the data is not copied or parsed and a reader that needs
+    one field (e.g. the open times) touches only its file.
+    """
+
+    def __init__(self, directory: str, retention_days: int):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.day = None
+        # symbol -> the columns not written yet
+        self.buffers = {}
+
+        # metrics
+        self.recorded = 0
+
+    def path(self, day: str, symbol: str, field: str) -> str:
+        return os.path.join(self.directory, day, symbol, field + FILE_SUFFIX)
+
+    def append(self, kline_data: dict) -> None:
+        """
+        Records a closed kline.
+
+        Args:
+            kline_data (dict): The 'k' object of the kline event.
+        """
+        open_time = int(kline_data['t'])
+        day = day_of(open_time)
+        if day != self.day:
+            self._rotate(day)
+
+        symbol = kline_data['s']
+        columns = self.buffers.get(symbol)
+        if columns is None:
+            columns = self.buffers[symbol] = [array(typecode) for _, _, typecode, _ in KLINE_COLUMNS]
+
+        columns[0].append(open_time)
+        for column, (_, key, _, _) in zip(columns[1:], KLINE_COLUMNS[1:]):
+            column.append(float(kline_data[key]))
+        self.recorded += 1
+
+    def _rotate(self, day: str) -> None:
+        self.close()
+        self.day = day
+        os.makedirs(os.path.join(self.directory, day), exist_ok=True)
+        logger.info(f"Kline recorder writes to {os.path.join(self.directory, day)}")
+
+    def flush(self, symbol: Optional[str] = None) -> None:
+        """
+        Appends the buffered klines (of the symbol, of all symbols if None) to their column files.
+        """
+        symbols = [symbol] if symbol is not None else list(self.buffers)
+        for buffered_symbol in symbols:
+            columns = self.buffers.pop(buffered_symbol, None)
+            if not columns:
+                continue
+            os.makedirs(os.path.join(self.directory, self.day, buffered_symbol), exist_ok=True)
+            for column, (field, _, typecode, dtype) in zip(columns, KLINE_COLUMNS):
+                with open(self.path(self.day, buffered_symbol, field), 'ab') as file:
+                    np.frombuffer(column, dtype=typecode).astype(dtype, copy=False).tofile(file)
+
+    def close(self) -> None:
+        self.flush()
+
+    def remove_expired(self, now: Optional[dt] = None) -> list:
+        """
+        Removes the days older than retention_days.
+
+        Returns:
+            list of the removed days
+        """
+        now = now or dt.now(timezone.utc)
+        oldest = (now - timedelta(days=self.retention_days)).strftime(DAY_FORMAT)
+
+        removed = [day for day in self.days() if day < oldest and day != self.day]
+        for day in removed:
+            shutil.rmtree(os.path.join(self.directory, day), ignore_errors=True)
+        if removed:
+            logger.info(f"Kline recorder removed expired days {removed}")
+        return removed
+
+    async def run(self, flush_interval: float) -> None:
+        """
+        Flushes the recorded klines every flush_interval seconds and removes the expired days.
+        """
+        logger.info("Task \'Kline recorder\' started!")
+        try:
+            while True:
+                await asyncio.sleep(flush_interval)
+                self.flush()
+                self.remove_expired()
+        finally:
+            self.close()
+
+    def days(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(day for day in os.listdir(self.directory)
+                      if len(day) == len('YYYYMMDD') and day.isdigit())
+
+    def symbols(self, day: str) -> list:
+        day_directory = os.path.join(self.directory, day)
+        if not os.path.isdir(day_directory):
+            return []
+        return sorted(name for name in os.listdir(day_directory)
+                      if os.path.isdir(os.path.join(day_directory, name)))
+
+    def read(self, day: str, symbol: str) -> Dict[str, np.ndarray]:
+        """
+        Maps the klines of the symbol for the day without reading them (zero-copy, read only).
+
+        Returns:
+            dict {field: array} with a column of every field of KLINE_COLUMNS, empty if nothing was recorded
+        """
+        if symbol in self.buffers and day == self.day:
+            self.flush(symbol)
+
+        paths = [self.path(day, symbol, field) for field, _, _, _ in KLINE_COLUMNS]
+        # the columns of an interrupted flush may differ in length, only the complete klines are visible
+        count = min((os.path.getsize(path) if os.path.exists(path) else 0) // dtype.itemsize
+                    for path, (_, _, _, dtype) in zip(paths, KLINE_COLUMNS))
+        if not count:
+            return {field: np.empty(0, dtype=dtype) for field, _, _, dtype in KLINE_COLUMNS}
+        return {field: np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+                for path, (field, _, _, dtype) in zip(paths, KLINE_COLUMNS)}
+
+    def read_day(self, day: str) -> dict:
+        """
+        Maps the klines of all symbols for the day.
+
+        Returns:
+            dict {symbol: dict {field: array}}
+        """
+        return {symbol: self.read(day, symbol) for symbol in self.symbols(day)}
+
+    def payloads(self, day: str) -> Iterator[dict]:
+        """
+        Yields the recorded klines of the day as closed kline events ordered by open time,
+        in the format of the stream (for utils.replay).
+        """
+        klines = self.read_day(day)
+        events = sorted((open_time, symbol, index)
+                        for symbol, columns in klines.items()
+                        for index, open_time in enumerate(columns['open_time'].tolist()))
+
+        for open_time, symbol, index in events:
+            columns = klines[symbol]
+            yield {"e": "kline", "E": open_time, "s": symbol,
+                   "k": {"t": open_time, "s": symbol, "i": "1m", "x": True,
+                         "o": str(columns['open'][index]), "h": str(columns['high'][index]),
+                         "l": str(columns['low'][index]), "c": str(columns['close'][index]),
+                         "q": str(columns['quote_volume'][index])}}
+
+
+KLINE_RECORDER = KlineRecorder(settings.RECORDER_DIR, settings.RECORDER_RETENTION_DAYS) \
+    if settings.RECORDER_DIR else None
+
+__all__ = ['KlineRecorder', 'KLINE_RECORDER', 'KLINE_COLUMNS', 'day_of']
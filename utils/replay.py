@@ -0,0 +1,245 @@
+"""
+Replays recorded stream data through the alert pipeline offline, at maximum speed.
+
+The recorded payloads (the dicts event_adapter receives, one JSON per line) go through the same
+event_batch / event_kline / all_checks path as the live stream. The database writer, the 24h volume
+table and Telegram are replaced by in-memory stand-ins and the exchange clients are never created
+(they are created on first use), so no network is used.
+
+Usage:
+    python -m utils.replay klines.jsonl [--batch-size 300] [--daily-volume 100000000] [--output report.json]
+    python -m utils.replay <RECORDER_DIR> --day 20240101 [...]
+    python -m utils.replay klines.jsonl --check-records replayed.jsonl --compare <CHECK_RECORDS_FILE>
+"""
+import argparse
+import asyncio
+import functools
+import os
+import sys
+import time
+from statistics import fmean, quantiles
+
+import ujson
+from loguru import logger
+
+os.environ.setdefault('DB_DATABASE', 'sqlite://')
+os.environ.setdefault('GROUP_ID', '0')
+
+
+class RecordingWriter:
+    """
+    Stand-in for the alerts writer.
+    """
+
+    def __init__(self):
+        self.alerts = []
+
+    async def submit(self, symbol, date_time, strategy='default', timeframe='1m') -> None:
+        self.alerts.append({"symbol": symbol, "date_time": date_time.isoformat(), "strategy": strategy,
+                            "timeframe": timeframe})
+
+
+class RecordingNotifier:
+    """
+    Stand-in for the Telegram dispatcher.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def notify(self, text, key=None) -> None:
+        self.messages.append(text)
+
+
+class FixedDailyVolumes:
+    """
+    Stand-in for the 24h volume table: every symbol has the same volume.
+    """
+
+    def __init__(self, volume: float):
+        self.volume = volume
+        self.volumes = {}
+
+    def get(self, symbol):
+        return self.volumes.get(symbol, self.volume)
+
+
+class RecordingCheckLog:
+    """
+    Stand-in for the check log: keeps the structured check records (the log line is formatted only with --verbose).
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record, result: bool) -> None:
+        logger.info("{}", record)
+        self.records.append(record.to_dict())
+
+
+class StageTimer:
+    """
+    Collects the duration of every call of the wrapped pipeline functions.
+    """
+
+    def __init__(self):
+        self.durations = {}
+
+    def wrap(self, module, name: str) -> None:
+        function = getattr(module, name)
+        durations = self.durations.setdefault(name, [])
+
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    durations.append(time.perf_counter() - started)
+        else:
+            @functools.wraps(function)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    durations.append(time.perf_counter() - started)
+
+        setattr(module, name, timed)
+
+    def report(self) -> dict:
+        result = {}
+        for name, durations in self.durations.items():
+            if not durations:
+                continue
+            percentiles = quantiles(durations, n=100) if len(durations) > 1 else durations * 99
+            result[name] = {
+                "calls": len(durations),
+                "total_s": sum(durations),
+                "mean_us": fmean(durations) * 1e6,
+                "p50_us": percentiles[49] * 1e6,
+                "p99_us": percentiles[98] * 1e6,
+            }
+        return result
+
+
+def compare_check_records(replayed: list, recorded: list) -> dict:
+    """
+    Compares the check results of the replay with the check records of a live run (CHECK_RECORDS_FILE),
+    matched by symbol, kline open time and strategy.
+    """
+    def key(record: dict) -> tuple:
+        return record['s'], record['t'], record.get('strategy', 'default')
+
+    recorded = {key(record): record for record in recorded}
+    matched, mismatches = 0, []
+    for record in replayed:
+        expected = recorded.get(key(record))
+        if expected is None:
+            continue
+        matched += 1
+        if expected['r'] != record['r']:
+            mismatches.append({"s": record['s'], "t": record['t'], "strategy": key(record)[2],
+                               "recorded": expected['r'], "replayed": record['r']})
+
+    return {"matched": matched, "not_recorded": len(replayed) - matched, "mismatches": mismatches}
+
+
+def read_payloads(path: str, day: str = None) -> list:
+    """
+    Reads a JSON lines recording, or the klines of the day from a kline recorder directory.
+    """
+    if os.path.isdir(path):
+        from utils.recorder import KlineRecorder  # pylint: disable=import-outside-toplevel
+        recorder = KlineRecorder(path, retention_days=0)
+        return list(recorder.payloads(day or recorder.days()[-1]))
+
+    with open(path, encoding='utf-8') as file:
+        return [ujson.loads(line) for line in file if line.strip()]
+
+
+async def replay(payloads: list, batch_size: int, daily_volume: float) -> dict:
+    """
+    Feeds the payloads through the pipeline in batches of batch_size and returns the report.
+    """
+    # pylint: disable=import-outside-toplevel
+    import utils.binance
+    import utils.checks
+    import utils.strategies
+    import utils.telegram
+
+    writer, notifier, check_log = RecordingWriter(), RecordingNotifier(), RecordingCheckLog()
+    utils.binance.ALERT_WRITER = writer
+    utils.checks.CHECK_LOG = check_log
+    utils.strategies.CHECK_LOG = check_log
+    utils.binance.DAILY_VOLUMES = FixedDailyVolumes(daily_volume)
+    utils.telegram.TELEGRAM_DISPATCHER = notifier
+
+    timer = StageTimer()
+    for name in ('event_adapter', 'all_checks', 'event_candidates', 'check_daily_volume', 'event_alert'):
+        timer.wrap(utils.binance, name)
+
+    started = time.perf_counter()
+    for index in range(0, len(payloads), batch_size):
+        await utils.binance.event_batch(payloads[index:index + batch_size])
+    elapsed = time.perf_counter() - started
+
+    return {
+        "payloads": len(payloads),
+        "seconds": elapsed,
+        "payloads_per_second": len(payloads) / elapsed if elapsed else 0,
+        "alerts": writer.alerts,
+        "telegram_messages": len(notifier.messages),
+        "check_records": check_log.records,
+        "stages": timer.report(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='JSON lines file with the stream payloads or a kline recorder directory')
+    parser.add_argument('--day', help='day (YYYYMMDD) to replay from a kline recorder directory (default: the last)')
+    parser.add_argument('--batch-size', type=int, default=1000, help='payloads per stream batch')
+    parser.add_argument('--daily-volume', type=float, default=float('inf'),
+                        help='24h quote volume of every symbol (default: all symbols pass the check)')
+    parser.add_argument('--output', help='write the report to this JSON file')
+    parser.add_argument('--check-records', help='write the check records of the replay to this JSON lines file')
+    parser.add_argument('--compare', help='check records (JSON lines) of a live run to compare the results with')
+    parser.add_argument('--verbose', action='store_true', help='log every check')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+
+    report = asyncio.run(replay(read_payloads(args.recording, args.day), args.batch_size, args.daily_volume))
+
+    print(f"{report['payloads']} payloads in {report['seconds']:.3f}s "
+          f"({report['payloads_per_second']:.0f}/s), {len(report['alerts'])} alerts")
+    for alert in report['alerts']:
+        print(f"  {alert['date_time']} {alert['symbol']}")
+    for name, stage in report['stages'].items():
+        print(f"  {name:<20} {stage['calls']:>8} calls  mean {stage['mean_us']:9.1f} us  "
+              f"p50 {stage['p50_us']:9.1f} us  p99 {stage['p99_us']:9.1f} us")
+
+    check_records = report.pop('check_records')
+    if args.check_records:
+        with open(args.check_records, 'w', encoding='utf-8') as file:
+            file.writelines(ujson.dumps(record) + '\n' for record in check_records)
+
+    if args.compare:
+        report['comparison'] = compare_check_records(check_records, read_payloads(args.compare))
+        comparison = report['comparison']
+        print(f"  {comparison['matched']} evaluations compared, {len(comparison['mismatches'])} mismatches, "
+              f"{comparison['not_recorded']} not in the records")
+        for mismatch in comparison['mismatches'][:20]:
+            print(f"    {mismatch}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            ujson.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from loguru import logger
+
+
+def in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class Resources:
+    """
+    Shared clients and engines, created on first use.
+
+    Importing a module only registers the factory of its resource, so the exchange clients and the database
+    engine (and their imports) are paid for by the code that uses them, not by every import of the module.
+
+    Every resource has its own lock, so a slow factory only holds up the users of its resource and a resource
+    used from threads is created once. The event loop never waits for a lock: the resources with slow
+    factories are created in a thread with prepare() before the event loop uses them.
+    """
+
+    def __init__(self):
+        self.factories: Dict[str, Callable[[], Any]] = {}
+        self.instances: Dict[str, Any] = {}
+        # creation time of every created resource, in seconds
+        self.created_seconds: Dict[str, float] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        self.factories[name] = factory
+        self._locks[name] = threading.Lock()
+
+    def get(self, name: str) -> Any:
+        instance = self.instances.get(name)
+        if instance is not None:
+            return instance
+
+        lock = self._locks[name]
+        if not lock.acquire(blocking=not in_event_loop()):
+            raise RuntimeError(f"{name} is being created in a thread, await prepare('{name}') before using it")
+        try:
+            instance = self.instances.get(name)
+            if instance is None:
+                started = time.perf_counter()
+                instance = self.instances[name] = self.factories[name]()
+                self.created_seconds[name] = time.perf_counter() - started
+                logger.debug(f"Created {name} in {self.created_seconds[name]:.3f}s")
+        finally:
+            lock.release()
+        return instance
+
+    async def prepare(self, name: str) -> Any:
+        """
+        Creates the resource in a thread, so its factory does not block the event loop.
+        """
+        instance = self.instances.get(name)
+        if instance is None:
+            instance = await asyncio.to_thread(self.get, name)
+        return instance
+
+    def is_created(self, name: str) -> bool:
+        return name in self.instances
+
+
+RESOURCES = Resources()
+
+__all__ = ['Resources', 'RESOURCES']
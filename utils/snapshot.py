@@ -0,0 +1,282 @@
+import asyncio
+import os
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import ujson
+from loguru import logger
+
+import loader
+import settings
+from utils.backfill import KLINE_SEQUENCE
+from utils.batch_checks import KLINE_MATRIX
+from utils.klines import KlineWindow, new_window
+from utils.metrics import REGISTRY
+from utils.timeframes import TIMEFRAMES, PartialCandle, Timeframe
+
+SNAPSHOT_VERSION = 1
+KLINE_INTERVAL_MS = 60_000
+
+# klines of the windows, timeframe 0 - the 1m windows, i - the windows of the i-th timeframe of the snapshot
+SNAPSHOT_KLINE_DTYPE = np.dtype([('timeframe', '<i2'), ('symbol', '<i4'), ('open_time', '<i8'),
+                                 ('high', '<f8'), ('low', '<f8'), ('quote_volume', '<f8')])
+# partial candles of the higher timeframes
+SNAPSHOT_PARTIAL_DTYPE = np.dtype([('timeframe', '<i2'), ('symbol', '<i4'), ('open_time', '<i8'),
+                                   ('first_open_time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'),
+                                   ('close', '<f8'), ('quote_volume', '<f8'), ('count', '<i4')])
+
+
+class StateSnapshots:
+    """
+    Snapshots of the detector state to a local file: the kline windows (1m and the higher timeframes),
+    the partial candles of the higher timeframes and so the last kline of every symbol.
+
+    A snapshot is taken in two steps: the event loop only copies the window arrays (no parsing, no
+    allocations per kline), and a thread converts the copies to NumPy arrays and writes them to a
+    temporary file that replaces the snapshot atomically, so a crash during the write keeps the previous one.
+
+    On startup the windows are restored from the snapshot and only the klines closed after it are
+    backfilled (see missing_klines); the overlap with the live stream is skipped by the kline sequence.
+    """
+
+    def __init__(self, path: str, timeframes: List[Timeframe]):
+        self.path = path
+        self.timeframes = timeframes
+
+        # metrics
+        self.snapshots = 0
+        self.last_capture_seconds = 0.0
+        self.last_write_seconds = 0.0
+        self.last_size = 0
+        self.restore_seconds = 0.0
+        self.restored_symbols = 0
+
+    def capture(self) -> dict:
+        """
+        Copies the state, runs in the event loop so the state does not change meanwhile.
+        """
+        started = time.perf_counter()
+        windows = []
+        if KLINE_MATRIX is not None:
+            matrix = (KLINE_MATRIX.data.copy(), KLINE_MATRIX.heads.copy(), KLINE_MATRIX.counts.copy(),
+                      dict(KLINE_MATRIX.rows))
+        else:
+            matrix = None
+            windows.extend((0, symbol, window.columns())
+                           for symbol, window in loader.KLINES_DATA.items() if len(window))
+
+        partials = []
+        for index, timeframe in enumerate(self.timeframes, start=1):
+            aggregator = timeframe.aggregator
+            windows.extend((index, symbol, window.columns()) for symbol, window in aggregator.windows.items())
+            partials.extend((index, symbol, partial.open_time, partial.first_open_time, partial.open, partial.high,
+                             partial.low, partial.close, partial.quote_volume, partial.count)
+                            for symbol, partial in aggregator.partials.items())
+
+        self.last_capture_seconds = time.perf_counter() - started
+        return {"created": int(time.time() * 1000), "windows": windows, "matrix": matrix, "partials": partials}
+
+    def write(self, state: dict) -> None:
+        """
+        Converts the copied state and writes it, runs in a thread.
+        """
+        started = time.perf_counter()
+        symbols = {}
+
+        fields = {'timeframe': array('h'), 'symbol': array('i'), 'open_time': array('q'),
+                  'high': array('d'), 'low': array('d'), 'quote_volume': array('d')}
+        for timeframe, symbol, (open_times, highs, lows, quote_volumes) in state['windows']:
+            count = len(open_times)
+            fields['timeframe'].extend(array('h', [timeframe]) * count)
+            fields['symbol'].extend(array('i', [symbols.setdefault(symbol, len(symbols))]) * count)
+            fields['open_time'].extend(open_times)
+            fields['high'].extend(highs)
+            fields['low'].extend(lows)
+            fields['quote_volume'].extend(quote_volumes)
+
+        parts = []
+        if fields['open_time']:
+            klines = np.empty(len(fields['open_time']), dtype=SNAPSHOT_KLINE_DTYPE)
+            for name, values in fields.items():
+                klines[name] = np.frombuffer(values, dtype=klines.dtype[name])
+            parts.append(klines)
+        if state['matrix'] is not None:
+            parts.append(self._matrix_klines(*state['matrix'], symbols))
+        klines = np.concatenate(parts) if parts else np.empty(0, dtype=SNAPSHOT_KLINE_DTYPE)
+
+        partials = np.array([(timeframe, symbols.setdefault(symbol, len(symbols)), *values)
+                             for timeframe, symbol, *values in state['partials']], dtype=SNAPSHOT_PARTIAL_DTYPE)
+
+        meta = {"version": SNAPSHOT_VERSION, "created": state['created'],
+                "timeframes": [timeframe.interval for timeframe in self.timeframes]}
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'wb') as file:
+            np.savez(file, meta=np.array(ujson.dumps(meta)), symbols=np.array(list(symbols), dtype=str),
+                     klines=klines, partials=partials)
+        os.replace(temporary_path, self.path)
+
+        self.snapshots += 1
+        self.last_size = os.path.getsize(self.path)
+        self.last_write_seconds = time.perf_counter() - started
+
+    @staticmethod
+    def _matrix_klines(data: np.ndarray, heads: np.ndarray, counts: np.ndarray, rows: Dict[str, int],
+                       symbols: dict) -> np.ndarray:
+        """
+        The klines of the rows of the kline matrix (see KlineMatrix) from the oldest of every row.
+        """
+        row_symbols = list(rows)
+        row_indexes = np.fromiter(rows.values(), dtype=np.int64, count=len(rows))
+        row_counts = counts[row_indexes]
+        total = int(row_counts.sum())
+
+        # position of every kline in its row, 0 - the oldest
+        positions = np.arange(total) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+        slots = (np.repeat(heads[row_indexes] - row_counts, row_counts) + positions) % data.shape[1]
+        values = data[np.repeat(row_indexes, row_counts), slots]
+
+        klines = np.empty(total, dtype=SNAPSHOT_KLINE_DTYPE)
+        klines['timeframe'] = 0
+        klines['symbol'] = np.repeat([symbols.setdefault(symbol, len(symbols)) for symbol in row_symbols],
+                                     row_counts)
+        klines['open_time'] = values[:, 0]
+        klines['high'] = values[:, 1]
+        klines['low'] = values[:, 2]
+        klines['quote_volume'] = values[:, 3]
+        return klines
+
+    async def take(self) -> None:
+        state = self.capture()
+        await asyncio.to_thread(self.write, state)
+        logger.debug(f"State snapshot: copied in {self.last_capture_seconds * 1000:.2f}ms, "
+                     f"written in {self.last_write_seconds * 1000:.1f}ms, {self.last_size} bytes")
+
+    async def run(self, interval: float) -> None:
+        """
+        Takes a snapshot every interval seconds.
+
+        Note:
+            - This function runs indefinitely in a loop.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.take()
+            except Exception as exp:
+                logger.error(f'State snapshot {exp}')
+
+    def restore(self, symbols: Iterable[str], capacity: int) -> Dict[str, int]:
+        """
+        Restores the state of the symbols from the snapshot, the 1m klines older than capacity minutes are skipped.
+        The windows and the partial candles of the higher timeframes are restored only for the symbols with
+        restored 1m klines, without the candles older than their window.
+
+        Returns:
+            the open time of the last restored 1m kline of every symbol
+        """
+        if not os.path.exists(self.path):
+            return {}
+
+        started = time.perf_counter()
+        try:
+            with np.load(self.path, allow_pickle=False) as snapshot:
+                meta = ujson.loads(str(snapshot['meta']))
+                snapshot_symbols = snapshot['symbols'].tolist()
+                klines = snapshot['klines']
+                partials = snapshot['partials']
+        except Exception as exp:
+            logger.error(f'Read state snapshot {exp}')
+            return {}
+
+        if meta.get('version') != SNAPSHOT_VERSION:
+            logger.warning(f"State snapshot version {meta.get('version')} is not supported")
+            return {}
+
+        # the timeframes of the snapshot that are still configured
+        timeframes = {index: timeframe for index, interval in enumerate(meta['timeframes'], start=1)
+                      for timeframe in self.timeframes if timeframe.interval == interval}
+        wanted = set(symbols)
+        now = int(time.time() * 1000)
+        oldest_open_time = now - (capacity + 1) * KLINE_INTERVAL_MS
+
+        last_open_times = {}
+        for _, symbol_index, open_time, high, low, quote_volume in klines[klines['timeframe'] == 0].tolist():
+            symbol = snapshot_symbols[symbol_index]
+            if symbol not in wanted or open_time < oldest_open_time:
+                continue
+            kline_data = {'s': symbol, 't': open_time, 'h': high, 'l': low, 'q': quote_volume}
+            if KLINE_MATRIX is not None:
+                KLINE_MATRIX.load(kline_data)
+            else:
+                window = loader.KLINES_DATA.get(symbol)
+                if window is None:
+                    window = loader.KLINES_DATA[symbol] = new_window()
+                window.append(kline_data)
+            last_open_times[symbol] = open_time
+
+        # the candles of the higher timeframes are built from the 1m klines: they are restored only for the
+        # symbols whose 1m klines are restored, so the backfill continues them without a gap
+        windows = {}
+        for timeframe_index, symbol_index, open_time, high, low, quote_volume \
+                in klines[klines['timeframe'] != 0].tolist():
+            symbol = snapshot_symbols[symbol_index]
+            timeframe = timeframes.get(timeframe_index)
+            if timeframe is None or symbol not in last_open_times:
+                continue
+            aggregator = timeframe.aggregator
+            if open_time < now - (aggregator.capacity + 1) * aggregator.duration:
+                continue
+            window = windows.get((timeframe_index, symbol))
+            if window is None:
+                window = windows[timeframe_index, symbol] = aggregator.windows[symbol] = \
+                    KlineWindow(aggregator.capacity)
+            window.append({'s': symbol, 't': open_time, 'h': high, 'l': low, 'q': quote_volume})
+
+        for timeframe_index, symbol_index, open_time, first_open_time, open_price, high, low, close, quote_volume, \
+                count in partials.tolist():
+            symbol = snapshot_symbols[symbol_index]
+            timeframe = timeframes.get(timeframe_index)
+            if timeframe is None or symbol not in last_open_times:
+                continue
+            # the partial candle of the period of the last restored 1m kline, the backfill adds the rest
+            last_open_time = last_open_times[symbol]
+            if open_time != last_open_time - last_open_time % timeframe.aggregator.duration:
+                continue
+            partial = PartialCandle(open_time, {'t': first_open_time, 'o': open_price, 'h': high, 'l': low, 'c': close,
+                                                'q': quote_volume})
+            partial.count = count
+            timeframe.aggregator.partials[symbol] = partial
+
+        KLINE_SEQUENCE.last_open_times.update(last_open_times)
+
+        self.restored_symbols = len(last_open_times)
+        self.restore_seconds = time.perf_counter() - started
+        logger.info(f"Restored {len(last_open_times)} symbols from the state snapshot of "
+                    f"{(time.time() * 1000 - meta['created']) / 1000:.0f}s ago in {self.restore_seconds:.3f}s")
+        return last_open_times
+
+
+def create_state_snapshots() -> Optional[StateSnapshots]:
+    if not settings.SNAPSHOT_FILE:
+        return None
+    if settings.DETECTOR_WORKERS != '0':
+        logger.warning("State snapshots are off with the detector workers: the windows live in the workers")
+        return None
+    return StateSnapshots(settings.SNAPSHOT_FILE, TIMEFRAMES)
+
+
+STATE_SNAPSHOTS = create_state_snapshots()
+
+if STATE_SNAPSHOTS is not None:
+    REGISTRY.collect('alert_server_snapshot_capture_seconds', 'Time the last state snapshot blocked the event loop',
+                     lambda: STATE_SNAPSHOTS.last_capture_seconds)
+    REGISTRY.collect('alert_server_snapshot_write_seconds', 'Time the last state snapshot was written in',
+                     lambda: STATE_SNAPSHOTS.last_write_seconds)
+    REGISTRY.collect('alert_server_snapshot_bytes', 'Size of the last state snapshot',
+                     lambda: STATE_SNAPSHOTS.last_size)
+    REGISTRY.collect('alert_server_snapshot_restore_seconds', 'Time the state was restored in at startup',
+                     lambda: STATE_SNAPSHOTS.restore_seconds)
+
+__all__ = ['StateSnapshots', 'STATE_SNAPSHOTS']
@@ -0,0 +1,52 @@
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict
+
+from utils.resources import RESOURCES
+
+
+class StartupProfile:
+    """
+    Where the startup time goes: the imports, every startup step and the creation of the shared resources.
+
+    The steps run concurrently, so their durations overlap and add up to more than the total. The import time
+    of single modules is reported by `python -X importtime app.py --profile-startup`.
+    """
+
+    def __init__(self):
+        self.imports_seconds = 0.0
+        self.steps: Dict[str, float] = {}
+        self.started = 0.0
+        self.total_seconds = 0.0
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def step(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name] = time.perf_counter() - started
+
+    async def measure(self, name: str, awaitable: Awaitable):
+        with self.step(name):
+            return await awaitable
+
+    def finish(self) -> None:
+        self.total_seconds = time.perf_counter() - self.started
+
+    def report(self) -> str:
+        lines = [f"Startup in {self.imports_seconds + self.total_seconds:.3f}s",
+                 f"  {'imports':<40} {self.imports_seconds:8.3f}s"]
+        lines.extend(f"  {name:<40} {seconds:8.3f}s"
+                     for name, seconds in sorted(self.steps.items(), key=lambda item: -item[1]))
+        lines.extend(f"  {'created ' + name:<40} {seconds:8.3f}s"
+                     for name, seconds in sorted(RESOURCES.created_seconds.items(), key=lambda item: -item[1]))
+        return '\n'.join(lines)
+
+
+STARTUP_PROFILE = StartupProfile()
+
+__all__ = ['StartupProfile', 'STARTUP_PROFILE']
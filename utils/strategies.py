@@ -0,0 +1,299 @@
+import time
+from typing import Callable, List, Optional
+
+import ujson
+from loguru import logger
+
+import settings
+from utils.alerts_cache import DEFAULT_STRATEGY, DEFAULT_TIMEFRAME, get_last_alert
+from utils.check_log import CHECK_LOG
+from utils.checks import (
+    WINDOW_RULES, CheckRecord, WindowRecord, default_params, get_sum_volume, passes_time_passed, window_record,
+)
+from utils.klines import KlineWindow
+from utils.metrics import REGISTRY
+
+# relative cost of the rules: cheaper rules run first until measured costs and pass rates are known
+RULE_COSTS = {
+    'sum_volume': 1,
+    'volume_multiple': 1,
+    'max_candle': 1,
+    'exceeds_min': 2,
+    'within_threshold': 2,
+    'time_passed': 5,
+}
+# the rules of a strategy are reordered by the measured cost / fail rate every REORDER_EVERY evaluations
+REORDER_EVERY = 10000
+# one evaluation of TIMING_EVERY measures the duration of every rule
+TIMING_EVERY = 64
+
+
+def time_passed_rule(record: WindowRecord, params: dict, last_alert) -> bool:
+    return passes_time_passed(last_alert, record.new_candle, params['time_passed'])
+
+
+class CompiledRule:
+    __slots__ = ('name', 'index', 'predicate', 'cost', 'evaluated', 'passed', 'timed', 'seconds')
+
+    def __init__(self, name: str, index: int, predicate: Callable):
+        self.name = name
+        # position of the result: 0-4 the window checks, 5 time passed
+        self.index = index
+        self.predicate = predicate
+        self.cost = RULE_COSTS[name]
+
+        # metrics
+        self.evaluated = 0
+        self.passed = 0
+        self.timed = 0
+        self.seconds = 0.0
+
+    @property
+    def pass_rate(self) -> float:
+        return self.passed / self.evaluated if self.evaluated else 0.0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.seconds / self.timed if self.timed else 0.0
+
+    def expected_cost(self) -> float:
+        """
+        Cost of the rule per rejected evaluation, the optimal order of independent rules is ascending by it.
+        """
+        cost = self.mean_seconds if self.timed else self.cost * 1e-7
+        return cost / max(1.0 - self.pass_rate, 1e-3)
+
+
+class Strategy:
+    """
+    Strategy compiled from the config: an ordered list of rules and the thresholds of every symbol.
+
+    Rules run from the cheapest to the most expensive and stop at the first failed one. The time passed
+    rule (№6) is the most expensive and runs last, with the cooldown of the strategy itself.
+    """
+
+    def __init__(self, name: str, params: dict, groups: Optional[List[dict]] = None,
+                 rules: Optional[List[str]] = None, symbols: Optional[List[str]] = None):
+        rules = rules or [name for name, _ in WINDOW_RULES] + ['time_passed']
+
+        unknown = set(params) - set(default_params())
+        unknown |= {key for group in groups or [] for key in group.get('params', {}) if key not in default_params()}
+        unknown |= set(rules) - set(RULE_COSTS)
+        if unknown:
+            raise ValueError(f"Strategy {name}: unknown params or rules {sorted(unknown)}")
+
+        self.name = name
+        self.params = {**default_params(), **params}
+        self.symbols = set(symbols) if symbols else None
+
+        # thresholds of the groups of symbols
+        self.group_params = {}
+        for group in groups or []:
+            for symbol in group['symbols']:
+                self.group_params.setdefault(symbol, {}).update(group.get('params', {}))
+        self._symbol_params = {}
+
+        self.rules = []
+        for index, (rule_name, predicate) in enumerate(WINDOW_RULES):
+            if rule_name in rules:
+                self.rules.append(CompiledRule(rule_name, index, predicate))
+        self.time_passed = CompiledRule('time_passed', len(WINDOW_RULES), time_passed_rule) \
+            if 'time_passed' in rules else None
+        # the rules that are not in the strategy pass
+        enabled = {rule.index for rule in self.rules}
+        self._initial_results = tuple(None if index in enabled else True for index in range(len(WINDOW_RULES)))
+        # name in the check records, None - the only strategy (the log lines stay as without strategies)
+        self.label = name
+        # timeframe of the windows, set by the engine, the cooldown is kept per strategy and timeframe
+        self.timeframe = DEFAULT_TIMEFRAME
+
+        self.order = sorted(self.rules, key=lambda rule: rule.cost)
+        self.evaluations = 0
+        self.alerts = 0
+
+    def params_for(self, symbol: str) -> dict:
+        params = self._symbol_params.get(symbol)
+        if params is None:
+            params = self._symbol_params[symbol] = {**self.params, **self.group_params.get(symbol, {})}
+        return params
+
+    def applies_to(self, symbol: str) -> bool:
+        return self.symbols is None or symbol in self.symbols
+
+    def evaluate(self, symbol: str, features: WindowRecord, window: KlineWindow) -> CheckRecord:
+        """
+        Runs the rules on the window features of the symbol until the first failed one.
+
+        Args:
+            symbol (str): The symbol.
+            features (WindowRecord): The window features shared by the strategies.
+            window (KlineWindow): The full kline window, for the sum volume near the threshold of the strategy.
+
+        Returns:
+            CheckRecord of the strategy, rules that did not run have None results
+        """
+        params = self.params_for(symbol)
+        results = list(self._initial_results)
+        record = WindowRecord(features.new_candle, features.penultimate_candle, features.average_volume,
+                              get_sum_volume(window, params['avg_increase']), features.min_price,
+                              features.max_in_min_price, (), params)
+
+        self.evaluations += 1
+        timed = self.evaluations % TIMING_EVERY == 0
+        passed = True
+        for rule in self.order:
+            if timed:
+                started = time.perf_counter()
+            passed = rule.predicate(record, params)
+            if timed:
+                rule.seconds += time.perf_counter() - started
+                rule.timed += 1
+
+            rule.evaluated += 1
+            results[rule.index] = passed
+            if not passed:
+                break
+            rule.passed += 1
+
+        record.results = tuple(results)
+
+        last_alert = get_last_alert(symbol, self.name, self.timeframe)
+        t_passed = None
+        if passed:
+            if self.time_passed is None:
+                t_passed = True
+            else:
+                t_passed = self._run_time_passed(record, params, last_alert, timed)
+
+        if self.evaluations % REORDER_EVERY == 0:
+            self.reorder()
+
+        check_record = CheckRecord(symbol, record, t_passed, last_alert, self.label)
+        if t_passed:
+            self.alerts += 1
+        return check_record
+
+    def _run_time_passed(self, record: WindowRecord, params: dict, last_alert, timed: bool) -> bool:
+        rule = self.time_passed
+        if timed:
+            started = time.perf_counter()
+        passed = rule.predicate(record, params, last_alert)
+        if timed:
+            rule.seconds += time.perf_counter() - started
+            rule.timed += 1
+
+        rule.evaluated += 1
+        rule.passed += passed
+        return passed
+
+    def reorder(self) -> None:
+        order = sorted(self.rules, key=CompiledRule.expected_cost)
+        if order != self.order:
+            self.order = order
+            logger.info(f"Strategy {self.name} rules order: {[rule.name for rule in order]}")
+
+    def stats(self) -> dict:
+        rules = self.order + ([self.time_passed] if self.time_passed else [])
+        return {
+            "evaluations": self.evaluations,
+            "alerts": self.alerts,
+            "rules": {rule.name: {"evaluated": rule.evaluated, "pass_rate": rule.pass_rate,
+                                  "mean_us": rule.mean_seconds * 1e6} for rule in rules},
+        }
+
+
+class StrategyEngine:
+    """
+    Runs all the strategies on every full window: the window features (average and sum volume, min price...)
+    are taken from the window statistics once and shared by all the strategies, which only compare them
+    with their thresholds.
+    """
+
+    def __init__(self, strategies: List[Strategy], timeframe: Optional[str] = None):
+        if not strategies:
+            raise ValueError("No strategies configured")
+        self.strategies = strategies
+        # None - the 1m windows, otherwise the windows of a higher timeframe (see utils.timeframes)
+        self.timeframe = timeframe
+        for strategy in strategies:
+            strategy.timeframe = timeframe or DEFAULT_TIMEFRAME
+            if timeframe:
+                strategy.label = f"{strategy.name}@{timeframe}"
+            elif len(strategies) == 1:
+                strategy.label = None
+            self._register_metrics(strategy, strategy.timeframe)
+
+    @classmethod
+    def from_config(cls, path: str, timeframe: Optional[str] = None) -> 'StrategyEngine':
+        """
+        Compiles the strategies from the JSON config (see strategies.example.json),
+        without a config - the default strategy with the thresholds from the settings.
+
+        The vector engine and the detector workers check only the default strategy, a config with them
+        fails at startup instead of being ignored.
+        """
+        if not path:
+            return cls([Strategy(DEFAULT_STRATEGY, {})], timeframe)
+
+        if timeframe is None and (settings.CHECK_ENGINE != 'scalar' or settings.DETECTOR_WORKERS != '0'):
+            raise ValueError("Strategies run only on the scalar check engine in the main process, "
+                             "unset STRATEGIES_FILE or set CHECK_ENGINE=scalar and DETECTOR_WORKERS=0")
+
+        with open(path, encoding='utf-8') as file:
+            config = ujson.load(file)
+
+        strategies = [Strategy(strategy['name'], strategy.get('params', {}), strategy.get('groups'),
+                               strategy.get('rules'), strategy.get('symbols'))
+                      for strategy in config['strategies']]
+        logger.info(f"Strategies{f' {timeframe}' if timeframe else ''}: {[strategy.name for strategy in strategies]}")
+        return cls(strategies, timeframe)
+
+    def evaluate(self, symbol: str, window: KlineWindow) -> List[str]:
+        """
+        Runs the strategies on the full window of the symbol and writes their check records.
+
+        Returns:
+            names of the strategies that alerted
+        """
+        features = window_record(window)
+        alerted = []
+        for strategy in self.strategies:
+            if not strategy.applies_to(symbol):
+                continue
+            record = strategy.evaluate(symbol, features, window)
+            result = bool(record.time_passed)
+            CHECK_LOG.write(record, result)
+            if result:
+                alerted.append(strategy.name)
+        return alerted
+
+    def stats(self) -> dict:
+        return {strategy.label or strategy.name: strategy.stats() for strategy in self.strategies}
+
+    @staticmethod
+    def _register_metrics(strategy: Strategy, timeframe: str) -> None:
+        rules = strategy.rules + ([strategy.time_passed] if strategy.time_passed else [])
+        for rule in rules:
+            labels = f'strategy="{strategy.name}",timeframe="{timeframe}",rule="{rule.name}"'
+            REGISTRY.collect('alert_server_rule_evaluations_total', 'Evaluations of the strategy rules',
+                             lambda rule=rule: rule.evaluated, kind='counter', labels=labels)
+            REGISTRY.collect('alert_server_rule_passed_total', 'Passed evaluations of the strategy rules',
+                             lambda rule=rule: rule.passed, kind='counter', labels=labels)
+            REGISTRY.collect('alert_server_rule_mean_seconds', 'Mean duration of the strategy rules (sampled)',
+                             lambda rule=rule: rule.mean_seconds, labels=labels)
+
+
+STRATEGY_ENGINE = StrategyEngine.from_config(settings.STRATEGIES_FILE)
+
+
+async def all_checks(symbol: str, candle: KlineWindow) -> List[str]:
+    """
+    Runs all the strategies on the full kline window of the symbol.
+
+    Returns:
+        names of the strategies that alerted (empty - no alert)
+    """
+    return STRATEGY_ENGINE.evaluate(symbol, candle)
+
+
+__all__ = ['Strategy', 'StrategyEngine', 'STRATEGY_ENGINE', 'all_checks']
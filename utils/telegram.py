@@ -1,16 +1,172 @@
+import asyncio
+import time
+from typing import Optional
+
 import httpx
 from loguru import logger
 
 import settings
+from utils.metrics import REGISTRY, TELEGRAM_SEND_SECONDS
+
 
+DEFAULT_RETRY_AFTER = 1  # In seconds
 
-async def send_alert(symbol):
+
+def get_retry_after(response: httpx.Response) -> float:
+    """
+    Seconds to wait after a 429: 'retry_after' of the JSON body, the Retry-After header if the body is not
+    the API's JSON (e.g. a page of a proxy), DEFAULT_RETRY_AFTER otherwise.
+    """
+    try:
+        return float(response.json()['parameters']['retry_after'])
+    except (ValueError, TypeError, KeyError):
+        pass
     try:
-        async with httpx.AsyncClient() as client:
-            url = f"https://api.telegram.org/bot{settings.TOKEN_MAIN_BOT}/sendMessage"
-            params = {"chat_id": settings.GROUP_ID, "text": symbol}
-            response = await client.get(url, params=params)
-            if response.status_code != 200:
-                logger.error(f'Status code: {response.status_code}')
-    except Exception as exp:
-        logger.error(f"Error in send alert to telegram - {exp}")
+        return float(response.headers['Retry-After'])
+    except (ValueError, KeyError):
+        return DEFAULT_RETRY_AFTER
+
+
+class TelegramDispatcher:
+    """
+    Sends messages to the Telegram group through one long-lived, connection-pooled client.
+
+    Messages are put on a bounded queue and sent by the dispatcher task, which:
+        - coalesces messages with the same key (alerts of the same minute) into one message;
+        - keeps at most messages_per_minute messages per chat and waits on 429 'retry_after'.
+    """
+
+    def __init__(self, base_url: str, token: str, chat_id: int, queue_size: int,
+                 messages_per_minute: int, coalesce_delay: float, max_retries: int = 3):
+        self.base_url = base_url
+        self.token = token
+        self.chat_id = chat_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.min_interval = 60 / messages_per_minute
+        self.coalesce_delay = coalesce_delay
+        self.max_retries = max_retries
+        self.client = None
+        self._next_send_time = 0.0
+
+        # metrics
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    def notify(self, text: str, key: Optional[object] = None) -> None:
+        """
+        Puts the message on the queue. Messages with the same key that are queued together are sent as one.
+        """
+        try:
+            self.queue.put_nowait((key, text))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.error(f"Telegram queue is full, message dropped: {text}")
+
+    async def run(self) -> None:
+        """
+        Sends messages from the queue until cancelled.
+        """
+        logger.info("Telegram dispatcher started!")
+        while True:
+            batch = [await self.queue.get()]
+
+            # give alerts of the same minute a moment to arrive
+            await asyncio.sleep(self.coalesce_delay)
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            for text in self._coalesce(batch):
+                await self.send(text)
+
+    def _coalesce(self, batch: list) -> list:
+        messages = {}
+        for index, (key, text) in enumerate(batch):
+            messages.setdefault(index if key is None else key, []).append(text)
+
+        self.coalesced += len(batch) - len(messages)
+        return ["\n".join(texts) for texts in messages.values()]
+
+    async def send(self, text: str) -> bool:
+        """
+        Sends the message right away, respecting the rate limit of the chat.
+        """
+        client = self._get_client()
+        for _ in range(self.max_retries + 1):
+            delay = self._next_send_time - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_send_time = time.monotonic() + self.min_interval
+
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"/bot{self.token}/sendMessage",
+                                             data={"chat_id": self.chat_id, "text": text})
+            except Exception as exp:
+                logger.error(f"Error in send alert to telegram - {exp}")
+                return False
+            finally:
+                TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started)
+
+            if response.status_code == 200:
+                self.sent += 1
+                return True
+
+            if response.status_code == 429:
+                self.rate_limited += 1
+                retry_after = get_retry_after(response)
+                logger.warning(f"Telegram rate limit, retry after {retry_after}s")
+                self._next_send_time = time.monotonic() + retry_after
+                continue
+
+            logger.error(f'Status code: {response.status_code}')
+            return False
+
+        logger.error(f"Telegram message not sent after {self.max_retries} retries: {text}")
+        return False
+
+    async def close(self) -> None:
+        """
+        Sends the messages that are still in the queue and closes the client.
+        """
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        for text in self._coalesce(batch):
+            await self.send(text)
+
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(base_url=self.base_url, timeout=10)
+        return self.client
+
+
+TELEGRAM_DISPATCHER = TelegramDispatcher(
+    base_url=settings.TG_API_URL,
+    token=settings.TOKEN_MAIN_BOT,
+    chat_id=settings.GROUP_ID,
+    queue_size=settings.TG_QUEUE_SIZE,
+    messages_per_minute=settings.TG_MESSAGES_PER_MINUTE,
+    coalesce_delay=settings.TG_COALESCE_DELAY,
+)
+
+REGISTRY.collect('alert_server_telegram_queue_depth', 'Telegram messages waiting to be sent',
+                 lambda: TELEGRAM_DISPATCHER.queue.qsize())
+REGISTRY.collect('alert_server_telegram_sent_total', 'Telegram messages sent',
+                 lambda: TELEGRAM_DISPATCHER.sent, kind='counter')
+REGISTRY.collect('alert_server_telegram_dropped_total', 'Telegram messages dropped on a full queue',
+                 lambda: TELEGRAM_DISPATCHER.dropped, kind='counter')
+REGISTRY.collect('alert_server_telegram_rate_limited_total', 'Telegram 429 responses',
+                 lambda: TELEGRAM_DISPATCHER.rate_limited, kind='counter')
+
+
+async def send_alert(text, key=None):
+    TELEGRAM_DISPATCHER.notify(str(text), key)
+
+
+__all__ = ['TelegramDispatcher', 'TELEGRAM_DISPATCHER', 'send_alert']
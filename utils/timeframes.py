@@ -0,0 +1,162 @@
+from typing import List
+
+import settings
+from utils.klines import KlineWindow
+from utils.metrics import REGISTRY
+from utils.strategies import StrategyEngine
+
+KLINE_INTERVAL_MS = 60_000
+INTERVAL_UNITS = {'m': 1, 'h': 60, 'd': 1440}
+
+
+def interval_minutes(interval: str) -> int:
+    """
+    Converts an interval of the exchange ('5m', '1h', '1d') to minutes.
+    """
+    minutes = int(interval[:-1]) * INTERVAL_UNITS[interval[-1]]
+    if minutes <= 1 or (1440 % minutes and minutes % 1440):
+        raise ValueError(f"Timeframe {interval} is not a multiple of 1m aligned to the day")
+    return minutes
+
+
+class PartialCandle:
+    __slots__ = ('open_time', 'first_open_time', 'open', 'high', 'low', 'close', 'quote_volume', 'count')
+
+    def __init__(self, open_time: int, kline_data: dict):
+        self.open_time = open_time
+        # open time of the first 1m kline, the period open time if the start of the period was not missed
+        self.first_open_time = int(kline_data['t'])
+        self.open = float(kline_data['o'])
+        self.high = float(kline_data['h'])
+        self.low = float(kline_data['l'])
+        self.close = float(kline_data['c'])
+        self.quote_volume = float(kline_data['q'])
+        self.count = 1
+
+    def update(self, kline_data: dict) -> None:
+        high = float(kline_data['h'])
+        low = float(kline_data['l'])
+        if high > self.high:
+            self.high = high
+        if low < self.low:
+            self.low = low
+        self.close = float(kline_data['c'])
+        self.quote_volume += float(kline_data['q'])
+        self.count += 1
+
+    def to_kline(self, symbol: str, interval: str) -> dict:
+        """
+        The closed candle in the format of the 'k' object of the kline stream event.
+        """
+        return {"t": self.open_time, "s": symbol, "i": interval, "x": True, "n": self.count,
+                "o": self.open, "h": self.high, "l": self.low, "c": self.close, "q": self.quote_volume}
+
+
+class CandleAggregator:
+    """
+    Builds the candles of one higher timeframe from the closed 1m klines and keeps their windows.
+
+    Every symbol has one partial candle and one kline window of the timeframe, so the memory is bounded by
+    symbols x (window capacity + 1) and every 1m kline costs O(1). A candle closes with the last 1m kline of
+    its period, or, if that kline is missing, with the first kline of the next period.
+
+    Only the complete candles go to the windows: a period that misses 1m klines (the first period after the
+    start, a gap in the stream, a partial candle of a restore) would lower the volumes and the extremes of the
+    window for the next periods, so it is dropped and counted. A period is complete if it starts with the 1m
+    kline of the period open and has all its 1m klines (they come in order and once, see KlineSequence).
+    """
+
+    def __init__(self, interval: str, capacity: int):
+        self.interval = interval
+        self.duration = interval_minutes(interval) * KLINE_INTERVAL_MS
+        self.klines_per_candle = interval_minutes(interval)
+        self.capacity = capacity
+        self.partials = {}
+        self.windows = {}
+
+        # metrics
+        self.closed = 0
+        self.incomplete = 0
+
+    def add(self, kline_data: dict) -> List[KlineWindow]:
+        """
+        Adds the closed 1m kline to the partial candle of its symbol.
+
+        Returns:
+            the window of the symbol if a complete candle of the timeframe closed (empty list otherwise)
+        """
+        symbol = kline_data['s']
+        open_time = int(kline_data['t'])
+        period_open_time = open_time - open_time % self.duration
+
+        closed = []
+        partial = self.partials.get(symbol)
+        if partial is not None and partial.open_time != period_open_time:
+            # the last klines of the previous period are missing
+            closed.extend(self._close(symbol, partial))
+            partial = None
+
+        if partial is None:
+            partial = self.partials[symbol] = PartialCandle(period_open_time, kline_data)
+        else:
+            partial.update(kline_data)
+
+        if open_time + KLINE_INTERVAL_MS == period_open_time + self.duration:
+            closed.extend(self._close(symbol, partial))
+        return closed
+
+    def _close(self, symbol: str, partial: PartialCandle) -> List[KlineWindow]:
+        del self.partials[symbol]
+        if partial.count < self.klines_per_candle or partial.first_open_time != partial.open_time:
+            self.incomplete += 1
+            return []
+
+        window = self.windows.get(symbol)
+        if window is None:
+            window = self.windows[symbol] = KlineWindow(self.capacity)
+        window.append(partial.to_kline(symbol, self.interval))
+        self.closed += 1
+        return [window]
+
+    def forget(self, symbol: str) -> None:
+        self.partials.pop(symbol, None)
+        self.windows.pop(symbol, None)
+
+
+class Timeframe:
+    """
+    Higher timeframe: the aggregator of its candles and the strategies that run when they close.
+    """
+
+    def __init__(self, interval: str, capacity: int, strategies_file: str):
+        self.interval = interval
+        self.aggregator = CandleAggregator(interval, capacity)
+        self.engine = StrategyEngine.from_config(strategies_file, interval)
+
+        labels = f'timeframe="{interval}"'
+        REGISTRY.collect('alert_server_timeframe_candles_total', 'Candles of the higher timeframes closed',
+                         lambda: self.aggregator.closed, kind='counter', labels=labels)
+        REGISTRY.collect('alert_server_timeframe_incomplete_total',
+                         'Candles of the higher timeframes dropped for missing 1m klines',
+                         lambda: self.aggregator.incomplete, kind='counter', labels=labels)
+
+    def add(self, kline_data: dict) -> List[tuple]:
+        """
+        Adds the closed 1m kline and runs the strategies on the windows of the candles that closed.
+
+        Returns:
+            list of (open time of the candle, names of the strategies that alerted)
+        """
+        alerts = []
+        for window in self.aggregator.add(kline_data):
+            if window.is_full():
+                strategies = self.engine.evaluate(kline_data['s'], window)
+                if strategies:
+                    alerts.append((window[-1].open_time, strategies))
+        return alerts
+
+
+TIMEFRAMES = [Timeframe(interval.strip(), settings.MAXIMUM_KLINES, settings.STRATEGIES_FILE)
+              for interval in settings.TIMEFRAMES.split(',') if interval.strip()]
+
+__all__ = ['CandleAggregator', 'Timeframe', 'TIMEFRAMES', 'interval_minutes']
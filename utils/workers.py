@@ -0,0 +1,283 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+import zlib
+from typing import Optional
+
+from loguru import logger
+
+import settings
+from utils.checks import check_window
+from utils.klines import KlineWindow
+from utils.metrics import REGISTRY
+
+# fields of a kline that the workers need
+KLINE_FIELDS = ('s', 't', 'h', 'l', 'q')
+# the last message of a worker, (STOPPED, worker_id)
+STOPPED = 'stopped'
+RESULTS_POLL_INTERVAL = 0.5  # In seconds
+STOP_TIMEOUT = 5  # In seconds
+
+
+def detector_worker(inbox, outbox, worker_id: int, capacity: int) -> None:
+    """
+    Worker process: keeps the kline windows of its symbols and runs the window checks (№1-5).
+
+    Reads lists of closed klines from the inbox and, for every list, puts
+    (worker_id, batch_id, sent_at, klines count, candidates) to the outbox,
+    where candidates are (symbol, new kline, WindowRecord) of the windows that passed the checks.
+    A ('forget', symbols) message drops the windows of the symbols, None stops the worker,
+    which answers with (STOPPED, worker_id).
+    """
+    windows = {}
+    while True:
+        message = inbox.get()
+        if message is None:
+            outbox.put((STOPPED, worker_id))
+            break
+
+        if message[0] == 'forget':
+            for symbol in message[1]:
+                windows.pop(symbol, None)
+            continue
+
+        batch_id, sent_at, klines = message
+        candidates = []
+        for kline_data in klines:
+            symbol = kline_data['s']
+            window = windows.get(symbol)
+            if window is None:
+                window = windows[symbol] = KlineWindow(capacity)
+            window.append(kline_data)
+
+            if window.is_full():
+                result, log = check_window(window)
+                if result:
+                    candidates.append((symbol, window[-1], log))
+
+        outbox.put((worker_id, batch_id, sent_at, len(klines), candidates))
+
+
+def get_workers_count(value: str) -> int:
+    """
+    Parses the DETECTOR_WORKERS setting: 'auto' - one worker per CPU, a number - that many workers, 0 - disabled.
+    """
+    if value == 'auto':
+        return os.cpu_count() or 1
+    return int(value)
+
+
+class DetectorPool:
+    """
+    Runs the window checks in worker processes sharded by symbol.
+
+    Closed klines are routed by a stable hash of the symbol, so every worker owns the windows of its
+    symbols. The klines of one stream batch are sent to every worker as one message, and the candidates
+    come back over a single result queue to the main process, which runs the rest of the alert path.
+
+    The result queue is read with a timeout, so a reader never blocks on a worker that died: the batches in
+    flight of a dead worker are written off. The stop answers of the workers are the sentinels that end
+    results(): on stop the reader is not cancelled (a cancelled read would still take a message off the queue
+    and lose it), it reads until every worker has answered, so no result is lost and no worker is left
+    blocked on a full pipe.
+    """
+
+    def __init__(self, workers_count: int, capacity: int):
+        self.workers_count = workers_count
+        self.capacity = capacity
+        self.processes = []
+        self.inboxes = []
+        self.outbox = None
+        self._pending = [[] for _ in range(workers_count)]
+        self._batch_id = 0
+        # workers that answered the stop or died
+        self._stopped = set()
+        self.stopping = False
+        # results() is running, it reads the queue until the workers stopped
+        self.reading = False
+
+        # metrics
+        self.routed = 0
+        self.in_flight_by_worker = [0] * workers_count
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self) -> None:
+        # spawn: the main process runs websocket threads, forking it is not safe
+        context = multiprocessing.get_context('spawn')
+        self.outbox = context.Queue()
+
+        for worker_id in range(self.workers_count):
+            inbox = context.Queue()
+            process = context.Process(target=detector_worker, args=(inbox, self.outbox, worker_id, self.capacity),
+                                      name=f'detector-{worker_id}', daemon=True)
+            process.start()
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+
+        logger.info(f"Detector pool started with {self.workers_count} workers")
+
+    async def stop(self) -> list:
+        """
+        Stops the workers: every worker gets the stop message and the result queue is read until all of them
+        answered (or died), by the running results() or, without it, here. Then the workers are joined.
+
+        Returns:
+            the candidates that were still in flight when no results() was running
+        """
+        self.stopping = True
+        for inbox in self.inboxes:
+            inbox.put(None)
+
+        loop = asyncio.get_running_loop()
+        candidates = []
+        deadline = time.monotonic() + STOP_TIMEOUT
+        while not self.finished and time.monotonic() < deadline:
+            if self.reading:
+                # the reader gets the last results and ends with the stop answers
+                await asyncio.sleep(RESULTS_POLL_INTERVAL / 10)
+                continue
+
+            message = await loop.run_in_executor(None, self._read)
+            if message is None:
+                self._check_workers()
+            else:
+                candidates.extend(self._handle(message))
+
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                logger.error(f"Detector worker {process.name} did not stop, terminated")
+                process.terminate()
+        # the stop messages of the terminated workers are never read
+        for inbox in self.inboxes:
+            inbox.cancel_join_thread()
+        return candidates
+
+    @property
+    def finished(self) -> bool:
+        return len(self._stopped) == self.workers_count
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self.in_flight_by_worker)
+
+    def _read(self):
+        """
+        The next message of the result queue or None if there is none for RESULTS_POLL_INTERVAL, runs in a thread.
+        """
+        try:
+            return self.outbox.get(timeout=RESULTS_POLL_INTERVAL)
+        except queue.Empty:
+            return None
+
+    def _handle(self, message: tuple) -> list:
+        """
+        Accounts the message of a worker and returns its candidates.
+        """
+        if message[0] == STOPPED:
+            self._stopped.add(message[1])
+            return []
+
+        worker_id, _, sent_at, _, candidates = message
+        self.in_flight_by_worker[worker_id] -= 1
+        self.last_latency = time.perf_counter() - sent_at
+        self.max_latency = max(self.max_latency, self.last_latency)
+        return candidates
+
+    def _check_workers(self) -> None:
+        """
+        Writes off the batches in flight of the workers that died.
+        """
+        for worker_id, process in enumerate(self.processes):
+            if worker_id not in self._stopped and not process.is_alive():
+                if not self.stopping:
+                    logger.error(f"Detector worker {process.name} died with exit code {process.exitcode}, "
+                                 f"{self.in_flight_by_worker[worker_id]} batches lost")
+                self._stopped.add(worker_id)
+                self.in_flight_by_worker[worker_id] = 0
+
+    def worker_of(self, symbol: str) -> int:
+        return zlib.crc32(symbol.encode()) % self.workers_count
+
+    def submit(self, kline_data: dict) -> None:
+        """
+        Adds the closed kline to the pending batch of the worker that owns its symbol.
+        """
+        self._pending[self.worker_of(kline_data['s'])].append({field: kline_data[field] for field in KLINE_FIELDS})
+
+    def flush(self) -> None:
+        """
+        Sends the pending klines to the workers, one message per worker.
+        """
+        sent_at = time.perf_counter()
+        for worker_id, klines in enumerate(self._pending):
+            if klines:
+                self._batch_id += 1
+                self.inboxes[worker_id].put((self._batch_id, sent_at, klines))
+                self.routed += len(klines)
+                self.in_flight_by_worker[worker_id] += 1
+                self._pending[worker_id] = []
+
+    def forget(self, symbols: list) -> None:
+        """
+        Drops the windows of the symbols in the workers that own them.
+        """
+        by_worker = {}
+        for symbol in symbols:
+            by_worker.setdefault(self.worker_of(symbol), []).append(symbol)
+        for worker_id, worker_symbols in by_worker.items():
+            self.inboxes[worker_id].put(('forget', worker_symbols))
+
+    async def results(self):
+        """
+        Yields (symbol, new kline, WindowRecord) of the candidates found by the workers, until all of them stopped.
+        """
+        loop = asyncio.get_running_loop()
+        self.reading = True
+        try:
+            while not self.finished:
+                message = await loop.run_in_executor(None, self._read)
+                if message is None:
+                    self._check_workers()
+                    continue
+
+                for candidate in self._handle(message):
+                    yield candidate
+        finally:
+            self.reading = False
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers_count,
+            "routed": self.routed,
+            "in_flight": self.in_flight,
+            "last_latency": self.last_latency,
+            "max_latency": self.max_latency,
+        }
+
+
+DETECTOR_POOL: Optional[DetectorPool] = None
+
+
+def start_detector_pool() -> Optional[DetectorPool]:
+    """
+    Starts the detector pool if DETECTOR_WORKERS is enabled.
+    """
+    global DETECTOR_POOL  # pylint: disable=global-statement
+
+    workers_count = get_workers_count(settings.DETECTOR_WORKERS)
+    if workers_count > 0:
+        DETECTOR_POOL = DetectorPool(workers_count, settings.MAXIMUM_KLINES)
+        DETECTOR_POOL.start()
+    return DETECTOR_POOL
+
+
+REGISTRY.collect('alert_server_detector_in_flight', 'Kline batches sent to the detector workers and not answered yet',
+                 lambda: DETECTOR_POOL.in_flight if DETECTOR_POOL is not None else 0)
+REGISTRY.collect('alert_server_detector_latency_seconds', 'Round trip of the last kline batch to a detector worker',
+                 lambda: DETECTOR_POOL.last_latency if DETECTOR_POOL is not None else 0)
+
+__all__ = ['DetectorPool', 'DETECTOR_POOL', 'start_detector_pool', 'detector_worker']